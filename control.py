@@ -468,10 +468,8 @@ control_structure = {
     },
     "export": [
         {
-            "format": "J",
-            "cvariables": [
-                "identifier", "year", "site_type_category", "land_use_category", "soil_peatland_category"
-            ],
+            # the report_collectives values in a table, handed over to the data pipeline in memory (see metsi_driver.py)
+            "format": "opt_table",
             "xvariables": [
                 "identifier",
                 "area",
@@ -674,6 +672,14 @@ control_structure = {
     ]
 }
 
+# The same table in a Parquet file, e.g., for convert_to_opt.py when metsi is run on its own.
+# The data pipeline writes it with all the stands of the real estate, the cached ones included (see simulation_cache.py)
+control_structure['export'].append({
+    "format": "opt_parquet",
+    "filename": "data.parquet",
+    "xvariables": next(decl for decl in control_structure['export'] if decl["format"] == "opt_table")["xvariables"]
+})
+
 # The preprocessing export format is added as an external module
 control_structure['export_prepro'] = csv_and_json
 
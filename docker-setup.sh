@@ -10,7 +10,10 @@ pip install poetry
 
 # Patch metsi so that our scripts work
 cp metsi-patch/rm_timber.py metsi/lukefi/metsi/app/export_handlers/
+cp metsi-patch/opt_table.py metsi/lukefi/metsi/app/export_handlers/
 cp metsi-patch/smk_util.py metsi/lukefi/metsi/data/formats/smk_util.py
+# register the export formats of opt_table.py with metsi's exporter, so the metsi CLI knows them too
+cat metsi-patch/export_formats.py >> metsi/lukefi/metsi/app/export.py
 # Install patched metsi
 cd metsi #UTOPIA/metsi
 pip install .
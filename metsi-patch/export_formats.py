@@ -0,0 +1,24 @@
+
+# The export formats of opt_table.py, registered with metsi's own exporter. setup.sh appends this file to
+# lukefi/metsi/app/export.py, so the metsi CLI writes the opt_parquet export from the same control file as the data
+# pipeline. The opt_table export is only handed over in memory when metsi is run by the data pipeline (see
+# pipeline/metsi_driver.py), so the CLI skips it.
+from pathlib import Path as _Path
+
+from lukefi.metsi.app.console_logging import print_logline as _print_logline
+from lukefi.metsi.app.export_handlers.opt_table import opt_parquet as _opt_parquet
+from lukefi.metsi.app.utils import MetsiException as _MetsiException
+
+_metsi_export_files = export_files
+
+
+def export_files(config, decl: list[dict], data):
+    """Write the export files declared in the control, the opt_parquet and opt_table formats included"""
+    _metsi_export_files(config, [d for d in decl if d.get('format') not in ('opt_parquet', 'opt_table')], data)
+    for d in decl:
+        if d.get('format') == 'opt_parquet':
+            if not d.get('xvariables'):
+                raise _MetsiException("The opt_parquet export needs its xvariables when metsi is run on its own")
+            _opt_parquet(_Path(config.target_directory, d.get('filename', 'data.parquet')), data, d['xvariables'])
+        elif d.get('format') == 'opt_table':
+            _print_logline("Skipping the opt_table export, it is only handed over to the data pipeline in memory")
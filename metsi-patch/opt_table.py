@@ -0,0 +1,46 @@
+from pathlib import Path
+import numpy as np
+import polars as pl
+from lukefi.metsi.app.app_types import SimResults
+from lukefi.metsi.sim.core_types import CollectedData
+
+
+def collective_value(value) -> float:
+    """Reduce a report_collectives value to a number. The value of an expression that selects several values (or none)
+    from the collected data is their sum (or 0)."""
+    if value is None:
+        return 0.0
+    return float(np.sum(np.asarray(value, dtype=np.float64)))
+
+
+def collect_row_for_schedule(derived_data: CollectedData, xvariables: list[str]) -> list[float]:
+    """Create the row of a single schedule from the collectives reported at its last time point"""
+    reports = derived_data.get('report_collectives')
+    if not reports:
+        return [0.0] * len(xvariables)
+    collectives = reports[max(reports)]
+    return [collective_value(collectives.get(variable)) for variable in xvariables]
+
+
+def opt_table(data: SimResults, xvariables: list[str]) -> pl.DataFrame:
+    """
+    Collect the report_collectives values of all schedules of all stands into a table, in the same row and column
+    order as the xda file of the J export, without formatting them as text.
+
+    :param data: SimResults package
+    :param xvariables: the names of the collectives, the first two are the stand identifier and area
+    :return: DataFrame with a row for each schedule and a Float64 column for each collective, the identifier as Int64
+    """
+    columns = [[] for _ in xvariables]
+    for payload in data.values():
+        for schedule_derived_data in map(lambda x: x.collected_data, payload):
+            for column, value in zip(columns, collect_row_for_schedule(schedule_derived_data, xvariables)):
+                column.append(value)
+    table = pl.DataFrame({variable: pl.Series(variable, column, dtype=pl.Float64)
+                          for variable, column in zip(xvariables, columns)})
+    return table.with_columns(pl.nth(0).cast(pl.Int64, strict=True))
+
+
+def opt_parquet(filepath: Path, data: SimResults, xvariables: list[str]):
+    """Produce a Parquet file of the report_collectives values of all schedules and stands (see opt_table)"""
+    opt_table(data, xvariables).write_parquet(filepath)
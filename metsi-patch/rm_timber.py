@@ -1,10 +1,13 @@
 from pathlib import Path
 from collections import defaultdict
+from collections.abc import Iterable, Iterator
 from lukefi.metsi.app.app_types import SimResults
-from lukefi.metsi.app.file_io import row_writer
 from lukefi.metsi.domain.collected_types import CrossCutResult
 from lukefi.metsi.sim.core_types import CollectedData
 
+# the size of the write buffer of the output files, the rows are written as they are generated
+WRITE_BUFFER_SIZE = 1024 * 1024
+
 
 def scan_operation_type_for_event(year: int, cross_cut: list[CrossCutResult]) -> str:
     val = next(filter(lambda r: r.time_point == year and r.source == "harvested", cross_cut)).operation
@@ -99,36 +102,38 @@ def collect_timber_data_for_year(
     return retval
 
 
-def prepare_schedules_file_content(data: SimResults, data_source: str) -> list[str]:
+def generate_schedules_file_content(data: SimResults, data_source: str) -> Iterator[str]:
     """
-    Create the content rows for Reijo Mykkänen output files for all stands divided into schedules and state/node/event
-    years within.
+    Generate the content rows for Reijo Mykkänen output files for all stands divided into schedules and state/node/event
+    years within. The rows are generated one schedule at a time, so the content of all stands is never in memory at
+    once.
 
     :param data: SimResults package
     :param data_source: "trees" for standing/harvested tree variables content, 
                         "timber" for standing/harvested timber volume content
-    :return: list of strings representing file rows
+    :return: iterator of strings representing file rows
     """
-    output_rows = []
     for stand_id, payload in data.items():
         header = str(stand_id)
         # schedule_rows = [f"Stand {stand_id} Area {payload[0].computational_unit.area}"]
         for schedule_number, schedule_derived_data in enumerate(map(lambda x: x.collected_data, payload)):
             # rows = [f"Schedule {schedule_number}"]
-            prepared = collect_rows_for_events(schedule_derived_data, data_source, str(stand_id), str(schedule_number))
-            output_rows.extend(prepared)
-            output_rows.append("")
-        output_rows.append("")
-    return output_rows
+            yield from collect_rows_for_events(schedule_derived_data, data_source, str(stand_id), str(schedule_number))
+            yield ""
+        yield ""
+
+
+def stream_row_writer(filepath: Path, rows: Iterable[str]):
+    """Write the rows into the file as they are generated, one row per line as row_writer does, through a buffer"""
+    with open(filepath, 'w', newline='\n', encoding='utf-8', buffering=WRITE_BUFFER_SIZE) as file:
+        file.writelines(f"{row}\n" for row in rows)
 
 
 def rm_schedules_events_timber(filepath: Path, data: SimResults):
     """Produce output file collecting state and event year timber volumes for all schedules and stands"""
-    content = prepare_schedules_file_content(data, "timber")
-    row_writer(filepath, content)
+    stream_row_writer(filepath, generate_schedules_file_content(data, "timber"))
 
 
 def rm_schedules_events_trees(filepath: Path, data: SimResults):
     """Produce output file collecting state and event year tree parameters for all schedules and stands"""
-    content = prepare_schedules_file_content(data, "trees")
-    row_writer(filepath, content)
+    stream_row_writer(filepath, generate_schedules_file_content(data, "trees"))
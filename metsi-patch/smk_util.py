@@ -4,6 +4,7 @@ from types import SimpleNamespace
 from xml.etree.ElementTree import Element
 
 import geopandas
+import numpy as np
 from shapely.geometry import Polygon, Point
 from lukefi.metsi.data.formats import util
 from lukefi.metsi.data.model import TreeStratum
@@ -192,13 +193,22 @@ def parse_forest_management_category(source: str | None) -> int | float | None:
         return 1
 
 
-def point_series(value: str) -> list[tuple[float, float]]:
-    """ Converts a gml string presentation to a list of (x, y) points"""
-    series = []
-    for xy_point in value.split(' '):
-        point = xy_point.split(',')
-        series.append((float(point[0]), float(point[1])))
-    return series
+def parse_gml_coordinates(value: str) -> np.ndarray:
+    """ Converts the text of a gml:coordinates element ("x,y x,y ...") to an (n, 2) float64 array of (x, y) points.
+
+    The whole string is converted with a single NumPy call, so this is also used by the UTOPIA data pipeline for the
+    stand polygons.
+
+    Raises ValueError if the text has something else than numbers or an odd number of them. """
+    numbers = value.replace(',', ' ').split()
+    if len(numbers) % 2 != 0:
+        raise ValueError(f"Odd number of coordinates in gml:coordinates: {value!r}")
+    return np.array(numbers, dtype=np.float64).reshape(-1, 2)
+
+
+def point_series(value: str) -> np.ndarray:
+    """ Converts a gml string presentation to an (n, 2) array of (x, y) points"""
+    return parse_gml_coordinates(value)
 
 
 def parse_centroid(sns: SimpleNamespace) -> tuple[float, float, str]:
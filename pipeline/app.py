@@ -1,9 +1,17 @@
 from fastapi import FastAPI
-from routers import english, finnish
+from routers import english, finnish, maps
+from upstream import get_metrics
 
 app = FastAPI(
     title="User and forest data interface",
 )
 
 app.include_router(english.router)
-app.include_router(finnish.router)
\ No newline at end of file
+app.include_router(finnish.router)
+app.include_router(maps.router)
+
+
+@app.get("/metrics")
+def metrics():
+    """Retry counts, failures and latencies of this worker's calls to Maanmittauslaitos and Metsäkeskus APIs."""
+    return get_metrics()
@@ -1,10 +1,15 @@
 '''
 convert_to_opt.py
 
-This script converts the data.xda file into alternatives.csv and alternatives_key.csv.
+This script converts the data.xda file into alternatives.parquet and alternatives_key.csv.
 Basically just what the R script did, but in Python.
 
-Therefore, it is assumed that the "data.xda" file is inside the target directory.
+Therefore, it is assumed that the "data.xda" file is inside the target directory,
+unless the same data is given as a table (the opt_table export of metsi, see metsi_driver.py)
+or the "data.parquet" file (the opt_parquet export) is there instead.
+The data pipeline hands the table over in memory, and writes "data.parquet" with all the stands
+only if the opt_parquet export is in the control file (as it is in the shipped control files).
+The alternatives are written into a columnar file, so only the needed columns are read, see read_alternatives.
 '''
 
 import os
@@ -202,19 +207,53 @@ data_names = [
 class ConversionException(Exception):
 	'''Exception for when conversion fails'''
 
+def read_alternatives(data_dir: str, columns: list[str] | None = None) -> pl.DataFrame:
+	'''
+	Read the alternatives of a directory, only the given columns (or all of them).
+	They are read from the memory mapped alternatives.parquet if it is there,
+	otherwise from alternatives.csv (written by the earlier versions and the R script).
+	The unit is a float either way, since that's how the CSV has always been read.
+	'''
+	if os.path.exists(f"{data_dir}/alternatives.parquet"):
+		df = pl.read_parquet(f"{data_dir}/alternatives.parquet", columns=columns, memory_map=True)
+	else:
+		df = pl.read_csv(
+				f"{data_dir}/alternatives.csv",
+				columns=columns,
+				schema_overrides={"unit": pl.Float64},
+				infer_schema_length=10000
+			)
+	if "unit" in df.columns:
+		df = df.with_columns(pl.col("unit").cast(pl.Float64))
+	return df
+
 # Export this function out
-def convert_to_opt(data_dir: str, usernum: int):
+def convert_to_opt(data_dir: str, usernum: int, table: pl.DataFrame | None = None):
 
-	# Make sure the necessary data exists
-	if not os.path.exists(f"{data_dir}/data.xda"):
-		raise ConversionException(f"There's no \"data.xda\" in {data_dir}.")
-	# Read the CSV in
-	df = pl.read_csv(
-			f"{data_dir}/data.xda", 
-			separator='\t', 
-			has_header=False, 
-			infer_schema=False
-		).with_columns(
+	# The opt_parquet export, memory mapped and only the columns used here
+	if table is None and os.path.exists(f"{data_dir}/data.parquet"):
+		table = pl.read_parquet(
+				f"{data_dir}/data.parquet",
+				columns=list(range(len(data_names))),
+				memory_map=True
+			)
+	# The data is given in memory, no need to read it from the file
+	if table is None:
+		# Make sure the necessary data exists
+		if not os.path.exists(f"{data_dir}/data.xda"):
+			raise ConversionException(
+				f"There's no \"data.parquet\" or \"data.xda\" in {data_dir}. "
+				"The data pipeline hands the metsi results over in memory, so add the opt_parquet export "
+				"to the control file to write them for this script."
+			)
+		# Read the CSV in
+		table = pl.read_csv(
+				f"{data_dir}/data.xda", 
+				separator='\t', 
+				has_header=False, 
+				infer_schema=False
+			)
+	df = table.with_columns(
 			# First cast all columns from 1 to 183 to pl Float
 			pl.nth(range(1,184)).cast(
 				pl.Float64,
@@ -236,8 +275,8 @@ def convert_to_opt(data_dir: str, usernum: int):
 	# Multiply columns 2 to 184 with the area column. (that is every value that's not the area of the stand and the stand identifier)
 	df = df.with_columns((pl.nth(range(2,184)) * pl.nth(1))) 
 	
-	# Name the columns
-	df = df.rename(lambda column_name: data_names[int(column_name.split("_")[1])-1])
+	# Name the columns (by their position, the columns of a table are named by metsi's variables)
+	df = df.rename(dict(zip(df.columns, data_names)))
 
 	# Init the dataframe for filtering out the zero-profit treatments besides the first one
 	df_filtered = df.schema.to_frame()
@@ -347,7 +386,7 @@ def convert_to_opt(data_dir: str, usernum: int):
 	# Output
 	alt_key_csv.write_csv(f"{data_dir}/alternatives_key.csv", separator=',')
 
-	# Construct the alternatives.csv
+	# Construct the alternatives
 	alt_csv = pl.concat([
 		holdings.to_frame(),
 		df_filtered.select(pl.col("identifier")).rename({"identifier": "unit"}),
@@ -367,7 +406,8 @@ def convert_to_opt(data_dir: str, usernum: int):
 	# Output
 	# Again, might or might not help with write speed
 	alt_csv = alt_csv.rechunk()
-	alt_csv.write_csv(f"{data_dir}/alternatives.csv", separator=',')	
+	# A columnar file, so the columns can be read without parsing the whole table
+	alt_csv.write_parquet(f"{data_dir}/alternatives.parquet")
 		
 
 
@@ -381,5 +421,8 @@ if __name__ == "__main__":
 	parser.add_argument("-d", dest="dir", help="Target directory")
 	args = parser.parse_args(args=None if sys.argv[1:] else ["--help"])
 	
-	# Hop to the conversion function
-	convert_to_opt(args.dir, 1)
+	# Hop to the conversion function, failing with the message only
+	try:
+		convert_to_opt(args.dir, 1)
+	except ConversionException as e:
+		sys.exit(f"Error: {e}")
@@ -12,7 +12,7 @@ The scipt also runs metsi and to be able to do that, there are the following req
 TODO: check these (atleast the control.yaml location can be given as argument to metsi so
 it can be made an argument for this script as well)
 
-1. metsi has to be installed so it can be called from command line as 'metsi'
+1. metsi has to be installed, it is run in the same process through metsi_driver.py
 
 2. 'data' directory from metsi has to be found in the same directory as this script
     (has information about prices etc.) (or where the script is run?)
@@ -32,6 +32,9 @@ The scipt takes four arguments:
 -k: Path to a (text) file with the API key for Maanmittauslaitos API. The file format does not matter as long as the
     file's content is just the API key and can be read in python.
 
+--invalidate: Instead of running the pipeline, remove the cached Maanmittauslaitos polygons of the real estates given
+    with -i. The polygons are otherwise cached (see disk_cache.py) so that repeated runs skip the API call.
+
 An example call:
 
     python data_pipeline.py -i 111-2-34-56 999-888-7777-6666 -d path/to/target/directory -n Lastname -k path/to/api/key/key.txt
@@ -44,10 +47,8 @@ The polygons will then be filtered to get rid of any neighboring forest stands t
 Metsäkeskus API. This is done by creating a buffer around the polygon from Maanmittauslaitos
 and then looping through all the stands from Metsäkeskus to see if their polygon is completely inside
 the buffered polygon of the estate. The stands that are not completely inside will be removed.
-This is visualised by drawing an image of the different polygons that showcases which
-stands are inside the blue bufferzone and which are outside (drawn in black) with red color representing the
-original polygon of the (part of the) holding and green color indicating stands that are determined to
-be inside of the bufferzone.
+The remaining stands can be seen on a map image that is drawn on demand from the GeoJSON of the holdings
+(see stand_map.py), so no images are drawn while the pipeline runs.
 
 The script will create a directory named 'Lastname' into the directory 'path/to/target/directory'.
 Into this created directory the script then creates a directory for each real estate, in this case,
@@ -62,11 +63,15 @@ NOTE: Solved (kinda) by modifying the updated metsi installation so that it writ
 """
 
 import argparse
+import gzip
 import json
+import multiprocessing
+import os
 import sys
 import shutil
-import subprocess
 from sys import platform
+from concurrent.futures import FIRST_EXCEPTION, Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
 from xml.etree import ElementTree as ET
 
@@ -74,36 +79,70 @@ from convert_to_opt import convert_to_opt
 from write_trees_json import write_trees_json
 from write_carbon_json import write_carbon_json
 from utopia_problem import utopia_problem
-from metsi_driver import run_metsi
+import metsi_driver
+from metsi_driver import MetsiError, run_metsi
+from disk_cache import DiskCache
+from forest_data import ForestData, get_stand_rings
+from map_encoding import decode_stand_map, encode_stand_map
+from simulation_cache import lookup_results, read_results, simulation_fingerprint, store_results, write_results
+from stand_store import StandStore
+from upstream import (
+    MML_URL,
+    METSAKESKUS_URL,
+    RetryableError,
+    UpstreamError,
+    fetch_all,
+    request,
+    stand_query_key,
+)
 
 from desdeo.api.db import get_session
 from desdeo.api.models import ProblemDB, ProblemMetaDataDB, ForestProblemMetaData
 from desdeo.api.routers.user_authentication import get_user, verify_password
 
-import geopandas as gpd
-import matplotlib.pyplot as plt
+import numpy as np
+import polars as pl
 import requests
+import shapely
 import shapely.geometry as geom
-
-# the namespace used in metsi
-NS = {
-    "schema_location": "http://standardit.tapio.fi/schemas/forestData ForestData.xsd",
-    "xsi": "http://www.w3.org/2001/XMLSchema-instance",
-    "xlink": "http://www.w3.org/1999/xlink",
-    "gml": "http://www.opengis.net/gml",
-    "gdt": "http://standardit.tapio.fi/schemas/forestData/common/geometricDataTypes",
-    "co": "http://standardit.tapio.fi/schemas/forestData/common",
-    "sf": "http://standardit.tapio.fi/schemas/forestData/specialFeature",
-    "op": "http://standardit.tapio.fi/schemas/forestData/operation",
-    "dts": "http://standardit.tapio.fi/schemas/forestData/deadTreeStrata",
-    "tss": "http://standardit.tapio.fi/schemas/forestData/treeStandSummary",
-    "tst": "http://standardit.tapio.fi/schemas/forestData/treeStratum",
-    "ts": "http://standardit.tapio.fi/schemas/forestData/treeStand",
-    "st": "http://standardit.tapio.fi/schemas/forestData/Stand",
-    "ci": "http://standardit.tapio.fi/schemas/forestData/contactInformation",
-    "re": "http://standardit.tapio.fi/schemas/forestData/realEstate",
-    "default": "http://standardit.tapio.fi/schemas/forestData"
-}
+from shapely.ops import unary_union
+
+# the real estate polygons from Maanmittauslaitos rarely change, so they are cached by the long form real estate id
+estate_cache = DiskCache(
+    "estates",
+    ttl=float(os.environ.get("ESTATE_CACHE_TTL", 30 * 24 * 60 * 60)),
+    max_bytes=int(os.environ.get("ESTATE_CACHE_SIZE", 64 * 1024 * 1024)),
+)
+# the forest data from Metsäkeskus is cached (compressed) by the polygon it was asked with
+stand_cache = DiskCache(
+    "stands",
+    ttl=float(os.environ.get("STAND_CACHE_TTL", 7 * 24 * 60 * 60)),
+    max_bytes=int(os.environ.get("STAND_CACHE_SIZE", 1024 * 1024 * 1024)),
+)
+
+# if set, the parts of a real estate that are at most this many meters apart are fetched with a single query
+MERGE_DISTANCE = float(os.environ["MERGE_PARTS_DISTANCE"]) if os.environ.get("MERGE_PARTS_DISTANCE") else None
+
+# the version of the forest data standard asked from Metsäkeskus
+STD_VERSION = "MV1.9"
+# the responses of Metsäkeskus API when there are no stands inside the polygon or the API is overloaded
+NO_STANDS_FOUND = "MV-kuvioita ei löytynyt.".encode()
+GATEWAY_TIMEOUT = b"504 Gateway Time-out"
+# the error payloads are detected from this many first bytes of a response
+PREFIX_SIZE = 4096
+# the size of the chunks a response is streamed to disk in
+CHUNK_SIZE = 64 * 1024
+# how many stands are filtered at once when streaming the forest data
+BATCH_SIZE = 1024
+# if set to 1, the forest data of each real estate is also written into output.xml in the real estate's directory
+DEBUG_XML = os.environ.get("PIPELINE_DEBUG_XML", "") == "1"
+# if set, the forest data is read from a local stand database (see stand_store.py) instead of Metsäkeskus API
+STAND_DATABASE = os.environ.get("STAND_DATABASE")
+stand_store = StandStore(STAND_DATABASE) if STAND_DATABASE else None
+# how many real estates of an owner are simulated and converted at the same time, each in its own process
+ESTATE_WORKERS = int(os.environ.get("ESTATE_WORKERS", "4"))
+
+_estate_pool: ProcessPoolExecutor | None = None
 
 
 class PipelineError(Exception):
@@ -158,6 +197,49 @@ def coordinates_to_polygon(coordinate_pairs: list) -> str:
     return polygon[:-2] + "))"  # replace the last ", " with "))"
 
 
+def plan_queries(coordinates: list, merge_distance: float | None = None) -> list[tuple[list, list[int]]]:
+    """Plan the polygons to query Metsäkeskus API with for the different parts of the real estates.
+
+    Without a merge distance, every part is queried with its own polygon. With a merge distance, the parts that are
+    at most merge_distance apart are clustered together and each cluster is queried with a single polygon that covers
+    all of its parts: the outline of the parts buffered by half of the merge distance (which is connected by
+    construction). This cuts the number of calls for real estates with many small nearby parts.
+
+    Args:
+        coordinates (list): A list of lists of coordinates. Different parts of the real estates as different lists.
+        merge_distance (float | None, optional): The maximum distance in meters between the parts that are queried
+            together. Defaults to None (no merging).
+
+    Returns:
+        list[tuple[list, list[int]]]: A list of the queries as (query polygon, the indices of the parts covered by
+            the query) tuples.
+    """
+    if merge_distance is None or len(coordinates) < 2:
+        return [(coordinates[i], [i]) for i in range(len(coordinates))]
+
+    parts = [geom.Polygon(part) for part in coordinates]
+    # the buffered parts that are close enough to each other melt into one polygon, i.e., a cluster
+    merged = unary_union([part.buffer(merge_distance / 2) for part in parts])
+    clusters = list(merged.geoms) if isinstance(merged, geom.MultiPolygon) else [merged]
+
+    queries = []
+    for cluster in clusters:
+        members = [i for i in range(len(parts)) if cluster.intersects(parts[i])]
+        if len(members) == 1:
+            # a part with no other parts nearby is queried as is
+            queries.append((coordinates[members[0]], members))
+        else:
+            # keep the query polygon small by dropping the vertices that the buffering adds to the corners, with a
+            # tolerance below the buffer so the outline stays outside of the parts, but the unsimplified outline is
+            # used if the simplified one does not cover all of them
+            outline = cluster.exterior.simplify(min(1.0, merge_distance / 4))
+            polygon = geom.Polygon(outline)
+            if not polygon.is_valid or not polygon.covers(unary_union([parts[i] for i in members])):
+                outline = cluster.exterior
+            queries.append(([list(point) for point in outline.coords], members))
+    return queries
+
+
 def get_real_estate_coordinates(realestateid: str, api_key: str) -> list:
     """Get the real estate polygon that matches the given real estate id from Maanmittauslaitos.
 
@@ -168,8 +250,16 @@ def get_real_estate_coordinates(realestateid: str, api_key: str) -> list:
     Returns:
         list: A list of the coordinates from Maanmittauslaitos for the given real estate ID.
     """
-    r = requests.get(f"https://avoin-paikkatieto.maanmittauslaitos.fi/kiinteisto-avoin/simple-features/v3/collections/PalstanSijaintitiedot/items?kiinteistotunnus={realestateid}",
-                     params={"api-key": api_key, "crs": "http://www.opengis.net/def/crs/EPSG/0/3067"})
+    # if the polygon of the real estate has been fetched recently, skip the API call
+    cached = estate_cache.get(realestateid)
+    if cached is not None:
+        return json.loads(cached)
+
+    try:
+        r = request("GET", MML_URL, hedge=True, params={"kiinteistotunnus": realestateid, "api-key": api_key,
+                                                        "crs": "http://www.opengis.net/def/crs/EPSG/0/3067"})
+    except UpstreamError as e:
+        raise PipelineError(f"Error connecting to Maanmittauslaitos API: {e}") from e
 
     # get the data into a dict
     estate_data = json.loads(r.content)
@@ -184,379 +274,424 @@ def get_real_estate_coordinates(realestateid: str, api_key: str) -> list:
     for feature in features:
         coordinates.append(feature["geometry"]["coordinates"][0])
 
+    estate_cache.put(realestateid, json.dumps(coordinates).encode())
     return coordinates
 
 
-def write_real_estate_xmls(coordinates: list, realestateid: str, realestate_dir: str) -> tuple[list[str], list]:
+def stream_stand_data(response: requests.Response, path: str) -> bool:
+    """Stream the forest data from a Metsäkeskus API response into a gzip compressed file.
+
+    The error payloads of Metsäkeskus API are short, so they are detected from a bounded prefix of the response body
+    without holding the whole response in memory. The file is written under a temporary name and moved in place when
+    complete.
+
+    Args:
+        response (requests.Response): The (streamed) response of Metsäkeskus API.
+        path (str): The path of the compressed XML file to write.
+
+    Raises:
+        RetryableError: If the response is a 504 Gateway Time-out page (which may come with status 200), so that the
+            request is retried.
+
+    Returns:
+        bool: True if the forest data was written, False if no stands were found with the polygon.
+    """
+    # closing the response releases the connection back to the pool, even if the body is not read to the end
+    with response:
+        chunks = response.iter_content(chunk_size=CHUNK_SIZE)
+        # read the bounded prefix
+        prefix = b""
+        for chunk in chunks:
+            prefix = prefix + chunk
+            if len(prefix) >= PREFIX_SIZE:
+                break
+
+        if GATEWAY_TIMEOUT in prefix:
+            raise RetryableError("504 Gateway Time-out")
+        if NO_STANDS_FOUND in prefix:
+            return False
+
+        tmp = f"{path}.part"
+        with gzip.open(tmp, "wb", compresslevel=5) as file:
+            file.write(prefix)
+            for chunk in chunks:
+                file.write(chunk)
+    os.replace(tmp, path)
+    return True
+
+
+def write_real_estate_xmls(
+    coordinates: list, realestateids: list[str], xml_dir: str, merge_distance: float | None = MERGE_DISTANCE
+) -> tuple[list[str], list[list[int]]]:
     """Get the forest data from Metsäkeskus with a list of coordinates and write the data into XML files.
 
+    The parts of all the real estates of the owner are queried together, so that nearby parts of adjacent real estates
+    can share a query. Each query (see plan_queries) gets its own XML file. Without merging, there is one query per
+    part. If STAND_DATABASE is set, the queries are answered from the local stand database instead (see
+    stand_store.py).
+
     Args:
-        coordinates (list): A list of lists of coordinates. Different parts of the real estate as different lists.
-        realestateid (str): The real estate ID. Used only for the error messages.
-        realestate_dir (str): A directory to store the forest data XMLs in.
+        coordinates (list): A list of lists of coordinates. Different parts of the real estates as different lists.
+        realestateids (list[str]): The real estate ID of each part. Used only for the error messages.
+        xml_dir (str): A directory to store the forest data XMLs in.
+        merge_distance (float | None, optional): The maximum distance in meters between the parts that are queried
+            together. Defaults to MERGE_PARTS_DISTANCE environment variable, or no merging if it is not set.
 
     Returns:
-        tuple[list[str], list]: A list of possible error messages and a new coordinates list.
-            If a polygon does not match any stands in Metsäkeskus' database the coordinates will be removed
-            and an error message is added to indicate that there were some polygons that had no data in
-            Metsäkeskus database for the real estate.
+        tuple[list[str], list[list[int]]]: A list of possible error messages and, for each XML file, the indices of
+            the parts whose forest data is in the file. The forest data is written into gzip compressed files
+            output_<number>.xml.gz. If a polygon does not match any stands in Metsäkeskus' database, no file is
+            written for it and an error message is added to indicate that there were some polygons that had no data
+            in Metsäkeskus database for the real estate.
     """
     error_messages = []
-    # a copy of the original coordinate list to modify is necessary
-    coordinates_copy = coordinates.copy()
-    # the number of the current part of the estate (each part has its own XML file)
-    number = 1
-    # loop through the different parts of the estate
-    for i in range(len(coordinates)):
-        # get the polygon in the correct form to call Metsäkeskus API
-        polygon = coordinates_to_polygon(coordinates[i])
+    # the parts of each query that has forest data in Metsäkeskus' database
+    files = []
+    queries = plan_queries(coordinates, merge_distance)
+
+    def fetch_part(i: int) -> bool:
+        # the forest data of each query is first written into a file named by the query
+        path = f"{xml_dir}/query_{i+1}.xml.gz"
+        part = queries[i][0]
+
+        # the local stand database answers the query as Metsäkeskus API would, there is nothing to cache
+        if stand_store is not None:
+            return stand_store.write_xml(part, path)
 
-        # call Metsäkeskus API to get the forest data for the polygon
-        req = requests.post("https://avoin.metsakeskus.fi/rest/mvrest/FRStandData/v1/ByPolygon",
-                            data={"wktPolygon": polygon, "stdVersion": "MV1.9"})
-        xml = req.content
+        # if the same polygon has been asked recently, copy the cached (compressed) forest data
+        key = stand_query_key(part, STD_VERSION)
+        if stand_cache.copy_to(key, path):
+            return True
 
+        # get the polygon in the correct form to call Metsäkeskus API
+        polygon = coordinates_to_polygon(part)
+
+        # call Metsäkeskus API to get the forest data for the polygon and stream it into the file
+        # the query only reads data, so it is safe to retry and hedge
+        try:
+            found = request("POST", METSAKESKUS_URL, handle=lambda response: stream_stand_data(response, path),
+                            hedge=True, stream=True, headers={"Accept-Encoding": "gzip"},
+                            data={"wktPolygon": polygon, "stdVersion": STD_VERSION})
+        except UpstreamError as e:
+            raise PipelineError(f"Error connecting to Metsäkeskus API: {e}") from e
+
+        # only actual forest data ends up in the cache
+        if found:
+            stand_cache.put_file(key, path)
+        return found
+
+    # fetch the forest data of all the queries concurrently
+    found = fetch_all(fetch_part, range(len(queries)))
+
+    # the number of the current query (each query with forest data has its own XML file)
+    number = 1
+    # loop through the different queries
+    for i in range(len(queries)):
         # if no stands are found with the polygon
-        if "MV-kuvioita ei löytynyt." in xml.decode():
+        if not found[i]:
             # add an error message stating that for a polygon, no forest data was found
+            estates = ", ".join(dict.fromkeys(realestateids[j] for j in queries[i][1]))
             error_messages.append(
-                f"NOTE: No forest found for a polygon from estate {realestateid}.")
+                f"NOTE: No forest found for a polygon from estate {estates}.")
 
-            # remove the polygon from the list of coordinates
-            coordinates_copy.pop(i)
+            # leave the polygon out of the files
             continue
 
-        if "504 Gateway Time-out" in xml.decode():
-            raise PipelineError(
-                "Error connecting to Metsäkeskus API: 504 Gateway Time-out")
-
-        # write the forest data into an XML file
-        if platform == "win32":
-            with Path.open(f"{realestate_dir}/output_{number}.xml", "wb") as file:
-                file.write(xml)
-        if platform == "linux":
-            with Path(f"{realestate_dir}/output_{number}.xml").open(mode="wb") as file:
-                file.write(xml)
+        # number the (compressed) XML files of the queries with forest data
+        os.replace(f"{xml_dir}/query_{i+1}.xml.gz", f"{xml_dir}/output_{number}.xml.gz")
 
+        files.append(queries[i][1])
         # raise the number for the next loop
         number = number + 1
-    return error_messages, coordinates_copy
+    return error_messages, files
 
 
-def get_polygon_dict(root: ET.Element) -> dict[str, dict[str, tuple[float, float] | list[tuple[float, float]]]]:
-    """Get a dict of the stands' polygons from a given ElementTree.
+def assign_stands(
+    polygons: np.ndarray, tree: shapely.STRtree, part_estates: np.ndarray, buffers: np.ndarray, areas: np.ndarray
+) -> np.ndarray:
+    """Assign a batch of stands to the real estates whose buffer zones contain them.
+
+    The stands are decided on all at once with Shapely's array predicates. The STRtree of the buffered parts narrows
+    down the candidate real estates of each stand, so only the candidates' (prepared) buffer zones are tested.
 
     Args:
-        root (ET.Element): Element with the polygons.
+        polygons (np.ndarray): The polygons of the stands.
+        tree (shapely.STRtree): An STRtree of the buffered parts of the real estates.
+        part_estates (np.ndarray): For each part in the tree, the index of its real estate in buffers and areas.
+        buffers (np.ndarray): The buffered area of each real estate.
+        areas (np.ndarray): The area of each real estate.
 
     Returns:
-        dict[str, dict[str, tuple[float, float] | list[tuple[float, float]]]]: A dict with stand IDs as keys and
-            a dict with the exterior and interior polygons as values.
+        np.ndarray: For each stand, the index of its real estate in buffers and areas, or -1 if the stand does not
+            belong to any of the real estates.
     """
-    orig_polygons = {}
-    # loop through the children of the root
-    for child in root:
-        if child.tag == "{http://standardit.tapio.fi/schemas/forestData/Stand}Stands":
-            # loop through the stands
-            for stand in child:
-                if stand.tag == "{http://standardit.tapio.fi/schemas/forestData/Stand}Stand":
-                    # store the stand ID
-                    stand_id = stand.attrib["id"]
-                    exterior_and_interior = {}
-                    # find the exterior polygon for the stand
-                    for exterior in stand.iter("{http://www.opengis.net/gml}exterior"):
-                        for linear_ring in exterior.iter("{http://www.opengis.net/gml}LinearRing"):
-                            for ring in linear_ring:
-                                coordinates = ring.text.split(" ")
-                                coordinate_pairs = []
-                                for coordinate in coordinates:
-                                    coordinate_pairs.append(
-                                        (float(coordinate.split(",")[0]), float(coordinate.split(",")[1])))
-                    exterior_and_interior["exterior"] = coordinate_pairs
-                    coordinate_pairs = []
-                    # if exists, find the interior polygon (a hole in the stand)
-                    interiors = []
-                    for interior in stand.iter("{http://www.opengis.net/gml}interior"):
-                        for linear_ring in interior.iter("{http://www.opengis.net/gml}LinearRing"):
-                            for ring in linear_ring:
-                                coordinates = ring.text.split(" ")
-                                for coordinate in coordinates:
-                                    coordinate_pairs.append(
-                                        (float(coordinate.split(",")[0]), float(coordinate.split(",")[1])))
-                        interiors.append(coordinate_pairs)
-                    exterior_and_interior["interior"] = interiors
-                    orig_polygons[stand_id] = exterior_and_interior
-    return orig_polygons
-
-
-def fix_prefixes(element: ET.Element | ET.ElementTree, namespaces: dict[str, str]):
-    """A helper function to help write the final XML file in the correct format.
+    # the real estates with a buffered part that intersects with a stand are the candidates for the stand
+    stand_indices, part_indices = tree.query(polygons, predicate="intersects")
+    contained = np.zeros((len(buffers), len(polygons)), dtype=bool)
+    contained[part_estates[part_indices], stand_indices] = True
+
+    # a candidate real estate gets the stand only if the stand is inside the real estate's buffer zone
+    for k in range(len(buffers)):
+        candidates = np.flatnonzero(contained[k])
+        contained[k, candidates] = shapely.contains(buffers[k], polygons[candidates])
+
+    # a stand inside the buffer zones of more than one real estate goes to the real estate that covers the most of it
+    scores = np.where(contained, 0.0, -1.0)
+    shared = np.flatnonzero(contained.sum(axis=0) > 1)
+    for k in range(len(buffers)):
+        shared_k = shared[contained[k, shared]]
+        scores[k, shared_k] = shapely.area(shapely.intersection(areas[k], polygons[shared_k]))
+
+    # argmax picks the first real estate on a tie, so the assignment does not depend on anything but the order of
+    # the IDs
+    return np.where(contained.any(axis=0), scores.argmax(axis=0), -1)
+
+
+def remove_neighboring_stands(
+    coordinates: list, estates: list[int], files: list[list[int]], xml_dir: str, realestate_dirs: list[str]
+) -> tuple[list[str], list[ForestData]]:
+    """Index the stands of all the real estates of the owner and remove the stands that do not belong to any of them.
+
+    This is done by creating a buffer around each real estate's polygons and removing any stands that are not
+    contained inside any of the buffer zones. Every stand is assigned to exactly one real estate: a stand inside the
+    buffer zones of more than one real estate (e.g., on the border of two adjacent real estates) goes to the real
+    estate that covers the most of it (see assign_stands). The buffer zones and the areas are those of all the parts
+    of all the real estates, whichever queries the parts were fetched with, so the assignment of a stand does not
+    depend on the query (or the XML file) that returned it. A stand returned by more than one query (e.g., by the
+    queries of two adjacent parts) is decided on only once.
+
+    The XML files are streamed: the stands are decided on in batches of BATCH_SIZE as they are read, and only the
+    kept stands are held in memory, in the forest data of their real estate. The forest data is passed on to the
+    later stages as is, so the XML does not need to be written and parsed again.
 
     Args:
-        element (ET.Element | ET.ElementTree): Element or ElementTree to add the namespaces to.
-        namespaces (dict[str, str]): The namespaces.
-    """
-    # Add the namespace to each element if needed
-    for child in element:
-        fix_prefixes(child, namespaces)
-
-    if element.tag.startswith("{"):
-        # Extract the namespace part from the tag
-        namespace = element.tag.split("}")[0][1:]
-        prefix = ""
-        for key, value in namespaces.items():
-            if namespace == value:
-                # place the correct prefix for the namespace
-                prefix = key
-        element.tag = f"{prefix}:{element.tag.split('}')[1]}"
-
-
-def remove_neighboring_stands(coordinates: list, realestate_dir: str, plot: bool = False) -> list[str]:
-    """Identify and remove stands from Metsäkeskus data that do not belong to the real estate.
-
-    This is done by creating a buffer around the real estate's polygon and removing any stands that are not
-    contained inside the buffer zone.
-
-    Args:
-        coordinates (list): List of lists of coordinates. Length equals to number of separate parts of the real estate.
-        realestate_dir (str): The directory in which the real estate's data is stored.
-        plot (bool, optional): Whether to plot an image of the real estate. Defaults to False.
+        coordinates (list): A list of lists of coordinates. The parts of all the real estates as different lists.
+        estates (list[int]): For each part, the index of its real estate in realestate_dirs.
+        files (list[list[int]]): For each XML file in xml_dir, the indices of the parts whose forest data is in the
+            file (as returned by write_real_estate_xmls).
+        xml_dir (str): The directory in which the fetched XML files are stored.
+        realestate_dirs (list[str]): The directories in which the real estates' data is stored.
 
     Returns:
-        list[str]: list of the removed stands' IDs.
+        tuple[list[str], list[ForestData]]: A list of the removed stands' IDs and the forest data of each real estate.
     """
-    # loop through the different parts of the real estate
-    if len(coordinates) == 0:
+    if len(files) == 0:
         raise PipelineError(
             "There are no coordinates to use to get XML data! Are you sure the real estate ID is correct?")
 
-    for i in range(len(coordinates)):
-        # read the XML into an ElementTree
-        tree = ET.parse(f"{realestate_dir}/output_{i+1}.xml")
-        root = tree.getroot()
-
-        # the target polygon is the original polygon from Maanmittauslaitos
-        # when multiple holdings, go through this in a loop?
-        target = geom.Polygon(coordinates[i])
-
-        # set the buffer distance
-        buffer_distance = 10
-
-        # a list of the original polygons fetched from Metsäkeskus
-        orig_polygons = get_polygon_dict(root)
-
-        # create a list of shapely Polygons from the list of original polygons
-        polygons = []
-        for key, value in orig_polygons.items():
-            if len(value["interior"]) > 0:
-                # if there are holes in the stand, the interior will indicate it
-                polygons.append(
-                    (key, geom.Polygon(value["exterior"], holes=value["interior"])))
-            else:
-                # if no interior for the stand, there are no holes
-                polygons.append((key, geom.Polygon(value["exterior"])))
-
-        # create a GeoPandas GeoDataFrame with the shapely polygons
-        gdf_polygons = gpd.GeoDataFrame(
-            {"stand_id": [p[0] for p in polygons], "geometry": [p[1] for p in polygons]})
-
-        # create a GeoDataFrame for the target (holding) polygon
-        gdf_target = gpd.GeoDataFrame(geometry=[target])
-
-        # buffer the target polygon
-        buffer = gdf_target.buffer(buffer_distance).iloc[0]
-
-        removed = []  # for plotting purposes
-        removed_ids = []
-
-        # add the neighboring stands into a list to be removed and drop them from the GeoDataFrame
-        for index, stand in gdf_polygons.iterrows():
-            if not buffer.contains(stand.geometry):
-                removed.append(stand)  # for plotting purposes
-                removed_ids.append(stand.stand_id)
-                gdf_polygons = gdf_polygons.drop(
-                    index)  # also for plotting purposes
-
-        # loop through the ElementTree
-        for child in root:
-            if child.tag == "{http://standardit.tapio.fi/schemas/forestData/Stand}Stands":
-                # initialize a list of stands to remove
-                to_remove = []
-                # loop through the stands
-                for stand in child:
-                    if stand.tag == "{http://standardit.tapio.fi/schemas/forestData/Stand}Stand" and stand.attrib["id"] in removed_ids:
-                        # if the current stand's ID is in the list of IDs to remove, add the stand Element to the list
-                        to_remove.append(stand)
-                # finally loop through the list of stands to remove to actually remove them from the ElementTree
-                for r in to_remove:
-                    child.remove(r)
-
-        # use the namespaces used in metsi to get the XML in the correct format for metsi
-        namespaces = NS
-        fix_prefixes(root, namespaces)
-        new_xml = ET.tostring(root).decode()
-
-        # form the namespace list that is in the root element of the XML file, this is needed to include all namespaces
-        namespaces_list = ""
-        for key, value in NS.items():
-            if value == "http://standardit.tapio.fi/schemas/forestData ForestData.xsd":
-                namespaces_list = namespaces_list + \
-                    f'xsi:{key}="{value}"' + " "
-            elif key == "default":
-                namespaces_list = namespaces_list + f'xmlns="{value}"' + " "
-            else:
-                namespaces_list = namespaces_list + \
-                    f'xmlns:{key}="{value}"' + " "
-        namespaces_list = namespaces_list + \
-            'schemaPackageVersion="V20" schemaPackageSubversion="V20.01"'
-
-        # finalize the first row by adding the correct tag and namespace listing
-        first_row = "<ForestPropertyData " + namespaces_list + ">"
-
-        # split the XML file into a list of strings to add the correct first and last line
-        new_xml_list = new_xml.split("\n")
-        # replace the first line with the correctly formed one
-        new_xml_list[0] = first_row
-        # replace the last row
-        new_xml_list[-1] = "</ForestPropertyData>"
-        # join the list of lines back into a single string
-        new_xml = "\n".join(new_xml_list)
-
-        # write the XML file
-        if platform == "win32":
-            with Path.open(f"{realestate_dir}/output_{i+1}.xml", "w") as file:
-                file.write(new_xml)
-        if platform == "linux":
-            with Path(f"{realestate_dir}/output_{i+1}.xml").open(mode="w") as file:
-                file.write(new_xml)
-
-        # in case we want to plot the stands
-        if plot:
-            _, ax = plt.subplots()
-
-            # plot the real estate in red (to see if a spot is missing basically)
-            gdf_target.plot(ax=ax, color="red", alpha=0.2)
-
-            # plot the remaining stands (not removed) in green
-            gdf_polygons.plot(ax=ax, color="green",
-                              alpha=0.5, edgecolor="black")
-
-            # plot the buffer area in blue
-            gpd.GeoSeries([buffer]).plot(ax=ax, color="blue", alpha=0.3)
-
-            # plot all the removed stands in black
-            for r in removed:
-                x, y = r.geometry.exterior.xy
-                ax.fill(x, y, alpha=0.5, fc="black")
-
-            ax.set_title('Polygons with Buffer (Removed Neighbors)')
-
-            # save the figure in the same directory as the XML file
-            plt.savefig(f"{realestate_dir}/stands_{i+1}.png")
-    return removed_ids
-
-
-def combine_xmls(realestate_dir: str, coordinates: list):
-    """Combine the XMLs of the different parts of the real estate into a single XML file.
-
-    The final XML file will have all the data of all the stands in the real estate. The final combined XML file is
-    named output.xml (the XML files of the different parts of the real estate are name output_<partnumber>.xml).
-
-    If there are multiple parts of the real estate for which there are XML files, different parts of the XML files are
-    left out. From the first XML, the last two rows that close the elements Stands and ForestPropertyData are left out.
-    The element Stands includes all the Stand elements and we want to include all of the real estate's stands in one
-    Stands element, so we only close the Stands element when all the stands are included. The element ForestPropertyData
-    is the root element of the XML so we want to close it when all the relevant data from all the parts are included.
-
-    From the last XML file, the first two rows are left out. The first two rows open the mentioned ForestPropertyData
-    and Stands elements. When excluding those rows, what is left are all the Stand elements of the XML and the last two
-    rows that, as mentioned, close the Stands and ForestPropertyData elements.
-
-    If there are more than two parts of the real estate, i.e., more than two XML files, from all the files, besides
-    the first and last, we leave out the first two and the last two rows. This way, what is left to add to the combined
-    file are the Stand elements.
-
-    If there is only one part (one XML file named output_1.xml), we just copy the contents of that into a new XML file
-    named output.xml. This way the metsi call can be hard coded to always use an XML file with the name output.xml.
+    # set the buffer distance
+    buffer_distance = 10
+
+    # the index of all the stands of the owner: the real estate each stand is assigned to (or -1 if the stand was
+    # removed), by the stand's ID
+    stand_index = {}
+
+    # the forest data of each real estate
+    forest_datas = [ForestData() for _ in realestate_dirs]
+
+    # the target polygons are the original polygons from Maanmittauslaitos of all the parts of all the real estates,
+    # so that a stand fetched with the query of one real estate is also tested against its neighbors
+    targets = np.array([geom.Polygon(part) for part in coordinates])
+    part_estates = np.array(estates)
+
+    # buffer the target polygons and put them into an STRtree
+    part_buffers = shapely.buffer(targets, buffer_distance)
+    tree = shapely.STRtree(part_buffers)
+
+    # the area and the buffered area of each real estate
+    areas = np.array([shapely.union_all(targets[part_estates == k]) for k in range(len(realestate_dirs))])
+    buffers = np.array([shapely.union_all(part_buffers[part_estates == k]) for k in range(len(realestate_dirs))])
+    # the buffer zones are tested against every stand, so prepare them once
+    shapely.prepare(buffers)
+
+    # loop through the XML files
+    for i in range(len(files)):
+        # the stands read but not yet decided on
+        batch = []
+
+        def flush():
+            polygons = np.array([polygon for _, polygon in batch])
+            owners = assign_stands(polygons, tree, part_estates, buffers, areas)
+            for (stand, polygon), owner in zip(batch, owners):
+                stand_id = stand.attrib["id"]
+                # the same stand may be twice in a batch, if the XML file has it twice
+                if stand_id not in stand_index:
+                    stand_index[stand_id] = int(owner)
+                    if owner >= 0:
+                        forest_datas[owner].add(stand, polygon)
+            batch.clear()
+
+        # read the (compressed) XML file one element at a time
+        with gzip.open(f"{xml_dir}/output_{i+1}.xml.gz") as file:
+            stands = None
+            for event, element in ET.iterparse(file, events=("start", "end")):
+                if event == "start":
+                    if element.tag == "{http://standardit.tapio.fi/schemas/forestData/Stand}Stands":
+                        stands = element
+                    continue
+                # only the stands are of interest, the element of a stand is complete at its end event
+                if element.tag != "{http://standardit.tapio.fi/schemas/forestData/Stand}Stand" or stands is None:
+                    continue
+
+                # a stand already decided on was also returned by another query and is left out
+                if element.attrib["id"] not in stand_index:
+                    rings = get_stand_rings(element)
+                    batch.append((element, geom.Polygon(rings["exterior"], holes=rings["interior"])))
+                    if len(batch) == BATCH_SIZE:
+                        flush()
+
+                # detach the stand from the tree, so it is freed once it has been decided on
+                stands.remove(element)
+
+            if len(batch) > 0:
+                flush()
+
+    removed_ids = [stand_id for stand_id, owner in stand_index.items() if owner < 0]
+    return removed_ids, forest_datas
+
+
+def get_stand_features(forest_data: ForestData, realestateid: str) -> list[dict]:
+    """Form the GeoJSON features of the stands of a real estate.
 
     Args:
-        realestate_dir (str): The directory where the real estate data is stored.
-        coordinates (list): List of lists of coordinates. Length is equal to number of separate parts of the real estate
+        forest_data (ForestData): The forest data of the real estate.
+        realestateid (str): The real estate ID, stored in the features as the estate code.
 
+    Returns:
+        list[dict]: A GeoJSON feature (a polygon) for each stand.
     """
-    if platform == "win32":
-
-        if len(coordinates) != 1:
-            # if there are multiple parts of the real estate, the final XML is formed by reading the different XMLs
-            # into strings and combining them
-            # final XML goes into a file name output.xml
-            with Path.open(f"{realestate_dir}/output.xml", "w") as file:
-                # read the first part's data from output_1.xml
-                with Path.open(f"{realestate_dir}/output_1.xml", "r") as file2:
-                    content = file2.read()
-
-                # from the first part, we leave out the last two rows that close the elements Stands and ForestPropertyData
-                file.write("\n".join(content.splitlines()[:-2]) + "\n")
-
-                # if there are more than two parts, loop through the other parts
-                for i in range(1, len(coordinates)-1):
-                    # each part's data is in an XML file output_<partnumber>.xml
-                    with Path.open(f"{realestate_dir}/output_{i+1}.xml", "r") as file2:
-                        content = file2.read()
-
-                    # from every other part besides first and last, we leave out the first two and last two rows
-                    # the first two open elements ForestPropertyData and Stands and the last two close them
-                    file.write("\n".join(content.splitlines()[2:-2]) + "\n")
-
-                # read the last part's XML file
-                with Path.open(f"{realestate_dir}/output_{len(coordinates)}.xml", "r") as file2:
-                    content = file2.read()
-
-                # from the last XML, we leave out the first two lines
-                file.write("\n".join(content.splitlines()[2:]))
-        else:
-            # if only one XML file, copy the contents to a new file named output.xml
-            with Path.open(f"{realestate_dir}/output.xml", "w") as file:
-                with Path.open(f"{realestate_dir}/output_1.xml", "r") as file2:
-                    content = file2.read()
-                file.write(content)
+    features = []
+    for stand_id, number, polygon in zip(forest_data.ids, forest_data.numbers, forest_data.geometries):
+        # put the stand's data into a dict
+        feature = {}
+        feature["type"] = "Feature"
+        properties = {}
+        properties["id"] = int(stand_id)  # stand id
+        properties["estate_code"] = realestateid
+        properties["number"] = number
+        feature["properties"] = properties
+        # the exterior polygon and the possible interior polygons (holes in the stand)
+        feature["geometry"] = geom.mapping(polygon)
+        features.append(feature)
+    return features
+
+
+def process_real_estate(realestateid: str, realestate_dir: str, forest_data: ForestData):
+    """Run the metsi simulations of a real estate and convert the results for the optimization.
+
+    The results are written into the real estate's directory. This is the part of the pipeline that each real estate
+    goes through on its own, so it can be run for several real estates at the same time (see process_real_estates).
 
-    if platform == "linux":
+    Args:
+        realestateid (str): The real estate ID.
+        realestate_dir (str): The directory in which the real estate's data is stored.
+        forest_data (ForestData): The forest data of the real estate.
+    """
+    # the XML file of the real estate's forest data is not needed by the pipeline, it is only written to debug
+    if DEBUG_XML:
+        forest_data.write_xml(f"{realestate_dir}/output.xml")
+
+    # Run the metsi simulator with the forest data
+    # Requires that the following are found in the current repository:
+    #   1. data directory from metsi (that has information about prices etc.)
+    #   2. a control.yaml file that has the parameters for the metsi simulation
+    # only the stands whose results are not in the simulation cache are simulated
+    fingerprint = simulation_fingerprint(metsi_driver.MetsiConfiguration.control_file)
+    keys, results, missing = lookup_results(forest_data, fingerprint)
+    print(f"Running metsi simulations for {realestateid} ({len(missing)} of {len(forest_data)} stands)...")
+    if len(missing) > 0:
+        simulated = forest_data.select(missing)
+        # metsi is given the forest data as is, the input path is only there for metsi's argument parsing
+        try:
+            exports = run_metsi([f"{realestate_dir}/output.xml", f"{realestate_dir}"], forest_data=simulated)
+        except MetsiError as e:
+            raise PipelineError(
+                f"Running the metsi simulations failed for the real estate {realestateid}: {e}") from e
+        # the results for the optimization are handed over in memory, not through an export file
+        if "opt_table" not in exports:
+            raise PipelineError("The metsi control file has no opt_table export.")
+        simulated_results = read_results(realestate_dir, simulated.ids, exports["opt_table"])
+        store_results([keys[i] for i in missing], simulated.ids, simulated_results)
+        results.update(simulated_results)
+    # the results of all the stands, cached and simulated, in the order of the stands
+    control = metsi_driver.load_control(metsi_driver.MetsiConfiguration.control_file)
+    table = write_results(realestate_dir, forest_data.ids, results, metsi_driver.opt_parquet_filenames(control))
+
+    # Convert the simulation output to CSV for optimization purposes
+    print(f"Converting metsi output to CSV for {realestateid}...")
+    convert_to_opt(f"{realestate_dir}", 1, table)
+
+    # Covnert trees.txt to a more usable format
+    print(f"Converting trees.txt to trees.json for {realestateid}...")
+    write_trees_json(realestate_dir)
+
+    # Compute CO2 and write them into a json file for optimization problems
+    print(f"Writing carbon.json for {realestateid}...")
+    write_carbon_json(realestate_dir)
+
+
+def _init_estate_worker(metsi_workers: int):
+    # the real estates processed at the same time share the cores for their metsi simulations
+    metsi_driver.METSI_WORKERS = metsi_workers
+
+
+def _get_estate_pool() -> ProcessPoolExecutor:
+    # the workers stay alive between the owners, so the pipeline and metsi are imported only once in each
+    global _estate_pool
+    if _estate_pool is None:
+        metsi_workers = max(1, (os.cpu_count() or 1) // ESTATE_WORKERS)
+        # spawn instead of fork, since the pipeline runs in the API process that has threads
+        _estate_pool = ProcessPoolExecutor(max_workers=ESTATE_WORKERS, mp_context=multiprocessing.get_context("spawn"),
+                                           initializer=_init_estate_worker, initargs=(metsi_workers,))
+    return _estate_pool
+
+
+def _submit_real_estates(ids: list[str], realestate_dirs: list[str], forest_datas: list[ForestData]) -> list[Future]:
+    # a worker that dies (e.g., runs out of memory inside metsi) breaks the whole pool, so a broken pool is replaced
+    # with a new one
+    global _estate_pool
+
+    def submit(pool: ProcessPoolExecutor) -> list[Future]:
+        return [pool.submit(process_real_estate, realestateid, realestate_dir, forest_data)
+                for realestateid, realestate_dir, forest_data in zip(ids, realestate_dirs, forest_datas)]
+
+    try:
+        return submit(_get_estate_pool())
+    except BrokenProcessPool:
+        _estate_pool.shutdown(wait=False, cancel_futures=True)
+        _estate_pool = None
+        return submit(_get_estate_pool())
+
+
+def process_real_estates(ids: list[str], realestate_dirs: list[str], forest_datas: list[ForestData]):
+    """Process the real estates (see process_real_estate) in parallel, at most ESTATE_WORKERS at a time.
+
+    Returns only when all the real estates are done. If a real estate fails, the real estates still waiting in the
+    queue are cancelled and, once the running ones have finished, the error of the real estate that failed first is
+    raised (of the first one in the order of the real estates, if several had failed by the time it was noticed).
+    Each worker process runs its metsi simulations with an equal share of the cores.
 
-        if len(coordinates) != 1:
-            # if there are multiple parts of the real estate, the final XML is formed by reading the different XMLs
-            # into strings and combining them
-            # final XML goes into a file name output.xml
-            with Path(f"{realestate_dir}/output.xml").open(mode="w") as file:
-                # read the first part's data from output_1.xml
-                with Path(f"{realestate_dir}/output_1.xml").open(mode="r") as file2:
-                    content = file2.read()
-
-                # from the first part, we leave out the last two rows that close the elements Stands and ForestPropertyData
-                file.write("\n".join(content.splitlines()[:-2]) + "\n")
-
-                # if there are more than two parts, loop through the other parts
-                for i in range(1, len(coordinates)-1):
-                    # each part's data is in an XML file output_<partnumber>.xml
-                    with Path(f"{realestate_dir}/output_{i+1}.xml").open(mode="r") as file2:
-                        content = file2.read()
-
-                    # from every other part besides first and last, we leave out the first two and last two rows
-                    # the first two open elements ForestPropertyData and Stands and the last two close them
-                    file.write("\n".join(content.splitlines()[2:-2]) + "\n")
-
-                # read the last part's XML file
-                with Path(f"{realestate_dir}/output_{len(coordinates)}.xml").open(mode="r") as file2:
-                    content = file2.read()
-
-                # from the last XML, we leave out the first two lines
-                file.write("\n".join(content.splitlines()[2:]))
-        else:
-            # if only one XML file, copy the contents to a new file named output.xml
-            with Path(f"{realestate_dir}/output.xml").open(mode="w") as file:
-                with Path(f"{realestate_dir}/output_1.xml").open(mode="r") as file2:
-                    content = file2.read()
-                file.write(content)
+    Args:
+        ids (list[str]): The real estate IDs.
+        realestate_dirs (list[str]): The directories in which the real estates' data is stored.
+        forest_datas (list[ForestData]): The forest data of each real estate.
+    """
+    if ESTATE_WORKERS == 1 or len(ids) == 1:
+        # a single real estate is processed here, its metsi simulations still use all the cores
+        for realestateid, realestate_dir, forest_data in zip(ids, realestate_dirs, forest_datas):
+            process_real_estate(realestateid, realestate_dir, forest_data)
+        return
+
+    futures = _submit_real_estates(ids, realestate_dirs, forest_datas)
+    # the real estates done by the time the first one failed, which has to be among them
+    done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+    for future in futures:
+        future.cancel()
+    wait(futures)
+    # the first failure in time if it is known, otherwise the first one in the order of the real estates
+    for future in [*(future for future in futures if future in done), *futures]:
+        if not future.cancelled() and future.exception() is not None:
+            raise future.exception()
 
 
 def _generate_descriptions(mapjson: dict, sid: str, stand: str, holding: str, extension: str) -> dict:
@@ -618,77 +753,58 @@ def run_pipeline(ids, target_dir, name, api_key_dir):
     # initialize a list of features (i.e., stands)
     features = []
 
-    # initialize strings for combining the alternatives CSV files of different real estates automatically
-    alternatives = ""
+    # initialize a string for combining the alternatives key CSV files of different real estates automatically
     alternatives_key = ""
     # initialize a dict to combine the carbon.json files of different real estates automatically
     carbons = {}
-    for i in range(len(ids)):
-        # get the real estate id
-        realestateid = ids[i]
-
-        # get the real estate id in the "long" form for the API call to Maanmittauslaitos API
-        realestateid_mml = parse_real_estate_id(ids[i])
-
-        # the directory where all the data for this real estate will be stored
-        realestate_dir = f"{target_dir}/{name}/{realestateid}"
 
+    # the directories where all the data for each real estate will be stored
+    realestate_dirs = [f"{target_dir}/{name}/{realestateid}" for realestateid in ids]
+    for realestate_dir in realestate_dirs:
         # if a directory for the real estate does not exist, make it
         if not Path(realestate_dir).is_dir():
             Path(realestate_dir).mkdir()
 
-        # get the real estate coordinates from Maanmittauslaitos
-        coordinates = get_real_estate_coordinates(realestateid_mml, api_key)
-
-        # get the forest data from Metsäkeskus and write it into XML files,
-        # returns any errors and updates coordinates list
-        # if no data for some polygon from Metsäkeskus, the coordinates are removed from the list
-        errors, coordinates = write_real_estate_xmls(
-            coordinates, realestateid, realestate_dir)
-        # if there were any errors in getting data from Metsäkeskus, print out the errors
-        if len(errors) > 0:
-            for error in errors:
-                print(error)
-
-        # remove stands from the XMLs that no not belong to the real estate and write the XMLs without them
-        removed_ids = remove_neighboring_stands(
-            coordinates, realestate_dir, plot=True)
-
-        # combine the XMLs (forest data) of all the possible separate parts of the real estate into one XML file
-        combine_xmls(realestate_dir, coordinates)
-
-        # Run the metsi simulator with the data in the XML file
-        # Requires that the following are found in the current repository:
-        #   1. data directory from metsi (that has information about prices etc.)
-        #   2. a control.yaml file that has the parameters for the metsi simulation
-        print(f"Running metsi simulations for {realestateid}...")
-        # This should be safe because we're filling the thing with parameters to metsi and doing "; whatever" should not work.
-        subprocess.call(["metsi", f"{realestate_dir}/output.xml", f"{realestate_dir}"])
-
-        # Convert the simulation output to CSV for optimization purposes
-        print(f"Converting metsi output to CSV for {realestateid}...")
-        convert_to_opt(f"{realestate_dir}", 1)
-
-        # Covnert trees.txt to a more usable format
-        print(f"Converting trees.txt to trees.json for {realestateid}...")
-        write_trees_json(realestate_dir)
-
-        # Compute CO2 and write them into a json file for optimization problems
-        print(f"Writing carbon.json for {realestateid}...")
-        write_carbon_json(realestate_dir)
-
-        # read the alternatives from the CSV file and add the contents to the python variable
-        if platform == "win32":
-            with Path.open(f"{realestate_dir}/alternatives.csv", "r") as f:
-                # if the first CSV file, write the first line (headers) as well, if not then only write the data rows
-                alternatives = alternatives + f.read() if i == 0 else alternatives + \
-                    "\n".join(f.read().split("\n")[1:])
+    # get the coordinates of all the real estates from Maanmittauslaitos concurrently
+    # (the real estate ids are given in the "long" form for the API call to Maanmittauslaitos API)
+    all_coordinates = fetch_all(
+        lambda realestateid: get_real_estate_coordinates(parse_real_estate_id(realestateid), api_key), ids)
+
+    # the parts of all the real estates in one list and the index of the real estate of each part, so that the stands
+    # shared by adjacent real estates are fetched and parsed only once
+    parts = [part for coordinates in all_coordinates for part in coordinates]
+    estates = [i for i in range(len(ids)) for _ in all_coordinates[i]]
+
+    # get the forest data of all the real estates from Metsäkeskus concurrently and write it into XML files,
+    # returns any errors and the parts of each XML file
+    # if no data for some polygon from Metsäkeskus, no XML file is written for it
+    errors, files = write_real_estate_xmls(parts, [ids[i] for i in estates], f"{target_dir}/{name}")
+
+    # if there were any errors in getting data from Metsäkeskus, print out the errors
+    if len(errors) > 0:
+        for error in errors:
+            print(error)
+
+    # assign every stand to exactly one real estate and remove the stands that do not belong to any of the real
+    # estates, the forest data of each real estate is kept in memory for the rest of the pipeline
+    removed_ids, forest_datas = remove_neighboring_stands(
+        parts, estates, files, f"{target_dir}/{name}", realestate_dirs)
+
+    for realestateid, forest_data in zip(ids, forest_datas):
+        if len(forest_data) == 0:
+            raise PipelineError(
+                f"No forest data was found for the real estate {realestateid}! Are you sure the real estate ID is correct?")
 
-        if platform == "linux":
-            with Path(f"{realestate_dir}/alternatives.csv").open(mode="r") as f:
-                # if the first CSV file, write the first line (headers) as well, if not then only write the data rows
-                alternatives = alternatives + f.read() if i == 0 else alternatives + \
-                    "\n".join(f.read().split("\n")[1:])
+    # simulate the real estates and convert the results, the real estates are independent of each other until the
+    # results are combined below
+    process_real_estates(ids, realestate_dirs, forest_datas)
+
+    for i in range(len(ids)):
+        # get the real estate id
+        realestateid = ids[i]
+        realestate_dir = realestate_dirs[i]
+
+        forest_data = forest_datas[i]
 
         # read the alternatives info from the CSV file and add the contents to the python variable
 
@@ -724,64 +840,19 @@ def run_pipeline(ids, target_dir, name, api_key_dir):
         for stand_id, value in carbon_dict.items():
             carbons[stand_id] = value
 
-        # read the real estate's forest data from the XML file into an ElementTree
-        tree = ET.parse(f"{realestate_dir}/output.xml")
-        root = tree.getroot()
-
-        # go through the ElementTree and take the data needed for the GeoJSON
-        for child in root:
-            if child.tag == "{http://standardit.tapio.fi/schemas/forestData/Stand}Stands":
-                # go through the stands
-                for stand in child:
-                    # check that the child is a Stand element (realistically should never be anything else)
-                    if stand.tag == "{http://standardit.tapio.fi/schemas/forestData/Stand}Stand":
-                        # put the stand's data into a dict
-                        feature = {}
-                        feature["type"] = "Feature"
-                        properties = {}
-                        geometry = {}
-                        geometry["type"] = "Polygon"
-                        properties["id"] = int(stand.attrib["id"])  # stand id
-                        properties["estate_code"] = realestateid
-                        properties["number"] = int(stand.find("{http://standardit.tapio.fi/schemas/forestData/Stand}StandBasicData").find(
-                            "{http://standardit.tapio.fi/schemas/forestData/Stand}StandNumber").text)
-                        coordinates = []
-                        # find the exterior polygon for the stand
-                        for exterior in stand.iter("{http://www.opengis.net/gml}exterior"):
-                            for linear_ring in exterior.iter("{http://www.opengis.net/gml}LinearRing"):
-                                for ring in linear_ring:
-                                    coords = ring.text.split(" ")
-                                    coordinate_pairs = []
-                                    for coordinate in coords:
-                                        coordinate_pairs.append(
-                                            [float(coordinate.split(",")[0]), float(coordinate.split(",")[1])])
-                                    coordinates.append(coordinate_pairs)
-                        # if exists, find the interior polygon (a hole in the stand)
-                        for interior in stand.iter("{http://www.opengis.net/gml}interior"):
-                            for linear_ring in interior.iter("{http://www.opengis.net/gml}LinearRing"):
-                                for ring in linear_ring:
-                                    coords = ring.text.split(" ")
-                                    coordinate_pairs = []
-                                    for coordinate in coords:
-                                        coordinate_pairs.append(
-                                            [float(coordinate.split(",")[0]), float(coordinate.split(",")[1])])
-                                    coordinates.append(coordinate_pairs)
-                        geometry["coordinates"] = coordinates
-                        feature["properties"] = properties
-                        feature["geometry"] = geometry
-                        features.append(feature)
+        # take the data needed for the GeoJSON straight from the forest data
+        features.extend(get_stand_features(forest_data, realestateid))
 
     # after iterating through all given real estates, finish the map data dict and write and combine all the data files
     map_data["features"] = features
+    # quantize and simplify the map (and possibly make it a topology), so it is smaller to store and to download
+    map_data = encode_stand_map(map_data)
     if platform == "win32":
         print("Writing GeoJSON file...")
         with Path.open(f"{target_dir}/{name}/{name}.geojson", "w") as file:
-            json.dump(map_data, file)
+            json.dump(map_data, file, separators=(",", ":"))
 
         print("Combining CSV files...")
-        with Path.open(f"{target_dir}/{name}/alternatives.csv", "w") as file:
-            file.write(alternatives)
-
         with Path.open(f"{target_dir}/{name}/alternatives_key.csv", "w") as file:
             file.write(alternatives_key)
 
@@ -795,12 +866,9 @@ def run_pipeline(ids, target_dir, name, api_key_dir):
     if platform == "linux":
         print("Writing GeoJSON file...")
         with Path(f"{target_dir}/{name}/{name}.geojson").open(mode="w") as file:
-            json.dump(map_data, file)
+            json.dump(map_data, file, separators=(",", ":"))
 
         print("Combining CSV files...")
-        with Path(f"{target_dir}/{name}/alternatives.csv").open(mode="w") as file:
-            file.write(alternatives)
-
         with Path(f"{target_dir}/{name}/alternatives_key.csv").open(mode="w") as file:
             file.write(alternatives_key)
 
@@ -811,6 +879,11 @@ def run_pipeline(ids, target_dir, name, api_key_dir):
         with Path(f"{target_dir}/{name}/carbon.json").open(mode="w") as file:
             json.dump(carbons, file)
 
+    # combine the alternatives into a columnar file, so the problem is formed from only the columns it needs
+    pl.concat([
+        pl.read_parquet(f"{realestate_dir}/alternatives.parquet", memory_map=True) for realestate_dir in realestate_dirs
+    ]).write_parquet(f"{target_dir}/{name}/alternatives.parquet")
+
     # Handle the database stuff
 
     # Initiate database connection
@@ -867,7 +940,7 @@ def run_pipeline(ids, target_dir, name, api_key_dir):
         years=list(map(lambda x: str(x), [5, 10, 20])),
         stand_id_field="id",
         stand_descriptor=_generate_descriptions(
-            json.loads(forest_map),
+            decode_stand_map(forest_map),
             "id",
             "number",
             "estate_code",
@@ -927,6 +1000,8 @@ if __name__ == "__main__":
                         help="Name of forest owner.", type=str, default="test")
     arg_msg = "Path to a (text) file with the API key for Maanmittauslaitos API."
     parser.add_argument("-k", dest="key", help=arg_msg, type=str)
+    arg_msg = "Invalidate the cached polygons of the given real estates and exit without running the pipeline."
+    parser.add_argument("--invalidate", dest="invalidate", help=arg_msg, action="store_true")
 
     # if arguments missing, print out the help messages to inform what is needed
     args = parser.parse_args(args=None if sys.argv[1:] else ["--help"])
@@ -937,4 +1012,9 @@ if __name__ == "__main__":
     name = args.name
     api_key_dir = args.key
 
+    if args.invalidate:
+        for realestateid in ids:
+            estate_cache.invalidate(parse_real_estate_id(realestateid))
+        sys.exit(0)
+
     run_pipeline(ids=ids, target_dir=target_dir, name=name, api_key_dir=api_key_dir)
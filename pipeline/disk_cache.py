@@ -0,0 +1,233 @@
+"""A small persistent on-disk cache for the data pipeline.
+
+Each cache has a name and its own directory under the cache root. The entries are stored as files named by the
+SHA-256 hash of their key, so any string (e.g., a real estate ID or a polygon) can be used as a key. Writing an entry
+is atomic, so several uvicorn workers can share the same cache directory.
+
+An entry expires when it is older than the TTL of the cache. When the total size of a cache grows past its size limit,
+the least recently used entries are evicted to make some room below the limit. Each process keeps a running estimate of
+the total size from the entries it writes, so the cache directory is scanned only when the estimate passes the limit,
+or after every SCAN_INTERVAL writes to count the entries written by the other processes too. The time an entry was
+written is kept as the modification time of the file and the time it was last read as the access time of the file.
+
+The cache root is given with the environment variable PIPELINE_CACHE and defaults to "../cache" (next to the output
+folder of the web runner).
+
+The script can also be run to invalidate the caches:
+
+    python disk_cache.py -n estates            # clear the whole "estates" cache
+    python disk_cache.py -n estates -k 11100200340056  # invalidate a single entry
+"""
+
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections.abc import Callable
+from pathlib import Path
+from typing import BinaryIO
+
+CACHE_ROOT = os.environ.get("PIPELINE_CACHE", "../cache")
+# how many entries a process writes into a size-bounded cache between the scans of its directory
+SCAN_INTERVAL = 100
+# the share of the size limit that an eviction frees, so the next writes fit in without scanning the directory again
+EVICT_HEADROOM = 0.1
+
+
+class DiskCache:
+    """A named on-disk cache with a TTL and a size-bounded LRU eviction."""
+
+    def __init__(self, name: str, ttl: float | None = None, max_bytes: int | None = None, root: str | None = None):
+        """Initialize the cache. The directory of the cache is made when the first entry is written.
+
+        Args:
+            name (str): The name of the cache, used as the name of its directory.
+            ttl (float | None, optional): How many seconds an entry stays fresh. Defaults to None (never expires).
+            max_bytes (int | None, optional): The maximum total size of the entries. Defaults to None (unbounded).
+            root (str | None, optional): The cache root directory. Defaults to PIPELINE_CACHE.
+        """
+        self.name = name
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.directory = Path(root if root is not None else CACHE_ROOT) / name
+        # the estimated total size of the entries, unknown until the directory is scanned
+        self._size = None
+        self._writes = 0
+        self._size_lock = threading.Lock()
+
+    def path(self, key: str) -> Path:
+        """Get the path of the file that stores the entry for the key.
+
+        Args:
+            key (str): The key of the entry.
+
+        Returns:
+            Path: The path of the entry, named by the hash of the key.
+        """
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        return self.directory / digest[:2] / digest
+
+    def _fresh_path(self, key: str) -> Path | None:
+        # get the path of a fresh entry and mark the entry as recently used
+        path = self.path(key)
+        try:
+            stat = path.stat()
+            if self.ttl is not None and time.time() - stat.st_mtime > self.ttl:
+                # the entry is stale, remove it so it does not take space
+                path.unlink(missing_ok=True)
+                return None
+            # the modification time (time of writing) stays the same
+            os.utime(path, (time.time(), stat.st_mtime))
+        except FileNotFoundError:
+            return None
+        return path
+
+    def get(self, key: str) -> bytes | None:
+        """Get the entry for the key.
+
+        Args:
+            key (str): The key of the entry.
+
+        Returns:
+            bytes | None: The cached value or None if there is no fresh entry for the key.
+        """
+        path = self._fresh_path(key)
+        try:
+            return path.read_bytes() if path is not None else None
+        except FileNotFoundError:
+            return None
+
+    def copy_to(self, key: str, destination: str) -> bool:
+        """Copy the entry for the key into a file, without reading it into memory.
+
+        Args:
+            key (str): The key of the entry.
+            destination (str): The path of the file to write.
+
+        Returns:
+            bool: True if there was a fresh entry for the key, False otherwise.
+        """
+        path = self._fresh_path(key)
+        if path is None:
+            return False
+        try:
+            shutil.copyfile(path, destination)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def put(self, key: str, value: bytes):
+        """Store an entry, replacing any earlier entry for the key.
+
+        Args:
+            key (str): The key of the entry.
+            value (bytes): The value to store.
+        """
+        self._store(key, lambda file: file.write(value))
+
+    def put_file(self, key: str, source: str):
+        """Store the contents of a file as the entry for the key, without reading it into memory.
+
+        Args:
+            key (str): The key of the entry.
+            source (str): The path of the file to store.
+        """
+        with Path(source).open(mode="rb") as source_file:
+            self._store(key, lambda file: shutil.copyfileobj(source_file, file))
+
+    def _store(self, key: str, write: Callable[[BinaryIO], object]):
+        path = self.path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # write into a temporary file first and then move it in place, so readers never see a half-written entry
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as file:
+                write(file)
+            size = os.path.getsize(tmp)
+            os.replace(tmp, path)
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+        if self.max_bytes is not None:
+            self._count_write(size)
+
+    def _count_write(self, size: int):
+        # add the entry to the estimated total size and evict only when the estimate may be past the limit (an entry
+        # that replaces an earlier one is counted in full, so the estimate never falls behind the writes of this
+        # process)
+        with self._size_lock:
+            self._writes = self._writes + 1
+            if self._size is not None and self._writes < SCAN_INTERVAL:
+                self._size = self._size + size
+                if self._size <= self.max_bytes:
+                    return
+            self._writes = 0
+        total = self.evict()
+        with self._size_lock:
+            self._size = total
+
+    def invalidate(self, key: str):
+        """Remove the entry for the key, if there is one.
+
+        Args:
+            key (str): The key of the entry.
+        """
+        self.path(key).unlink(missing_ok=True)
+
+    def clear(self):
+        """Remove all the entries of the cache."""
+        for path in self._entries():
+            path.unlink(missing_ok=True)
+
+    def evict(self) -> int:
+        """Remove the least recently used entries when the total size of the cache is past its size limit, until the
+        total size is EVICT_HEADROOM below the limit.
+
+        Returns:
+            int: The total size of the entries left in the cache.
+        """
+        entries = []
+        total = 0
+        for path in self._entries():
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_atime, stat.st_size, path))
+            total = total + stat.st_size
+        if self.max_bytes is None or total <= self.max_bytes:
+            return total
+        # the least recently used entries first
+        target = self.max_bytes * (1 - EVICT_HEADROOM)
+        for _, size, path in sorted(entries, key=lambda entry: entry[0]):
+            path.unlink(missing_ok=True)
+            total = total - size
+            if total <= target:
+                break
+        return total
+
+    def _entries(self) -> list[Path]:
+        if not self.directory.is_dir():
+            return []
+        return [path for path in self.directory.glob("*/*") if not path.name.startswith(".tmp-")]
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", dest="name", help="Name of the cache, e.g., estates.", type=str)
+    parser.add_argument("-k", dest="keys", help="Keys of the entries to invalidate. If not given, the whole cache is "
+                        "cleared.", type=str, nargs="*", default=[])
+    parser.add_argument("-r", dest="root", help="The cache root directory.", type=str, default=None)
+    args = parser.parse_args(args=None if sys.argv[1:] else ["--help"])
+
+    cache = DiskCache(args.name, root=args.root)
+    if args.keys:
+        for key in args.keys:
+            cache.invalidate(key)
+    else:
+        cache.clear()
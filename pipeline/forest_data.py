@@ -0,0 +1,268 @@
+"""The forest data of the real estates in the format of Metsäkeskus' forest data standard, as read by metsi.
+
+ForestData holds the stands of a real estate in memory after the data pipeline has fetched and filtered them, so the
+later stages (the GeoJSON of the stands and the metsi simulations) do not need to write and parse the XML again.
+StandsWriter writes stands into a ForestPropertyData XML file when one is needed.
+"""
+
+import copy
+import io
+from pathlib import Path
+from typing import TextIO
+from xml.etree import ElementTree as ET
+
+import numpy as np
+import shapely.geometry as geom
+from lukefi.metsi.data.formats.smk_util import parse_gml_coordinates
+
+# the namespace used in metsi
+NS = {
+    "schema_location": "http://standardit.tapio.fi/schemas/forestData ForestData.xsd",
+    "xsi": "http://www.w3.org/2001/XMLSchema-instance",
+    "xlink": "http://www.w3.org/1999/xlink",
+    "gml": "http://www.opengis.net/gml",
+    "gdt": "http://standardit.tapio.fi/schemas/forestData/common/geometricDataTypes",
+    "co": "http://standardit.tapio.fi/schemas/forestData/common",
+    "sf": "http://standardit.tapio.fi/schemas/forestData/specialFeature",
+    "op": "http://standardit.tapio.fi/schemas/forestData/operation",
+    "dts": "http://standardit.tapio.fi/schemas/forestData/deadTreeStrata",
+    "tss": "http://standardit.tapio.fi/schemas/forestData/treeStandSummary",
+    "tst": "http://standardit.tapio.fi/schemas/forestData/treeStratum",
+    "ts": "http://standardit.tapio.fi/schemas/forestData/treeStand",
+    "st": "http://standardit.tapio.fi/schemas/forestData/Stand",
+    "ci": "http://standardit.tapio.fi/schemas/forestData/contactInformation",
+    "re": "http://standardit.tapio.fi/schemas/forestData/realEstate",
+    "default": "http://standardit.tapio.fi/schemas/forestData"
+}
+
+# the prefix of each namespace, for writing the tags with prefixes (see fix_prefixes)
+PREFIXES = {value: key for key, value in NS.items()}
+
+
+def _forest_property_data_start() -> str:
+    # form the namespace list that is in the root element of the XML file, this is needed to include all namespaces
+    namespaces_list = ""
+    for key, value in NS.items():
+        if value == "http://standardit.tapio.fi/schemas/forestData ForestData.xsd":
+            namespaces_list = namespaces_list + f'xsi:{key}="{value}"' + " "
+        elif key == "default":
+            namespaces_list = namespaces_list + f'xmlns="{value}"' + " "
+        else:
+            namespaces_list = namespaces_list + f'xmlns:{key}="{value}"' + " "
+    namespaces_list = namespaces_list + 'schemaPackageVersion="V20" schemaPackageSubversion="V20.01"'
+    return "<ForestPropertyData " + namespaces_list + ">\n"
+
+
+# the start tag of the ForestPropertyData element, the same for every file
+FOREST_PROPERTY_DATA_START = _forest_property_data_start()
+
+
+def get_stand_rings(stand: ET.Element) -> dict[str, np.ndarray | list[np.ndarray]]:
+    """Get the exterior and interior polygons of a single stand.
+
+    Args:
+        stand (ET.Element): The Stand element.
+
+    Returns:
+        dict[str, np.ndarray | list[np.ndarray]]: A dict with the coordinates of the exterior polygon as an (n, 2)
+            array and a list of the interior polygons (holes in the stand) as arrays.
+    """
+    exterior_and_interior = {}
+    coordinates = np.empty((0, 2))
+    # find the exterior polygon for the stand
+    for exterior in stand.iter("{http://www.opengis.net/gml}exterior"):
+        for linear_ring in exterior.iter("{http://www.opengis.net/gml}LinearRing"):
+            for ring in linear_ring:
+                coordinates = parse_gml_coordinates(ring.text)
+    exterior_and_interior["exterior"] = coordinates
+    # if exists, find the interior polygons (holes in the stand)
+    interiors = []
+    for interior in stand.iter("{http://www.opengis.net/gml}interior"):
+        for linear_ring in interior.iter("{http://www.opengis.net/gml}LinearRing"):
+            interiors.extend(parse_gml_coordinates(ring.text) for ring in linear_ring)
+    exterior_and_interior["interior"] = interiors
+    return exterior_and_interior
+
+
+def get_polygon_dict(root: ET.Element) -> dict[str, dict[str, np.ndarray | list[np.ndarray]]]:
+    """Get a dict of the stands' polygons from a given ElementTree.
+
+    Args:
+        root (ET.Element): Element with the polygons.
+
+    Returns:
+        dict[str, dict[str, np.ndarray | list[np.ndarray]]]: A dict with stand IDs as keys and a dict with the
+            exterior and interior polygons as values.
+    """
+    orig_polygons = {}
+    # loop through the children of the root
+    for child in root:
+        if child.tag == "{http://standardit.tapio.fi/schemas/forestData/Stand}Stands":
+            # loop through the stands
+            for stand in child:
+                if stand.tag == "{http://standardit.tapio.fi/schemas/forestData/Stand}Stand":
+                    # store the stand ID and the stand's polygons
+                    orig_polygons[stand.attrib["id"]] = get_stand_rings(stand)
+    return orig_polygons
+
+
+def fix_prefixes(element: ET.Element | ET.ElementTree, prefixes: dict[str, str] = PREFIXES):
+    """A helper function to help write the final XML file in the correct format.
+
+    The tags of the element and all its descendants are changed from the form {namespace}tag to prefix:tag. The tree
+    is walked iteratively, so deep documents do not hit the recursion limit.
+
+    Args:
+        element (ET.Element | ET.ElementTree): Element or ElementTree to add the namespaces to.
+        prefixes (dict[str, str], optional): The prefix of each namespace. Defaults to PREFIXES.
+    """
+    for node in element.iter():
+        if node.tag.startswith("{"):
+            # split the tag into the namespace and the local name and place the correct prefix for the namespace
+            namespace, _, tag = node.tag[1:].partition("}")
+            node.tag = f"{prefixes.get(namespace, '')}:{tag}"
+
+
+def serialize_stand(stand: ET.Element) -> str:
+    """Get the XML of a stand as it is written into the forest data XML files (with the prefixes of metsi).
+
+    Args:
+        stand (ET.Element): The Stand element. It is left as is, the prefixes are changed in a copy of it.
+
+    Returns:
+        str: The XML of the stand, without the whitespace after it.
+    """
+    # use the namespaces used in metsi to get the stand in the correct format for metsi, in a copy so the stand can
+    # still be looked up by its namespaces after it has been written
+    stand = copy.deepcopy(stand)
+    fix_prefixes(stand)
+    stand.tail = None
+    return ET.tostring(stand, encoding="unicode")
+
+
+class StandsWriter:
+    """Merge stands into a single forest data XML file in the format metsi reads.
+
+    The stands (e.g., the filtered stands of all the parts of a real estate) are streamed into the file one at a time
+    under a single st:Stands element, so the file is written in one pass and nothing is read back. The layout of the
+    file does not depend on the layout of the XML files the stands came from.
+    """
+
+    def __init__(self, destination: str | TextIO):
+        """Open the file and write the start of the ForestPropertyData and Stands elements.
+
+        Args:
+            destination (str | TextIO): The path of the XML file to write or an open text file (e.g., io.StringIO)
+                to write into. An open file is left open.
+        """
+        # the number of stands written
+        self.count = 0
+        self._owned = isinstance(destination, str)
+        self._file = Path(destination).open(mode="w", encoding="utf-8") if self._owned else destination
+        self._closed = False
+        self._file.write(FOREST_PROPERTY_DATA_START + "  <st:Stands>\n")
+
+    def write(self, stand: ET.Element):
+        """Write a stand into the file.
+
+        Args:
+            stand (ET.Element): The Stand element (see serialize_stand).
+        """
+        # every stand is written on its own line
+        self.write_serialized(serialize_stand(stand))
+
+    def write_serialized(self, stand: str):
+        """Write a stand that is already in XML (e.g., from the local stand database) into the file.
+
+        Args:
+            stand (str): The XML of the Stand element, with the prefixes of metsi and without the whitespace after it.
+        """
+        self._file.write("    " + stand + "\n")
+        self.count = self.count + 1
+
+    def close(self):
+        """Close the Stands and ForestPropertyData elements and the file (if it was opened by the writer)."""
+        if not self._closed:
+            self._closed = True
+            self._file.write("  </st:Stands>\n</ForestPropertyData>\n")
+            if self._owned:
+                self._file.close()
+
+    def __enter__(self) -> "StandsWriter":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ForestData:
+    """The forest data of a real estate: the Stand elements with their polygons and stand numbers.
+
+    The forest data is produced once by the data pipeline's fetch and filter stage and handed to the later stages as
+    is. The XML file of the stands is only written when asked for (see write_xml).
+    """
+
+    def __init__(self):
+        """Initialize the forest data without any stands."""
+        # the Stand elements
+        self.stands: list[ET.Element] = []
+        # the polygon of each stand
+        self.geometries: list[geom.Polygon] = []
+        # the stand number of each stand
+        self.numbers: list[int] = []
+
+    def __len__(self) -> int:
+        return len(self.stands)
+
+    @property
+    def ids(self) -> list[str]:
+        """The IDs of the stands."""
+        return [stand.attrib["id"] for stand in self.stands]
+
+    def add(self, stand: ET.Element, geometry: geom.Polygon):
+        """Add a stand.
+
+        Args:
+            stand (ET.Element): The Stand element as parsed from Metsäkeskus' XML.
+            geometry (geom.Polygon): The polygon of the stand (see get_stand_rings).
+        """
+        self.stands.append(stand)
+        self.geometries.append(geometry)
+        self.numbers.append(int(stand.findtext(
+            "{http://standardit.tapio.fi/schemas/forestData/Stand}StandBasicData/"
+            "{http://standardit.tapio.fi/schemas/forestData/Stand}StandNumber")))
+
+    def select(self, indices: list[int]) -> "ForestData":
+        """Get the forest data of some of the stands.
+
+        Args:
+            indices (list[int]): The indices of the stands.
+
+        Returns:
+            ForestData: The forest data with the given stands, in the given order.
+        """
+        selected = ForestData()
+        selected.stands = [self.stands[i] for i in indices]
+        selected.geometries = [self.geometries[i] for i in indices]
+        selected.numbers = [self.numbers[i] for i in indices]
+        return selected
+
+    def write_xml(self, destination: str | TextIO):
+        """Write the stands into a ForestPropertyData XML file.
+
+        Args:
+            destination (str | TextIO): The path of the XML file or an open text file (see StandsWriter).
+        """
+        with StandsWriter(destination) as writer:
+            for stand in self.stands:
+                writer.write(stand)
+
+    def to_xml(self) -> str:
+        """Get the stands as a ForestPropertyData XML document, without writing a file.
+
+        Returns:
+            str: The XML document.
+        """
+        document = io.StringIO()
+        self.write_xml(document)
+        return document.getvalue()
@@ -0,0 +1,357 @@
+"""A compact encoding for the map of the stands (the GeoJSON stored as ForestProblemMetaData.map_json).
+
+The raw stand polygons have every vertex of the forest data at full float precision, which makes the map of a large
+holding a string of several megabytes. The encoder makes it smaller in three ways:
+
+- The coordinates are quantized to MAP_PRECISION decimals (of a meter in EPSG:3067). Defaults to 1.
+- The boundaries are simplified with Douglas-Peucker with the first (finest) tolerance (in meters) in
+  MAP_ZOOM_TOLERANCES. Only this level is stored, the coarser levels for zoomed out views are simplified from the
+  stored map when they are asked for (see stand_map_level). Defaults to "0.5,2,8". The boundaries are first cut into
+  arcs at the points where the stands meet, and an arc shared by two stands is simplified only once with its end
+  points fixed, so the neighboring stands still meet without gaps or overlaps. A polygon that would become invalid
+  (e.g., collapse or cross itself) keeps the points of the finer level.
+- If MAP_TOPOLOGY is set to 1, the map is stored as a TopoJSON topology instead, where each shared arc is stored only
+  once and the coordinates are delta-encoded integers. The DESDEO UI has to be able to read TopoJSON for this.
+
+decode_stand_map turns either format back into a GeoJSON feature collection, so the readers of the map (e.g.,
+stand_map.py) do not need to care about the format.
+"""
+
+import json
+import math
+import os
+
+import numpy as np
+import shapely
+
+MAP_PRECISION = int(os.environ.get("MAP_PRECISION", "1"))
+MAP_ZOOM_TOLERANCES = [float(t) for t in os.environ.get("MAP_ZOOM_TOLERANCES", "0.5,2,8").split(",") if t.strip()]
+MAP_TOPOLOGY = os.environ.get("MAP_TOPOLOGY", "") == "1"
+
+# the members of a topology that are not copied into the decoded feature collection
+TOPOLOGY_MEMBERS = ("type", "transform", "arcs", "objects")
+
+
+def _polygons(geometry: dict) -> list:
+    # the polygons of a Polygon or a MultiPolygon geometry
+    return [geometry["coordinates"]] if geometry["type"] == "Polygon" else geometry["coordinates"]
+
+
+def _geometry(geometry_type: str, polygons: list) -> dict:
+    return {"type": geometry_type, "coordinates": polygons[0] if geometry_type == "Polygon" else polygons}
+
+
+def quantize_ring(ring: list, precision: int) -> list[tuple[int, int]]:
+    """Quantize the coordinates of a ring to integers.
+
+    E.g., with the precision 1, [[612.33, 7221.22], [611.53, 7222.11], [612.33, 7221.22]] -->
+    [(6123, 72212), (6115, 72221)]
+
+    Args:
+        ring (list): The coordinate pairs of a closed ring.
+        precision (int): How many decimals of the coordinates are kept.
+
+    Returns:
+        list[tuple[int, int]]: The quantized points of the ring, without the closing point and the points that became
+            duplicates of the previous point.
+    """
+    points = np.rint(np.asarray(ring, dtype=np.float64)[:, :2] * 10**precision).astype(np.int64)
+    keep = np.ones(len(points), dtype=bool)
+    keep[1:] = np.any(points[1:] != points[:-1], axis=1)
+    points = points[keep]
+    if len(points) > 1 and (points[0] == points[-1]).all():
+        points = points[:-1]
+    return list(map(tuple, points.tolist()))
+
+
+def find_junctions(rings: list[list[tuple[int, int]]]) -> set[tuple[int, int]]:
+    """Find the points where the boundaries of the stands meet or part.
+
+    A point is a junction if it has different neighbors in different rings (or twice in the same ring). Between two
+    junctions, the rings that share a boundary go through the same points.
+
+    Args:
+        rings (list[list[tuple[int, int]]]): The quantized rings of all the stands.
+
+    Returns:
+        set[tuple[int, int]]: The junction points.
+    """
+    neighbors = {}
+    junctions = set()
+    for ring in rings:
+        for i, point in enumerate(ring):
+            pair = frozenset((ring[i - 1], ring[(i + 1) % len(ring)]))
+            if neighbors.setdefault(point, pair) != pair:
+                junctions.add(point)
+    return junctions
+
+
+def cut_ring(ring: list[tuple[int, int]], junctions: set[tuple[int, int]]) -> list[list[tuple[int, int]]]:
+    """Cut a ring into arcs at the junctions.
+
+    Args:
+        ring (list[tuple[int, int]]): The quantized points of the ring, without the closing point.
+        junctions (set[tuple[int, int]]): The junction points of all the rings.
+
+    Returns:
+        list[list[tuple[int, int]]]: The arcs, each one starting where the previous one ended. A ring without
+            junctions is a single closed arc.
+    """
+    cuts = [i for i, point in enumerate(ring) if point in junctions]
+    if not cuts:
+        # start from the smallest point, so the same ring (e.g., a hole and the stand filling it) is always cut the
+        # same way regardless of where it started
+        start = ring.index(min(ring))
+        return [ring[start:] + ring[:start + 1]]
+    start = cuts[0]
+    rotated = ring[start:] + ring[:start] + [ring[start]]
+    cuts = [i - start for i in cuts] + [len(ring)]
+    return [rotated[first:last + 1] for first, last in zip(cuts[:-1], cuts[1:])]
+
+
+def drop_tolerances(arc: np.ndarray) -> np.ndarray:
+    """Get the Douglas-Peucker tolerance at which each point of an arc is dropped.
+
+    The tolerance of a point is never larger than the tolerance of the point that split the arc before it, so the
+    points kept with any tolerance are the same ones Douglas-Peucker would keep with it. The end points are never
+    dropped, and neither are the two most important points of a closed arc, so it stays at least a triangle.
+
+    Args:
+        arc (np.ndarray): The quantized points of the arc.
+
+    Returns:
+        np.ndarray: The tolerance of each point, in the quantized units.
+    """
+    points = arc.astype(np.float64)
+    tolerances = np.zeros(len(points))
+    tolerances[0] = tolerances[-1] = np.inf
+    stack = [(0, len(points) - 1, np.inf)]
+    while stack:
+        first, last, limit = stack.pop()
+        if last - first < 2:
+            continue
+        inner = points[first + 1:last]
+        start = points[first]
+        dx, dy = points[last] - start
+        length = math.hypot(dx, dy)
+        if length == 0:
+            distances = np.hypot(inner[:, 0] - start[0], inner[:, 1] - start[1])
+        else:
+            distances = np.abs(dx * (inner[:, 1] - start[1]) - dy * (inner[:, 0] - start[0])) / length
+        farthest = first + 1 + int(np.argmax(distances))
+        tolerances[farthest] = min(distances[farthest - first - 1], limit)
+        stack.append((first, farthest, tolerances[farthest]))
+        stack.append((farthest, last, tolerances[farthest]))
+    if len(points) > 3 and (arc[0] == arc[-1]).all():
+        tolerances[np.argsort(tolerances[1:-1])[-2:] + 1] = np.inf
+    return tolerances
+
+
+def _ring_points(ring: list[int], arcs: list[np.ndarray], masks: list[np.ndarray] | None = None) -> np.ndarray:
+    # join the arcs of a ring (a negative index ~i is the arc i reversed), without the closing point
+    parts = []
+    for index in ring:
+        arc = arcs[index if index >= 0 else ~index]
+        if masks is not None:
+            arc = arc[masks[index if index >= 0 else ~index]]
+        parts.append(arc[:-1] if index >= 0 else arc[::-1][:-1])
+    return np.concatenate(parts)
+
+
+def _arc_indices(polygon: list[list[int]]) -> set[int]:
+    # the arcs of a polygon, without their directions
+    return {index if index >= 0 else ~index for ring in polygon for index in ring}
+
+
+def _valid_polygons(polygons: list[list[list[int]]], arcs: list[np.ndarray], masks: list[np.ndarray]) -> np.ndarray:
+    # whether each polygon is valid with the points kept by the masks (a ring with less than 3 points never is)
+    rings = [[_ring_points(ring, arcs, masks) for ring in polygon] for polygon in polygons]
+    valid = np.array([all(len(ring) >= 3 for ring in polygon) for polygon in rings], dtype=bool)
+    shapes = [shapely.Polygon(polygon[0], polygon[1:]) for polygon, ok in zip(rings, valid) if ok]
+    valid[valid] = shapely.is_valid(shapes)
+    return valid
+
+
+def _simplify(arcs: list[np.ndarray], tolerances: list[np.ndarray], polygons: list[list[list[int]]],
+              previous: list[np.ndarray], tolerance: float) -> list[np.ndarray]:
+    # the points of each arc kept with the tolerance. The arcs of the polygons that would become invalid fall back to
+    # the previous (finer) level, which changes the polygons sharing the arcs too, so they are tested again until all
+    # the polygons are valid or all the arcs of the invalid ones have fallen back
+    masks = [arc_tolerances > tolerance for arc_tolerances in tolerances]
+    arc_polygons = [[] for _ in arcs]
+    for p, polygon in enumerate(polygons):
+        for index in _arc_indices(polygon):
+            arc_polygons[index].append(p)
+
+    fallen_back = np.zeros(len(arcs), dtype=bool)
+    pending = list(range(len(polygons)))
+    while pending:
+        valid = _valid_polygons([polygons[p] for p in pending], arcs, masks)
+        changed = set()
+        for p in np.asarray(pending)[~valid]:
+            for index in _arc_indices(polygons[p]):
+                if not fallen_back[index]:
+                    fallen_back[index] = True
+                    masks[index] = previous[index]
+                    changed.add(index)
+        pending = sorted({p for index in changed for p in arc_polygons[index]})
+    return masks
+
+
+def _to_coordinates(points: np.ndarray, precision: int) -> list:
+    closed = np.concatenate([points, points[:1]])
+    if precision <= 0:
+        return (closed * 10**-precision).tolist()
+    return np.round(closed / 10**precision, precision).tolist()
+
+
+def encode_stand_map(feature_collection: dict, precision: int = MAP_PRECISION,
+                     tolerance: float = MAP_ZOOM_TOLERANCES[0] if MAP_ZOOM_TOLERANCES else 0.0,
+                     topology: bool = MAP_TOPOLOGY) -> dict:
+    """Encode the map of the stands compactly.
+
+    Args:
+        feature_collection (dict): The GeoJSON feature collection of the stands (polygons or multipolygons).
+        precision (int, optional): How many decimals of the coordinates are kept. Defaults to MAP_PRECISION.
+        tolerance (float, optional): The simplification tolerance in meters. Defaults to the first (finest) one in
+            MAP_ZOOM_TOLERANCES.
+        topology (bool, optional): Whether to encode the map as a TopoJSON topology. Defaults to MAP_TOPOLOGY.
+
+    Returns:
+        dict: The encoded map, a GeoJSON feature collection or a TopoJSON topology, with the tolerance and the
+            precision it was encoded with.
+    """
+    features = feature_collection["features"]
+    # the quantized rings of each polygon of each stand (the holes that collapsed are left out)
+    quantized = [
+        [[ring for i, ring in enumerate(map(lambda ring: quantize_ring(ring, precision), polygon))
+          if i == 0 or len(ring) >= 3] for polygon in _polygons(feature["geometry"])]
+        for feature in features
+    ]
+    junctions = find_junctions([ring for polygons in quantized for polygon in polygons for ring in polygon])
+
+    # cut the rings into arcs, each arc stored only once
+    arcs = []
+    arc_index = {}
+
+    def index_arc(arc: list[tuple[int, int]]) -> int:
+        key = tuple(arc)
+        if key in arc_index:
+            return arc_index[key]
+        if key[::-1] in arc_index:
+            return ~arc_index[key[::-1]]
+        arc_index[key] = len(arcs)
+        arcs.append(np.array(arc, dtype=np.int64))
+        return len(arcs) - 1
+
+    shapes = [
+        [[[index_arc(arc) for arc in cut_ring(ring, junctions)] for ring in polygon] for polygon in polygons]
+        for polygons in quantized
+    ]
+    polygons = [polygon for shape in shapes for polygon in shape]
+
+    # the points kept with the tolerance, the quantized points are kept where the simplified polygons are invalid
+    arc_tolerances = [drop_tolerances(arc) for arc in arcs]
+    unsimplified = [np.ones(len(arc), dtype=bool) for arc in arcs]
+    masks = _simplify(arcs, arc_tolerances, polygons, unsimplified, tolerance * 10**precision)
+
+    header = {key: value for key, value in feature_collection.items() if key not in ("type", "features")}
+    header["precision"] = precision
+    header["tolerance"] = tolerance
+    if topology:
+        return _encode_topology(features, header, shapes, arcs, masks, precision)
+
+    def coordinates(shape: list) -> list:
+        return [[_to_coordinates(_ring_points(ring, arcs, masks), precision) for ring in polygon] for polygon in shape]
+
+    encoded = {"type": "FeatureCollection", **header}
+    encoded["features"] = [
+        {**feature, "geometry": _geometry(feature["geometry"]["type"], coordinates(shape))}
+        for feature, shape in zip(features, shapes)
+    ]
+    return encoded
+
+
+def _encode_topology(features: list[dict], header: dict, shapes: list, arcs: list[np.ndarray],
+                     masks: list[np.ndarray], precision: int) -> dict:
+    # the arcs are stored relative to the smallest coordinates and each point as the difference to the previous one
+    origin = np.min([arc.min(axis=0) for arc in arcs], axis=0) if arcs else np.zeros(2, dtype=np.int64)
+
+    geometries = []
+    for feature, shape in zip(features, shapes):
+        geometry = {"type": feature["geometry"]["type"], "arcs": shape[0] if feature["geometry"]["type"] == "Polygon"
+                    else shape}
+        geometry["properties"] = feature.get("properties", {})
+        geometries.append(geometry)
+
+    topology = {"type": "Topology", **header}
+    topology["transform"] = {
+        "scale": [10.0**-precision, 10.0**-precision],
+        "translate": (origin * 10.0**-precision).tolist(),
+    }
+    topology["arcs"] = []
+    for arc, mask in zip(arcs, masks):
+        points = arc[mask] - origin
+        topology["arcs"].append(np.concatenate([points[:1], np.diff(points, axis=0)]).tolist())
+    topology["objects"] = {"stands": {"type": "GeometryCollection", "geometries": geometries}}
+    return topology
+
+
+def decode_stand_map(map_json: str | dict) -> dict:
+    """Decode a map of the stands encoded with encode_stand_map (or a plain GeoJSON) into a GeoJSON feature collection.
+
+    Args:
+        map_json (str | dict): The map as a JSON string or as a dict.
+
+    Returns:
+        dict: The GeoJSON feature collection of the stands.
+    """
+    data = json.loads(map_json) if isinstance(map_json, str) else map_json
+    if data.get("type") == "Topology":
+        return _decode_topology(data)
+    return data
+
+
+def stand_map_level(map_json: str | dict, level: int) -> dict:
+    """Get a zoom level of a stored map of the stands, simplified from the stored (finest) level when asked for.
+
+    Args:
+        map_json (str | dict): The map encoded with encode_stand_map, as a JSON string or as a dict.
+        level (int): The zoom level, the index of its tolerance in MAP_ZOOM_TOLERANCES. 0 is the stored map and the
+            levels past the last one are the last one.
+
+    Returns:
+        dict: The map at the zoom level, in the format of the stored map (a GeoJSON or a TopoJSON topology).
+    """
+    data = json.loads(map_json) if isinstance(map_json, str) else map_json
+    level = min(level, len(MAP_ZOOM_TOLERANCES) - 1)
+    if level <= 0:
+        return data
+    # the stored map is already quantized, so it is quantized again with the same precision
+    return encode_stand_map(decode_stand_map(data), precision=data.get("precision", MAP_PRECISION),
+                            tolerance=MAP_ZOOM_TOLERANCES[level], topology=data.get("type") == "Topology")
+
+
+def _decode_topology(topology: dict) -> dict:
+    arcs = [np.cumsum(np.asarray(arc, dtype=np.int64).reshape(-1, 2), axis=0) for arc in topology["arcs"]]
+    scale = np.asarray(topology["transform"]["scale"])
+    translate = np.asarray(topology["transform"]["translate"])
+    # round away the float errors of the scaling
+    digits = max(0, round(-math.log10(scale[0])))
+
+    def ring_coordinates(ring: list[int]) -> list:
+        points = _ring_points(ring, arcs)
+        return np.round(np.concatenate([points, points[:1]]) * scale + translate, digits).tolist()
+
+    features = []
+    for geometry in topology["objects"]["stands"]["geometries"]:
+        polygons = [geometry["arcs"]] if geometry["type"] == "Polygon" else geometry["arcs"]
+        coordinates = [[ring_coordinates(ring) for ring in polygon] for polygon in polygons]
+        features.append({
+            "type": "Feature",
+            "properties": geometry.get("properties", {}),
+            "geometry": _geometry(geometry["type"], coordinates),
+        })
+
+    header = {key: value for key, value in topology.items() if key not in TOPOLOGY_MEMBERS}
+    return {"type": "FeatureCollection", **header, "features": features}
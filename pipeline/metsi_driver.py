@@ -5,8 +5,12 @@ Modified so that it can be run from a script, and not as a subprocess.
 
 import os
 import sys
-import copy
+import math
+import functools
+import multiprocessing
 import traceback
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from typing import Callable
 from pathlib import Path
 
@@ -20,12 +24,60 @@ from lukefi.metsi.app.app_io import parse_cli_arguments, MetsiConfiguration, gen
 from lukefi.metsi.app.app_types import SimResults
 from lukefi.metsi.domain.forestry_types import StandList
 from lukefi.metsi.app.export import export_files, export_preprocessed
+from lukefi.metsi.app.export_handlers.opt_table import opt_parquet, opt_table
 from lukefi.metsi.app.file_io import prepare_target_directory, read_stands_from_file, \
     read_full_simulation_result_dirtree, write_full_simulation_result_dirtree, read_control_module
 from lukefi.metsi.app.post_processing import post_process_alternatives
 from lukefi.metsi.app.simulator import simulate_alternatives
 from lukefi.metsi.app.console_logging import print_logline
 from lukefi.metsi.app.utils import MetsiException
+from lukefi.metsi.data.formats.forest_builder import ForestCentreBuilder
+
+from forest_data import ForestData
+
+
+# the number of worker processes the stands are simulated in, one per core by default
+METSI_WORKERS = int(os.environ.get("METSI_WORKERS", os.cpu_count() or 1))
+# without slice parameters in the control, each worker gets this many slices of the stands on average, so that the
+# workers finishing early can take another slice
+SLICES_PER_WORKER = 4
+# the default file name of the opt_parquet export
+OPT_PARQUET_FILENAME = "data.parquet"
+
+_pool: ProcessPoolExecutor | None = None
+
+
+class MetsiError(Exception):
+    """An error in a metsi run. Raised instead of printing the error and returning an error code."""
+
+
+@functools.lru_cache(maxsize=8)
+def _read_control(control_file: str, modified: int) -> dict:
+    _ = modified  # a part of the cache key, so the control file is read again if it changes
+    return read_control_module(control_file)
+
+
+def load_control(control_file: str) -> dict:
+    """Read the control structure, parsing each control file only once (until it is modified).
+
+    The same control structure is shared by all the runs, metsi only reads it (as it does for all the slices of a run).
+    """
+    try:
+        return _read_control(str(Path(control_file).resolve()), os.stat(control_file).st_mtime_ns)
+    except OSError as e:
+        raise MetsiError(f"Application control file path '{control_file}' can not be read.") from e
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        raise MetsiError(f"Application control file '{control_file}' can not be parsed: {e}") from e
+
+
+def read_stands(config: MetsiConfiguration, control: dict, forest_data: ForestData | None = None) -> StandList:
+    """Read the stands from the input file, or build them from forest data the data pipeline already has in memory"""
+    conversions = control.get('conversions', {})
+    if forest_data is None:
+        return read_stands_from_file(config, conversions)
+    # the same builder metsi uses for XML input files, but the document is handed over in memory
+    builder_flags = {'strata_origin': config.strata_origin}
+    return ForestCentreBuilder(builder_flags, conversions, forest_data.to_xml()).build()
 
 
 def preprocess(config: MetsiConfiguration, control: dict, stands: StandList) -> StandList:
@@ -53,10 +105,123 @@ def post_process(config: MetsiConfiguration, control: dict, data: SimResults) ->
     return result
 
 
-def export(config: MetsiConfiguration, control: dict, data: SimResults) -> None:
+def _get_pool() -> ProcessPoolExecutor:
+    # the workers stay alive between the runs, so metsi is imported and the control parsed only once in each
+    global _pool
+    if _pool is None:
+        # spawn instead of fork, since the pipeline runs in the API process that has threads
+        _pool = ProcessPoolExecutor(max_workers=METSI_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def _map_slices(config: MetsiConfiguration, control_file: str, slices: list[StandList]) -> list[SimResults]:
+    # a worker that dies (e.g., runs out of memory inside metsi) breaks the whole pool, so a broken pool is replaced
+    # with a new one, map returns the results in the order of the slices
+    global _pool
+    args = ([config] * len(slices), [control_file] * len(slices), slices)
+    try:
+        results = _get_pool().map(_simulate_slice, *args)
+    except BrokenProcessPool:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+        results = _get_pool().map(_simulate_slice, *args)
+    return list(results)
+
+
+def _simulate_slice(config: MetsiConfiguration, control_file: str, stands: StandList) -> SimResults:
+    # runs in a worker process, the control is read there since it can not always be pickled (e.g., control.py)
+    return simulate_alternatives(config, load_control(control_file), stands)
+
+
+def slice_stands(control: dict, stands: StandList, workers: int) -> list[StandList]:
+    """Split the stands into slices by the slice_* parameters of the control, or evenly for the workers."""
+    pct = control.get('slice_percentage')
+    sz = control.get('slice_size')
+    if pct is not None:
+        return slice_stands_by_percentage(stands, pct)
+    if sz is not None:
+        return slice_stands_by_size(stands, sz)
+    if workers == 1 or len(stands) < 2:
+        return [stands]
+    return slice_stands_by_size(stands, math.ceil(len(stands) / (workers * SLICES_PER_WORKER)))
+
+
+def merge_results(results: list[SimResults]) -> SimResults:
+    """Merge the simulation results of the slices in the order of the slices (i.e., in the order of the stands)."""
+    merged = {}
+    for result in results:
+        merged.update(result)
+    return merged
+
+
+def simulate_slices(config: MetsiConfiguration, control_file: str, control: dict, stands: StandList) -> SimResults:
+    """Simulate the stands in slices in parallel in the worker processes and merge the results.
+
+    The result is the same as simulating all the stands at once, regardless of the order the slices finish in.
+    """
+    print_logline("Simulating alternatives...")
+    slices = slice_stands(control, stands, METSI_WORKERS)
+    if METSI_WORKERS == 1 or len(slices) == 1:
+        results = [simulate_alternatives(config, control, stand_slice) for stand_slice in slices]
+    else:
+        results = _map_slices(config, control_file, slices)
+    result = merge_results(results)
+    if config.state_output_container is not None or config.derived_data_output_container is not None:
+        print_logline(f"Writing simulation results to '{config.target_directory}'")
+        write_full_simulation_result_dirtree(result, config)
+    return result
+
+
+def run_modes(config: MetsiConfiguration, control: dict, modes: list[RunMode], data):
+    """Run the given run modes in turn, each one with the result of the previous one."""
+    for mode in modes:
+        try:
+            data = mode_runners[mode](config, control, data)
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            raise MetsiError(f"Run mode {mode.name} failed: {e}") from e
+    return data
+
+
+def collective_names(control: dict) -> list[str]:
+    """Get the names of the report_collectives of the control, in the order they are declared."""
+    for operation, params in control.get('operation_params', {}).items():
+        # the operations are named in control.yaml, but given as functions in control.py
+        if getattr(operation, '__name__', operation) == 'report_collectives':
+            return [name for declaration in params for name in declaration]
+    return []
+
+
+def table_columns(control: dict, decl: dict) -> list[str]:
+    """Get the columns of a table export: its xvariables, or all the report_collectives if it has none."""
+    return decl.get('xvariables') or collective_names(control)
+
+
+def opt_parquet_filenames(control: dict) -> list[str]:
+    """Get the names of the files of the opt_parquet exports of the control."""
+    return [
+        decl.get('filename', OPT_PARQUET_FILENAME) for decl in control.get('export') or []
+        if decl.get('format') == 'opt_parquet'
+    ]
+
+
+def export(config: MetsiConfiguration, control: dict, data: SimResults) -> dict:
+    """Write the export files, and return the in-memory exports (see table_exporters) by format."""
     print_logline("Exporting simulation results...")
-    if control['export']:
-        export_files(config, control['export'], data)
+    declarations = control['export'] or []
+    metsi_declarations = [
+        decl for decl in declarations
+        if decl.get('format') not in table_exporters and decl.get('format') not in file_exporters
+    ]
+    if metsi_declarations:
+        export_files(config, metsi_declarations, data)
+    for decl in declarations:
+        if decl.get('format') in file_exporters:
+            filepath = Path(config.target_directory, decl.get('filename', OPT_PARQUET_FILENAME))
+            file_exporters[decl['format']](filepath, data, table_columns(control, decl))
+    return {
+        decl['format']: table_exporters[decl['format']](data, table_columns(control, decl))
+        for decl in declarations if decl.get('format') in table_exporters
+    }
 
 
 def export_prepro(config: MetsiConfiguration, control: dict, data: StandList) -> StandList:
@@ -83,6 +248,8 @@ def remove_existing_export_files(config: MetsiConfiguration, control: dict):
                 cda = decl.get('cda_filename', "data.cda")
                 safe_targets.add(xda)
                 safe_targets.add(cda)
+            elif fmt in file_exporters:
+                safe_targets.add(decl.get('filename', OPT_PARQUET_FILENAME))
             elif 'filename' in decl:
                 safe_targets.add(decl['filename'])
 
@@ -101,6 +268,16 @@ def remove_existing_export_files(config: MetsiConfiguration, control: dict):
             print_logline(f"Warning: Failed to delete file {file_path}: {e}")
 
 
+# the export formats that are not written into files, but handed over to the data pipeline as tables
+table_exporters: dict[str, Callable] = {
+    'opt_table': opt_table
+}
+
+# the export formats of the data pipeline that are written into files, e.g., when the results are read from disk
+file_exporters: dict[str, Callable] = {
+    'opt_parquet': opt_parquet
+}
+
 mode_runners: dict[RunMode, Callable] = {
     RunMode.PREPROCESS: preprocess,
     RunMode.EXPORT_PREPRO: export_prepro,
@@ -110,19 +287,18 @@ mode_runners: dict[RunMode, Callable] = {
 }
 
 
-def run_metsi(arguments) -> int:
+def run_metsi(arguments, forest_data: ForestData | None = None) -> dict:
     '''
     A little confusing naming, but that's how it is in metsi/lukefi/metsi/app/metsi.py. 
     Arguments can come from other sources than cli too.
+    If forest_data is given, the stands are built from it instead of reading the input file.
+    Returns the in-memory exports by format (see table_exporters), empty if the run does not end with the export.
+    Raises MetsiError if the run fails, with the original error as its cause.
     '''
     cli_arguments = parse_cli_arguments(arguments)
     control_file = \
         MetsiConfiguration.control_file if cli_arguments["control_file"] is None else cli_arguments['control_file']
-    try:
-        control_structure = read_control_module(control_file)
-    except IOError:
-        print(f"Application control file path '{control_file}' can not be read. Aborting....")
-        return 1
+    control_structure = load_control(control_file)
     try:
         app_config = generate_application_configuration({**cli_arguments, **control_structure['app_configuration']})
         prepare_target_directory(app_config.target_directory)
@@ -132,57 +308,40 @@ def run_metsi(arguments) -> int:
         remove_existing_export_files(app_config, control_structure)
 
         if app_config.run_modes[0] in [RunMode.PREPROCESS, RunMode.SIMULATE]:
-            # 1) read full stand list
-            full_stands = read_stands_from_file(app_config, control_structure.get('conversions', {}))
-
-            # 2) split it if slice_* parameters are given
-            pct = control_structure.get('slice_percentage')
-            sz = control_structure.get('slice_size')
-            if pct is not None:
-                stand_sublists = slice_stands_by_percentage(full_stands, pct)
-            elif sz is not None:
-                stand_sublists = slice_stands_by_size(full_stands, sz)
-            else:
-                stand_sublists = [full_stands]
-
-            input_data: list[StandList] | SimResults = stand_sublists
-
+            input_data: StandList | SimResults = read_stands(app_config, control_structure, forest_data)
         elif app_config.run_modes[0] in [RunMode.POSTPROCESS, RunMode.EXPORT]:
             input_data = read_full_simulation_result_dirtree(app_config.input_path)
         else:
             raise MetsiException("Can not determine input data for unknown run mode")
-    except Exception:  # pylint: disable=broad-exception-caught
-        traceback.print_exc()
-        print("Aborting run...")
-        return 1
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        raise MetsiError(f"Reading the input failed: {e}") from e
 
-    # now run each slice in turn
-    for _, stands in enumerate(input_data):
-        # -- optional slice folder (disabled for now) --
-        # slice_target = os.path.join(app_config.target_directory, f"slice_{slice_idx+1}")
-        # prepare_target_directory(slice_target)
-
-        # use original directory instead (to overwrite for now)
-        prepare_target_directory(app_config.target_directory)
-
-        # clone config so we don’t stomp on the original
-        cfg = copy.copy(app_config)
-        cfg.target_directory = app_config.target_directory
-
-        # feed this sub‐list of stands through the normal run_modes
-        current = stands
-        for mode in cfg.run_modes:
-            runner = mode_runners[mode]
-            current = runner(cfg, control_structure, current)
+    modes = app_config.run_modes
+    if RunMode.SIMULATE not in modes:
+        output = run_modes(app_config, control_structure, modes, input_data)
+    else:
+        # the stands are preprocessed all at once, simulated in slices in parallel (see simulate_slices), and the
+        # merged results are post-processed and exported all at once, so the slices do not overwrite each other
+        simulate_at = modes.index(RunMode.SIMULATE)
+        stands = run_modes(app_config, control_structure, modes[:simulate_at], input_data)
+        try:
+            result = simulate_slices(app_config, control_file, control_structure, stands)
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            raise MetsiError(f"Run mode {RunMode.SIMULATE.name} failed: {e}") from e
+        output = run_modes(app_config, control_structure, modes[simulate_at + 1:], result)
 
     _, dirs, files = next(os.walk(app_config.target_directory))
     if len(dirs) == 0 and len(files) == 0:
         os.rmdir(app_config.target_directory)
 
     print_logline("Exiting successfully")
-    return 0
+    return output if modes[-1] == RunMode.EXPORT else {}
 
 
 if __name__ == '__main__':
-    code = run_metsi(sys.argv[1:])
-    sys.exit(code)
\ No newline at end of file
+    try:
+        run_metsi(sys.argv[1:])
+    except MetsiError:
+        traceback.print_exc()
+        print("Aborting run...")
+        sys.exit(1)
\ No newline at end of file
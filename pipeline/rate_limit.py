@@ -0,0 +1,75 @@
+"""A token bucket rate limiter shared by all the processes (e.g., uvicorn workers) on the same machine.
+
+The state of the buckets is kept in a small SQLite database, so every worker takes its tokens from the same buckets.
+Each bucket is refilled with a fixed rate up to its burst size, and a request waits until there is a token for it.
+SQLite's write lock makes taking a token atomic between the processes.
+"""
+
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+
+class RateLimiter:
+    """A token bucket rate limiter with the buckets stored in SQLite."""
+
+    def __init__(self, path: str, rate: float, burst: float | None = None):
+        """Initialize the rate limiter. The database is created when the first token is taken.
+
+        Args:
+            path (str): The path of the SQLite database shared by the processes.
+            rate (float): How many tokens (requests) per second each bucket is refilled with.
+            burst (float | None, optional): The size of a bucket, i.e., how many requests can be made at once after
+                an idle period. Defaults to the rate (but at least 1).
+
+        Raises:
+            ValueError: If the rate is not positive or the burst is less than 1, since no token could ever be taken.
+        """
+        if not rate > 0:
+            raise ValueError(f"The rate of a rate limiter must be positive, got {rate}")
+        if burst is not None and not burst >= 1:
+            raise ValueError(f"The burst of a rate limiter must be at least 1, got {burst}")
+        self.path = path
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate)
+        self._initialized = False
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        with self._lock:
+            if not self._initialized:
+                Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+                connection = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+                connection.execute("PRAGMA journal_mode=WAL")
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, tokens REAL, updated REAL)")
+                self._initialized = True
+                return connection
+        return sqlite3.connect(self.path, timeout=60, isolation_level=None)
+
+    def acquire(self, name: str):
+        """Take a token from a bucket, waiting until one is available.
+
+        Args:
+            name (str): The name of the bucket, e.g., the host of an upstream API.
+        """
+        while True:
+            connection = self._connect()
+            try:
+                # take the write lock right away so no other process can read the bucket in between
+                connection.execute("BEGIN IMMEDIATE")
+                now = time.time()
+                row = connection.execute("SELECT tokens, updated FROM buckets WHERE name = ?", (name,)).fetchone()
+                tokens = self.burst if row is None else min(self.burst, row[0] + (now - row[1]) * self.rate)
+                wait = 0.0 if tokens >= 1 else (1 - tokens) / self.rate
+                if wait == 0.0:
+                    tokens = tokens - 1
+                connection.execute(
+                    "INSERT OR REPLACE INTO buckets (name, tokens, updated) VALUES (?, ?, ?)", (name, tokens, now))
+                connection.execute("COMMIT")
+            finally:
+                connection.close()
+            if wait == 0.0:
+                return
+            time.sleep(wait)
@@ -0,0 +1,64 @@
+"""Map images of the stands of the forest problems, drawn on demand (see stand_map.py), and the zoom levels of the maps,
+simplified on demand (see map_encoding.py)."""
+
+import json
+from typing import Annotated
+
+from desdeo.api.db import get_session
+from desdeo.api.models import ForestProblemMetaData, ProblemDB, ProblemMetaDataDB
+from desdeo.api.routers.user_authentication import get_user, verify_password
+from fastapi import APIRouter, Depends, HTTPException, Response
+from fastapi.security import HTTPBasic, HTTPBasicCredentials
+from sqlmodel import Session, select
+
+from map_encoding import stand_map_level
+from stand_map import get_stand_map
+
+router = APIRouter(prefix="/maps")
+security = HTTPBasic()
+
+
+def _map_json(problem_id: int, credentials: HTTPBasicCredentials, session: Session) -> str:
+    # the stored map of the stands of a forest problem, only for the DESDEO user who owns the problem
+    user = get_user(session=session, username=credentials.username)
+    if user is None or not verify_password(credentials.password, user.password_hash):
+        raise HTTPException(status_code=401, detail="Unable to verify credentials.",
+                            headers={"WWW-Authenticate": "Basic"})
+
+    problem = session.get(ProblemDB, problem_id)
+    if problem is None or problem.user_id != user.id:
+        raise HTTPException(status_code=404, detail="Problem not found.")
+
+    # the GeoJSON of the stands is stored with the forest problem's metadata
+    metadata = session.exec(select(ProblemMetaDataDB).where(ProblemMetaDataDB.problem_id == problem_id)).first()
+    forest_metadata = None if metadata is None else session.exec(
+        select(ForestProblemMetaData).where(ForestProblemMetaData.metadata_id == metadata.id)).first()
+    if forest_metadata is None:
+        raise HTTPException(status_code=404, detail="The problem has no map.")
+    return forest_metadata.map_json
+
+
+@router.get("/{problem_id}.png")
+async def stand_map(
+    problem_id: int,
+    credentials: Annotated[HTTPBasicCredentials, Depends(security)],
+    session: Annotated[Session, Depends(get_session)],
+) -> Response:
+    """The map of the stands of a forest problem. Only the DESDEO user who owns the problem can see it."""
+    return Response(await get_stand_map(_map_json(problem_id, credentials, session)), media_type="image/png")
+
+
+@router.get("/{problem_id}.json")
+def stand_map_zoom_level(
+    problem_id: int,
+    credentials: Annotated[HTTPBasicCredentials, Depends(security)],
+    session: Annotated[Session, Depends(get_session)],
+    level: int = 0,
+) -> Response:
+    """The map of the stands of a forest problem at a zoom level (the index of its tolerance in MAP_ZOOM_TOLERANCES).
+
+    Level 0 is the stored map, the coarser levels are simplified from it. Only the DESDEO user who owns the problem
+    can see it.
+    """
+    map_json = stand_map_level(_map_json(problem_id, credentials, session), level)
+    return Response(json.dumps(map_json, separators=(",", ":")), media_type="application/json")
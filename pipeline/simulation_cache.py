@@ -0,0 +1,191 @@
+"""A persistent cache of the metsi simulation results of single stands.
+
+The simulation of a stand only depends on the stand's data, the control file, the parameter files and the metsi
+modules UTOPIA patches (the export handlers and the XML parser in metsi-patch), so the results of a stand are cached by
+the hash of the stand's XML (as it is given to metsi) and a fingerprint of the control file, the parameter files and
+the patched modules (see simulation_fingerprint). A stand whose data or simulation settings have not changed since
+it was last simulated is not simulated again.
+
+The cached results of a stand are the parts of the exports the later stages of the pipeline read: the stand's rows of
+the opt_table export (see convert_to_opt.py) and the stand's block of trees.txt (see write_trees_json.py). After the
+stands missing from the cache have been simulated, the table and trees.txt are formed with the results of all the
+stands, in the order of the stands in the forest data, and the table is written into the files of the opt_parquet
+exports too. The other export files only have the simulated stands.
+
+The cache is bounded by size with the environment variable SIMULATION_CACHE_SIZE (bytes, defaults to 1 GiB).
+"""
+
+import hashlib
+import importlib.util
+import json
+import os
+import zlib
+from pathlib import Path
+
+import polars as pl
+
+from disk_cache import DiskCache
+from forest_data import ForestData, serialize_stand
+
+# the directory of the parameter files metsi reads (as given in the control file), in the root of the repository
+PARAMETER_FILES = str(Path(__file__).resolve().parent.parent / "data" / "parameter_files")
+# the metsi modules that are patched from metsi-patch and change the results that are cached
+PATCHED_MODULES = [
+    "lukefi.metsi.app.export_handlers.opt_table",
+    "lukefi.metsi.app.export_handlers.rm_timber",
+    "lukefi.metsi.data.formats.smk_util",
+]
+
+simulation_cache = DiskCache("simulations", max_bytes=int(os.environ.get("SIMULATION_CACHE_SIZE", 1024 * 1024 * 1024)))
+
+
+def simulation_fingerprint(control_file: str, parameter_dir: str = PARAMETER_FILES) -> str:
+    """Get a fingerprint of the simulation settings: the control file, the parameter files and the sources of the
+    patched metsi modules.
+
+    Args:
+        control_file (str): The path of metsi's control file (control.yaml or control.py).
+        parameter_dir (str, optional): The directory of the parameter files. Defaults to PARAMETER_FILES.
+
+    Returns:
+        str: The SHA-256 hash of the names and the contents of the files.
+    """
+    digest = hashlib.sha256()
+
+    def update(name: str, content: bytes):
+        digest.update(f"{name}\n{len(content)}\n".encode())
+        digest.update(content)
+
+    update(Path(control_file).name, Path(control_file).read_bytes())
+    # the names relative to the directory, so the fingerprint does not depend on where the repository is
+    for path in sorted(path for path in Path(parameter_dir).rglob("*") if path.is_file()):
+        update(path.relative_to(parameter_dir).as_posix(), path.read_bytes())
+    for module in PATCHED_MODULES:
+        spec = importlib.util.find_spec(module)
+        update(module, Path(spec.origin).read_bytes() if spec is not None and spec.origin else b"")
+    return digest.hexdigest()
+
+
+def _identifier(value: str) -> str:
+    # the stand identifiers may be written as floats in the export files
+    try:
+        return str(int(float(value)))
+    except ValueError:
+        return value
+
+
+def _is_year_line(columns: list[str]) -> bool:
+    # the first line of a year in trees.txt has the stand identifier, the number of the schedule and the year
+    if len(columns) != 3:
+        return False
+    try:
+        int(columns[1]), int(columns[2])
+    except ValueError:
+        return False
+    return True
+
+
+def lookup_results(forest_data: ForestData, fingerprint: str) -> tuple[list[str], dict[str, dict], list[int]]:
+    """Get the cached simulation results of the stands.
+
+    Args:
+        forest_data (ForestData): The forest data of a real estate.
+        fingerprint (str): The fingerprint of the simulation settings (see simulation_fingerprint).
+
+    Returns:
+        tuple[list[str], dict[str, dict], list[int]]: The cache key of each stand, the cached results by stand
+            identifier, and the indices of the stands that are not in the cache and have to be simulated.
+    """
+    keys = [
+        hashlib.sha256(f"{fingerprint}\n{serialize_stand(stand)}".encode()).hexdigest() for stand in forest_data.stands
+    ]
+    results = {}
+    missing = []
+    for i, (stand_id, key) in enumerate(zip(forest_data.ids, keys)):
+        cached = simulation_cache.get(key)
+        if cached is None:
+            missing.append(i)
+        else:
+            results[_identifier(stand_id)] = json.loads(zlib.decompress(cached))
+    return keys, results, missing
+
+
+def read_results(result_dir: str, stand_ids: list[str], table: pl.DataFrame) -> dict[str, dict]:
+    """Split the exports of a metsi run into the results of each stand.
+
+    Args:
+        result_dir (str): The directory with the trees.txt file of the run.
+        stand_ids (list[str]): The IDs of the simulated stands. A stand missing from the exports (e.g., left out by
+            the preprocessing) gets empty results.
+        table (pl.DataFrame): The opt_table export of the run, the stand identifier in the first column.
+
+    Raises:
+        ValueError: If trees.txt has lines outside of the blocks of the stands, or a stand has more than one block.
+
+    Returns:
+        dict[str, dict]: The column names of the table ("columns"), the stand's rows of the table ("rows") and the
+            lines of the block in trees.txt ("trees") of each stand, by stand identifier.
+    """
+    def empty() -> dict:
+        return {"columns": table.columns, "rows": [], "trees": []}
+
+    results = {_identifier(stand_id): empty() for stand_id in stand_ids}
+
+    for row in table.iter_rows():
+        results.setdefault(_identifier(str(row[0])), empty())["rows"].append(list(row))
+
+    # every schedule starts with a year line ("stand schedule year"), so the block of a stand runs from its first year
+    # line up to the year line of the next stand (the empty lines can not tell where a block ends, as a year with no
+    # trees also gives an empty line)
+    stand_id = None
+    with Path(f"{result_dir}/trees.txt").open() as file:
+        for number, line in enumerate(file, start=1):
+            columns = line.split()
+            if _is_year_line(columns) and _identifier(columns[0]) != stand_id:
+                stand_id = _identifier(columns[0])
+                if stand_id not in results or len(results[stand_id]["trees"]) > 0:
+                    raise ValueError(f"Line {number} of trees.txt starts an unexpected block of the stand {stand_id}")
+            elif stand_id is None:
+                raise ValueError(f"Line {number} of trees.txt is before the first year line: {line!r}")
+            results[stand_id]["trees"].append(line.rstrip("\n"))
+    return results
+
+
+def store_results(keys: list[str], stand_ids: list[str], results: dict[str, dict]):
+    """Store the simulation results of the stands in the cache.
+
+    Args:
+        keys (list[str]): The cache key of each stand (see lookup_results).
+        stand_ids (list[str]): The IDs of the stands.
+        results (dict[str, dict]): The results by stand identifier (see read_results).
+    """
+    for key, stand_id in zip(keys, stand_ids):
+        simulation_cache.put(key, zlib.compress(json.dumps(results[_identifier(stand_id)]).encode()))
+
+
+def write_results(
+    result_dir: str, stand_ids: list[str], results: dict[str, dict], parquet_filenames: list[str] | None = None
+) -> pl.DataFrame:
+    """Write the trees.txt file and form the opt_table export with the results of all the stands.
+
+    Args:
+        result_dir (str): The directory to write the files in.
+        stand_ids (list[str]): The IDs of the stands, in the order they are written in.
+        results (dict[str, dict]): The results by stand identifier (see read_results).
+        parquet_filenames (list[str] | None, optional): The files of the opt_parquet exports. They are written with
+            the table, so they do not only have the simulated stands. Defaults to None.
+
+    Returns:
+        pl.DataFrame: The rows of all the stands, as the opt_table export of a single run would have them.
+    """
+    stand_results = [results[_identifier(stand_id)] for stand_id in stand_ids]
+    columns = stand_results[0]["columns"]
+    schema = {columns[0]: pl.Int64, **{column: pl.Float64 for column in columns[1:]}}
+    table = pl.DataFrame([row for result in stand_results for row in result["rows"]], schema=schema, orient="row")
+    with Path(f"{result_dir}/trees.txt").open(mode="w") as file:
+        for result in stand_results:
+            for line in result["trees"]:
+                file.write(line + "\n")
+    for filename in parquet_filenames or []:
+        table.write_parquet(f"{result_dir}/{filename}")
+    return table
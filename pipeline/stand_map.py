@@ -0,0 +1,151 @@
+"""On-demand map images of the stands of a forest problem.
+
+The maps are not drawn while the data pipeline runs. Instead, a map is drawn from the GeoJSON stored with the forest
+problem (ForestProblemMetaData.map_json) only when it is asked for, e.g., from localhost:[PORT]/maps/<problem id>.png
+(see routers/maps.py). The drawing is done in a background worker process, so it does not hold up the API or the
+pipeline, and the images are cached by the hash of the GeoJSON they were drawn from. matplotlib is only imported in the
+worker.
+
+The map cache is configured with the environment variables MAP_CACHE_SIZE (bytes, defaults to 256 MiB) and
+MAP_WORKERS (the number of worker processes, defaults to 1).
+
+A map can also be drawn from a GeoJSON file without the API:
+
+    python stand_map.py -g path/to/Lastname.geojson -o stands.png
+"""
+
+import asyncio
+import hashlib
+import io
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from disk_cache import DiskCache
+from map_encoding import decode_stand_map
+
+MAP_WORKERS = int(os.environ.get("MAP_WORKERS", "1"))
+# the resolution of the map images
+MAP_DPI = 150
+
+# the map images are cached by the hash of the GeoJSON they were drawn from
+map_cache = DiskCache("maps", max_bytes=int(os.environ.get("MAP_CACHE_SIZE", 256 * 1024 * 1024)))
+
+_pool: ProcessPoolExecutor | None = None
+# the maps being drawn, by the hash of their GeoJSON, so the same map is not drawn twice at the same time
+_pending: dict[str, Future] = {}
+_lock = threading.Lock()
+
+
+def render_stand_map(geojson: str) -> bytes:
+    """Draw a map of the stands in a GeoJSON.
+
+    The stands are colored by their real estate and labeled with their stand numbers.
+
+    Args:
+        geojson (str): The map of the stands, as formed by the data pipeline (see map_encoding.py).
+
+    Returns:
+        bytes: The map as a PNG image.
+    """
+    # the plotting libraries are only needed here, so they are only imported by the worker process
+    import geopandas as gpd
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    data = decode_stand_map(geojson)
+    stands = gpd.GeoDataFrame.from_features(data["features"])
+
+    fig, ax = plt.subplots(figsize=(8, 8))
+    if len(stands) > 0:
+        # the stands of each real estate in their own color
+        stands.plot(ax=ax, column="estate_code", categorical=True, legend=True, cmap="Greens", alpha=0.7,
+                    edgecolor="black", linewidth=0.5, legend_kwds={"loc": "best", "fontsize": 8})
+        # the stand numbers in the middle of the stands
+        for number, point in zip(stands["number"], stands.geometry.representative_point()):
+            ax.annotate(str(number), (point.x, point.y), ha="center", va="center", fontsize=6)
+    ax.set_axis_off()
+    ax.set_title("Stands")
+
+    image = io.BytesIO()
+    fig.savefig(image, format="png", dpi=MAP_DPI, bbox_inches="tight")
+    plt.close(fig)
+    return image.getvalue()
+
+
+def _render_into_cache(key: str, geojson: str) -> bytes:
+    # runs in the worker process, the cache is safe to write from several processes
+    image = render_stand_map(geojson)
+    map_cache.put(key, image)
+    return image
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn instead of fork, since the API process has threads (and possibly open connections)
+        _pool = ProcessPoolExecutor(max_workers=MAP_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def _submit(key: str, geojson: str) -> Future:
+    # a worker that dies (e.g., runs out of memory) breaks the whole pool, so a broken pool is replaced with a new one
+    global _pool
+    try:
+        return _get_pool().submit(_render_into_cache, key, geojson)
+    except BrokenProcessPool:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+        return _get_pool().submit(_render_into_cache, key, geojson)
+
+
+def map_key(geojson: str) -> str:
+    """Get the cache key of the map of a GeoJSON.
+
+    Args:
+        geojson (str): The GeoJSON of the stands.
+
+    Returns:
+        str: The SHA-256 hash of the GeoJSON.
+    """
+    return hashlib.sha256(geojson.encode()).hexdigest()
+
+
+async def get_stand_map(geojson: str) -> bytes:
+    """Get the map of the stands in a GeoJSON, drawing it in the background worker if it is not in the cache.
+
+    Args:
+        geojson (str): The GeoJSON of the stands.
+
+    Returns:
+        bytes: The map as a PNG image.
+    """
+    key = map_key(geojson)
+    image = map_cache.get(key)
+    if image is not None:
+        return image
+
+    with _lock:
+        future = _pending.get(key)
+        if future is None:
+            future = _submit(key, geojson)
+            _pending[key] = future
+            future.add_done_callback(lambda _: _pending.pop(key, None))
+    return await asyncio.wrap_future(future)
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+    from pathlib import Path
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-g", dest="geojson", help="Path to the GeoJSON file of the stands.", type=str)
+    parser.add_argument("-o", dest="output", help="Path of the PNG image to write.", type=str, default="stands.png")
+    args = parser.parse_args(args=None if sys.argv[1:] else ["--help"])
+
+    Path(args.output).write_bytes(render_stand_map(Path(args.geojson).read_text()))
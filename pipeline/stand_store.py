@@ -0,0 +1,201 @@
+"""A local, spatially indexed database of stands, built from Metsäkeskus' bulk forest data downloads.
+
+Metsäkeskus also publishes its forest data as regional (e.g., municipal) bulk downloads in the forest data standard.
+The stands of the downloads are loaded into an SQLite database, with the bounding box of each stand in an R-tree, and
+the data pipeline can then answer its polygon queries locally instead of calling Metsäkeskus API. The answer is the
+same kind of ForestPropertyData XML document the API returns (the stands that intersect the polygon), so the rest of
+the pipeline does not notice the difference. The downloads have to be in the version of the standard the pipeline
+asks for (MV1.9).
+
+The pipeline uses the database when its path is given with the environment variable STAND_DATABASE. The database is
+built (or updated, a stand already in the database is replaced) with:
+
+    python stand_store.py -d data/stands.sqlite path/to/MV_Kuopio.zip path/to/MV_Siilinjarvi.xml.gz ...
+
+The downloads can be XML files, gzip compressed XML files or zip archives of XML files.
+"""
+
+import gzip
+import os
+import sqlite3
+import zipfile
+import zlib
+from collections.abc import Iterator
+from pathlib import Path
+from typing import BinaryIO
+from xml.etree import ElementTree as ET
+
+import shapely
+import shapely.geometry as geom
+
+from forest_data import StandsWriter, get_stand_rings, serialize_stand
+
+# how many stands are written into the database in one transaction
+INGEST_BATCH_SIZE = 1024
+
+
+class StandStore:
+    """An SQLite database of stands with an R-tree index of their bounding boxes."""
+
+    def __init__(self, path: str):
+        """Initialize the stand database. The database is created when the first stands are loaded into it.
+
+        Args:
+            path (str): The path of the SQLite database.
+        """
+        self.path = path
+
+    def _connect(self) -> sqlite3.Connection:
+        # every call gets its own connection, so the queries can be made from several threads
+        return sqlite3.connect(self.path, timeout=60)
+
+    def ingest(self, path: str) -> int:
+        """Load the stands of a bulk download into the database.
+
+        Args:
+            path (str): The path of the download: an XML file, a gzip compressed XML file or a zip archive of XML files.
+
+        Returns:
+            int: The number of stands loaded.
+        """
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        connection = self._connect()
+        try:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS stands "
+                "(id INTEGER PRIMARY KEY, stand_id TEXT UNIQUE NOT NULL, geometry BLOB NOT NULL, xml BLOB NOT NULL)")
+            connection.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS stand_bounds USING rtree(id, min_x, max_x, min_y, max_y)")
+
+            count = 0
+            batch = []
+            for file in _open_download(path):
+                with file:
+                    for stand in _iter_stands(file):
+                        batch.append(stand)
+                        if len(batch) == INGEST_BATCH_SIZE:
+                            count = count + _insert(connection, batch)
+                            batch.clear()
+            if len(batch) > 0:
+                count = count + _insert(connection, batch)
+        finally:
+            connection.close()
+        return count
+
+    def query(self, coordinates: list) -> list[str]:
+        """Get the stands that intersect a polygon, as Metsäkeskus API would return them.
+
+        Args:
+            coordinates (list): The coordinate pairs of the polygon.
+
+        Returns:
+            list[str]: The XML of each stand, with the prefixes of metsi (see StandsWriter).
+        """
+        polygon = geom.Polygon(coordinates)
+        min_x, min_y, max_x, max_y = polygon.bounds
+        connection = self._connect()
+        try:
+            rows = connection.execute(
+                "SELECT stands.geometry, stands.xml FROM stand_bounds JOIN stands ON stands.id = stand_bounds.id "
+                "WHERE stand_bounds.min_x <= ? AND stand_bounds.max_x >= ? "
+                "AND stand_bounds.min_y <= ? AND stand_bounds.max_y >= ? ORDER BY stands.id",
+                (max_x, min_x, max_y, min_y)).fetchall()
+        finally:
+            connection.close()
+        if len(rows) == 0:
+            return []
+
+        # the bounding boxes only give the candidates, the stands have to actually intersect the polygon
+        shapely.prepare(polygon)
+        hits = shapely.intersects(polygon, shapely.from_wkb([row[0] for row in rows]))
+        return [zlib.decompress(row[1]).decode() for row, hit in zip(rows, hits) if hit]
+
+    def write_xml(self, coordinates: list, path: str) -> bool:
+        """Write the stands that intersect a polygon into a gzip compressed ForestPropertyData XML file.
+
+        The file is written under a temporary name and moved in place when complete.
+
+        Args:
+            coordinates (list): The coordinate pairs of the polygon.
+            path (str): The path of the compressed XML file to write.
+
+        Returns:
+            bool: True if the forest data was written, False if no stands were found with the polygon.
+        """
+        stands = self.query(coordinates)
+        if len(stands) == 0:
+            return False
+
+        tmp = f"{path}.part"
+        with gzip.open(tmp, "wt", encoding="utf-8", compresslevel=5) as file, StandsWriter(file) as writer:
+            for stand in stands:
+                writer.write_serialized(stand)
+        os.replace(tmp, path)
+        return True
+
+
+def _open_download(path: str) -> Iterator[BinaryIO]:
+    # the XML files of a bulk download
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for name in archive.namelist():
+                if name.lower().endswith(".xml"):
+                    yield archive.open(name)
+    elif path.endswith(".gz"):
+        yield gzip.open(path)
+    else:
+        yield Path(path).open(mode="rb")
+
+
+def _iter_stands(file: BinaryIO) -> Iterator[tuple[str, geom.Polygon, bytes]]:
+    # stream the stands of an XML file as (stand ID, polygon, compressed XML) tuples
+    stands = None
+    for event, element in ET.iterparse(file, events=("start", "end")):
+        if event == "start":
+            if element.tag == "{http://standardit.tapio.fi/schemas/forestData/Stand}Stands":
+                stands = element
+            continue
+        if element.tag != "{http://standardit.tapio.fi/schemas/forestData/Stand}Stand" or stands is None:
+            continue
+
+        rings = get_stand_rings(element)
+        polygon = geom.Polygon(rings["exterior"], holes=rings["interior"])
+        # the stands are stored the way they are written into the XML files of the pipeline
+        yield element.attrib["id"], polygon, zlib.compress(serialize_stand(element).encode())
+
+        # detach the stand from the tree, so it is freed
+        stands.remove(element)
+
+
+def _insert(connection: sqlite3.Connection, batch: list[tuple[str, geom.Polygon, bytes]]) -> int:
+    ids = [(stand_id,) for stand_id, _, _ in batch]
+    polygons = [polygon for _, polygon, _ in batch]
+    bounds = shapely.bounds(polygons).tolist()
+    geometries = shapely.to_wkb(polygons)
+    with connection:
+        # a stand already in the database is replaced, its old bounding box is removed first
+        connection.executemany(
+            "DELETE FROM stand_bounds WHERE id = (SELECT id FROM stands WHERE stand_id = ?)", ids)
+        connection.executemany(
+            "INSERT OR REPLACE INTO stands (stand_id, geometry, xml) VALUES (?, ?, ?)",
+            [(stand_id, geometry, xml) for (stand_id, _, xml), geometry in zip(batch, geometries)])
+        connection.executemany(
+            "INSERT INTO stand_bounds (id, min_x, max_x, min_y, max_y) "
+            "SELECT id, ?, ?, ?, ? FROM stands WHERE stand_id = ?",
+            [(min_x, max_x, min_y, max_y, stand_id) for (min_x, min_y, max_x, max_y), (stand_id,) in zip(bounds, ids)])
+    return len(batch)
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-d", dest="database", help="Path to the stand database, e.g., data/stands.sqlite.", type=str)
+    parser.add_argument("downloads", help="Paths to the bulk downloads of Metsäkeskus' forest data.", type=str,
+                        nargs="*")
+    args = parser.parse_args(args=None if sys.argv[1:] else ["--help"])
+
+    store = StandStore(args.database)
+    for download in args.downloads:
+        print(f"{download}: {store.ingest(download)} stands")
@@ -0,0 +1,184 @@
+"""A local stand-in for the Maanmittauslaitos and Metsäkeskus APIs, for benchmarking and load testing the pipeline.
+
+The stand-in serves the PalstanSijaintitiedot and FRStandData/v1/ByPolygon endpoints at the same paths as the real
+APIs, replaying recorded responses (fixtures). The pipeline is pointed to it with the environment variables
+MML_API_BASE and METSAKESKUS_API_BASE (see upstream.py). For example:
+
+    uvicorn --app-dir pipeline standin:app --port 8001
+    MML_API_BASE=http://localhost:8001 METSAKESKUS_API_BASE=http://localhost:8001 python pipeline/data_pipeline.py ...
+
+The fixtures are stored as:
+
+- <fixtures>/mml/<real estate id in the long form>.json for Maanmittauslaitos,
+- <fixtures>/metsakeskus/<hash of the polygon and stdVersion>.xml for Metsäkeskus. The hash is the same one the stand
+  data cache uses (upstream.stand_query_key), so a fixture matches the polygon regardless of its rounding, orientation
+  and starting point.
+
+A recorded fixture is stored as the raw bytes of the response, with the content type of the response in a file next to
+it (<fixture>.content-type). The fixtures without one are served as GeoJSON and XML.
+
+A real estate without a fixture gets an empty feature collection and a polygon without a fixture gets the response
+Metsäkeskus gives when there are no stands inside the polygon.
+
+The stand-in is configured with the following environment variables:
+
+- STANDIN_FIXTURES: The fixture directory. Defaults to data/fixtures.
+- STANDIN_LATENCY: The mean latency added to every response in seconds. Defaults to 0.
+- STANDIN_JITTER: The maximum random deviation from the mean latency in seconds. Defaults to 0.
+- STANDIN_ERROR_RATE: The probability of answering with a 504 Gateway Time-out instead. Defaults to 0.
+- STANDIN_ERROR_STATUS: The HTTP status of the injected 504 Gateway Time-out pages. Metsäkeskus has been seen to send
+  them with status 200 too. Defaults to 504.
+- STANDIN_EMPTY_RATE: The probability of answering with an empty result instead. Defaults to 0.
+- STANDIN_SEED: A seed for the random latencies and errors, to make the runs repeatable.
+- STANDIN_CAPTURE: If set to 1, the requests without a fixture are passed on to the real APIs and the successful
+  responses are recorded as fixtures.
+"""
+
+import json
+import os
+import random
+import re
+import time
+from pathlib import Path
+from typing import Annotated
+
+import requests
+from fastapi import FastAPI, Form, Request, Response
+from fastapi.middleware.gzip import GZipMiddleware
+
+from upstream import (
+    METSAKESKUS_DEFAULT_BASE,
+    METSAKESKUS_PATH,
+    MML_DEFAULT_BASE,
+    MML_PATH,
+    TIMEOUT,
+    stand_query_key,
+)
+
+FIXTURES = os.environ.get("STANDIN_FIXTURES", "data/fixtures")
+LATENCY = float(os.environ.get("STANDIN_LATENCY", "0"))
+JITTER = float(os.environ.get("STANDIN_JITTER", "0"))
+ERROR_RATE = float(os.environ.get("STANDIN_ERROR_RATE", "0"))
+ERROR_STATUS = int(os.environ.get("STANDIN_ERROR_STATUS", "504"))
+EMPTY_RATE = float(os.environ.get("STANDIN_EMPTY_RATE", "0"))
+CAPTURE = os.environ.get("STANDIN_CAPTURE", "") == "1"
+
+GATEWAY_TIMEOUT_PAGE = (
+    "<html><head><title>504 Gateway Time-out</title></head>"
+    "<body><center><h1>504 Gateway Time-out</h1></center></body></html>"
+)
+NO_STANDS_FOUND_PAGE = "MV-kuvioita ei löytynyt."
+EMPTY_FEATURE_COLLECTION = {"type": "FeatureCollection", "features": []}
+
+_random = random.Random(os.environ.get("STANDIN_SEED"))
+
+app = FastAPI(title="Maanmittauslaitos and Metsäkeskus API stand-in")
+# the real APIs compress their responses, so the stand-in does it too
+app.add_middleware(GZipMiddleware, minimum_size=1000)
+
+
+def parse_wkt_polygon(wkt: str) -> list[tuple[float, float]]:
+    """Get the coordinate pairs of the exterior of a WKT polygon.
+
+    E.g., 'POLYGON ((612.33 7221.22, 611.53 7222.11))' --> [(612.33, 7221.22), (611.53, 7222.11)]
+
+    Args:
+        wkt (str): The polygon in WKT, as sent to Metsäkeskus API.
+
+    Returns:
+        list[tuple[float, float]]: The coordinate pairs of the exterior ring.
+    """
+    ring = re.search(r"\(\(([^()]*)\)", wkt).group(1)
+    return [tuple(map(float, pair.split())) for pair in ring.split(",")]
+
+
+def _simulate_upstream() -> Response | None:
+    # add the latency and, by chance, an injected error
+    delay = LATENCY + _random.uniform(-JITTER, JITTER)
+    if delay > 0:
+        time.sleep(delay)
+    if _random.random() < ERROR_RATE:
+        return Response(GATEWAY_TIMEOUT_PAGE, status_code=ERROR_STATUS, media_type="text/html")
+    return None
+
+
+def _is_json(content_type: str | None) -> bool:
+    # e.g., "application/json" or "application/geo+json; charset=utf-8"
+    media_type = (content_type or "").split(";")[0].strip().lower()
+    return media_type == "application/json" or media_type.endswith("+json")
+
+
+def _content_type_path(path: Path) -> Path:
+    return path.with_name(f"{path.name}.content-type")
+
+
+def _record(path: Path, content: bytes, content_type: str | None):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # the content type is written first, so a fixture is never served without it
+    for target, data in [(_content_type_path(path), (content_type or "").encode()), (path, content)]:
+        tmp = target.with_name(f".{target.name}.part")
+        tmp.write_bytes(data)
+        os.replace(tmp, target)
+
+
+def _replay(path: Path, media_type: str) -> Response:
+    # serve a fixture with its recorded content type, or the given one if it was not recorded
+    content_type_path = _content_type_path(path)
+    if content_type_path.is_file():
+        media_type = content_type_path.read_text() or media_type
+    return Response(path.read_bytes(), media_type=media_type)
+
+
+@app.get(MML_PATH)
+def real_estate_polygons(request: Request, kiinteistotunnus: str) -> Response:
+    """Replay the polygons of a real estate from the fixtures."""
+    error = _simulate_upstream()
+    if error is not None:
+        return error
+    if _random.random() < EMPTY_RATE:
+        return Response(json.dumps(EMPTY_FEATURE_COLLECTION), media_type="application/geo+json")
+
+    fixture = Path(f"{FIXTURES}/mml/{kiinteistotunnus}.json")
+    if fixture.is_file():
+        return _replay(fixture, "application/geo+json")
+
+    if CAPTURE:
+        # the query parameters (including the API key) are passed on as is, but only the response is recorded
+        r = requests.get(MML_DEFAULT_BASE + MML_PATH, params=dict(request.query_params), timeout=TIMEOUT)
+        # only JSON responses with features are recorded, e.g., not error pages
+        content_type = r.headers.get("Content-Type")
+        if r.ok and _is_json(content_type):
+            try:
+                features = json.loads(r.content).get("features")
+            except (ValueError, AttributeError):
+                features = None
+            if features:
+                _record(fixture, r.content, content_type)
+        return Response(r.content, status_code=r.status_code, media_type=r.headers.get("Content-Type"))
+
+    return Response(json.dumps(EMPTY_FEATURE_COLLECTION), media_type="application/geo+json")
+
+
+@app.post(METSAKESKUS_PATH)
+def stand_data(wktPolygon: Annotated[str, Form()], stdVersion: Annotated[str, Form()]) -> Response:  # noqa: N803
+    """Replay the forest data inside a polygon from the fixtures."""
+    error = _simulate_upstream()
+    if error is not None:
+        return error
+    if _random.random() < EMPTY_RATE:
+        return Response(NO_STANDS_FOUND_PAGE, media_type="text/plain")
+
+    key = stand_query_key(parse_wkt_polygon(wktPolygon), stdVersion)
+    fixture = Path(f"{FIXTURES}/metsakeskus/{key}.xml")
+    if fixture.is_file():
+        return _replay(fixture, "application/xml")
+
+    if CAPTURE:
+        r = requests.post(METSAKESKUS_DEFAULT_BASE + METSAKESKUS_PATH,
+                          data={"wktPolygon": wktPolygon, "stdVersion": stdVersion}, timeout=TIMEOUT)
+        # error pages and empty results are not recorded
+        if r.ok and NO_STANDS_FOUND_PAGE.encode() not in r.content and b"504 Gateway Time-out" not in r.content:
+            _record(fixture, r.content, r.headers.get("Content-Type"))
+        return Response(r.content, status_code=r.status_code, media_type=r.headers.get("Content-Type"))
+
+    return Response(NO_STANDS_FOUND_PAGE, media_type="text/plain")
@@ -0,0 +1,472 @@
+"""The shared HTTP layer used by the data pipeline to contact Maanmittauslaitos and Metsäkeskus APIs.
+
+All upstream calls go through one requests.Session, so the connections to the APIs are kept alive and reused between
+calls instead of opening a fresh connection for every polygon. Independent calls (e.g., the polygons of different real
+estates or the different parts of one real estate) can be run concurrently with fetch_all.
+
+The number of requests in flight at the same time is capped per process. The cap holds even when fetch_all calls are
+nested (e.g., estates fetched concurrently and the parts of each estate fetched concurrently as well). A streamed
+request stays in flight until its response is closed.
+
+Failed requests (connection errors, timeouts, broken response bodies, 502-504 responses or responses that the caller
+finds to be transient errors) are retried with an exponential backoff and full jitter. Idempotent requests can also be hedged: if a request
+has not been answered after a latency threshold, a duplicate request is sent and the one answered first is used. Every
+upstream host has a circuit breaker shared by all the threads of the process. After too many consecutive failures the
+breaker opens and the requests to the host fail fast, until a trial request is let through after a cool-down period.
+
+The request counts, retries, hedges, failures and latencies of each host are collected and can be read with
+get_metrics.
+
+The layer can be configured with the following environment variables:
+
+- MML_API_BASE: The address of Maanmittauslaitos API. Defaults to https://avoin-paikkatieto.maanmittauslaitos.fi.
+- METSAKESKUS_API_BASE: The address of Metsäkeskus API. Defaults to https://avoin.metsakeskus.fi.
+- UPSTREAM_CONCURRENCY: The maximum number of concurrent upstream requests per process. Defaults to 4.
+- UPSTREAM_TIMEOUT: The timeout of a single upstream request in seconds. Defaults to 120.
+- UPSTREAM_RETRIES: How many times a failed request is retried. Defaults to 4.
+- UPSTREAM_BACKOFF: The base delay of the exponential backoff in seconds. Defaults to 1.
+- UPSTREAM_BACKOFF_MAX: The maximum delay between two attempts in seconds. Defaults to 30.
+- UPSTREAM_HEDGE_AFTER: The latency in seconds after which a hedged request is duplicated. Hedging is off by default.
+- UPSTREAM_BREAKER_THRESHOLD: How many consecutive failures open the circuit breaker of a host. Defaults to 5.
+- UPSTREAM_BREAKER_RESET: How many seconds the breaker stays open before a trial request. Defaults to 60.
+- UPSTREAM_RATE_LIMIT: The maximum number of requests per second to each upstream host, shared by all the processes
+  on the machine (see rate_limit.py). Every attempt, including retries and hedged duplicates, takes a token. Not
+  limited by default.
+- UPSTREAM_RATE_BURST: How many requests can be made at once after an idle period. Defaults to the rate limit.
+"""
+
+import hashlib
+import os
+import random
+import threading
+import time
+from collections.abc import Callable, Iterable
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import TypeVar
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from disk_cache import CACHE_ROOT
+from rate_limit import RateLimiter
+
+# the addresses of the APIs, which can be pointed elsewhere (e.g., to the stand-in server in standin.py)
+MML_DEFAULT_BASE = "https://avoin-paikkatieto.maanmittauslaitos.fi"
+METSAKESKUS_DEFAULT_BASE = "https://avoin.metsakeskus.fi"
+MML_BASE = os.environ.get("MML_API_BASE", MML_DEFAULT_BASE).rstrip("/")
+METSAKESKUS_BASE = os.environ.get("METSAKESKUS_API_BASE", METSAKESKUS_DEFAULT_BASE).rstrip("/")
+
+# the Maanmittauslaitos API for the polygons of the real estates
+MML_PATH = "/kiinteisto-avoin/simple-features/v3/collections/PalstanSijaintitiedot/items"
+MML_URL = MML_BASE + MML_PATH
+# the Metsäkeskus API for the forest data inside a polygon
+METSAKESKUS_PATH = "/rest/mvrest/FRStandData/v1/ByPolygon"
+METSAKESKUS_URL = METSAKESKUS_BASE + METSAKESKUS_PATH
+
+CONCURRENCY = int(os.environ.get("UPSTREAM_CONCURRENCY", "4"))
+TIMEOUT = float(os.environ.get("UPSTREAM_TIMEOUT", "120"))
+RETRIES = int(os.environ.get("UPSTREAM_RETRIES", "4"))
+BACKOFF = float(os.environ.get("UPSTREAM_BACKOFF", "1"))
+BACKOFF_MAX = float(os.environ.get("UPSTREAM_BACKOFF_MAX", "30"))
+HEDGE_AFTER = float(os.environ["UPSTREAM_HEDGE_AFTER"]) if os.environ.get("UPSTREAM_HEDGE_AFTER") else None
+BREAKER_THRESHOLD = int(os.environ.get("UPSTREAM_BREAKER_THRESHOLD", "5"))
+BREAKER_RESET = float(os.environ.get("UPSTREAM_BREAKER_RESET", "60"))
+
+RATE_LIMIT = float(os.environ["UPSTREAM_RATE_LIMIT"]) if os.environ.get("UPSTREAM_RATE_LIMIT") else None
+RATE_BURST = float(os.environ["UPSTREAM_RATE_BURST"]) if os.environ.get("UPSTREAM_RATE_BURST") else None
+
+# the response statuses that tell that the upstream API is temporarily unavailable
+RETRY_STATUSES = {502, 503, 504}
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+_session = None
+_session_lock = threading.Lock()
+# caps the number of requests in flight, no matter how many threads want to make a request
+_slots = threading.BoundedSemaphore(CONCURRENCY)
+# the buckets are shared with the other workers through a database next to the caches
+_limiter = RateLimiter(f"{CACHE_ROOT}/rate_limit.sqlite", RATE_LIMIT, RATE_BURST) if RATE_LIMIT else None
+# the threads that run the hedged requests
+_hedge_pool = ThreadPoolExecutor(max_workers=2 * CONCURRENCY, thread_name_prefix="hedge")
+
+
+class UpstreamError(Exception):
+    """Raised when an upstream API can not be reached, even after retrying."""
+
+
+class RetryableError(UpstreamError):
+    """Raised (e.g., by a response validator) when a request failed in a way that is worth retrying."""
+
+
+class CircuitBreaker:
+    """A circuit breaker that fails fast while an upstream host is down.
+
+    The breaker opens after a number of consecutive failures. When it has been open for the reset timeout, a single
+    trial request is let through. If the trial succeeds, the breaker closes again, otherwise it stays open for another
+    reset timeout.
+    """
+
+    def __init__(self, threshold: int, reset_timeout: float):
+        """Initialize a closed breaker.
+
+        Args:
+            threshold (int): How many consecutive failures open the breaker.
+            reset_timeout (float): How many seconds the breaker stays open before a trial request.
+        """
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Check if a request can be made.
+
+        Returns:
+            bool: False if the breaker is open (and the request should fail fast), True otherwise.
+        """
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if self.trial_in_flight or time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self.trial_in_flight = True
+            return True
+
+    def record_success(self):
+        """Record a successful request and close the breaker."""
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        """Record a failed request and open the breaker if there have been too many failures in a row."""
+        with self._lock:
+            self.failures = self.failures + 1
+            self.trial_in_flight = False
+            if self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+    def release_trial(self):
+        """Record a request that ended without telling whether the host is up, so that another trial can be made."""
+        with self._lock:
+            self.trial_in_flight = False
+
+
+class Metrics:
+    """Thread-safe counters and latencies of the upstream requests, collected per host."""
+
+    def __init__(self):
+        """Initialize empty metrics."""
+        self._lock = threading.Lock()
+        self._hosts = {}
+
+    def _host(self, host: str) -> dict:
+        if host not in self._hosts:
+            self._hosts[host] = {
+                "requests": 0,
+                "retries": 0,
+                "hedges": 0,
+                "failures": 0,
+                "rejected": 0,
+                "latency_count": 0,
+                "latency_sum": 0.0,
+                "latency_max": 0.0,
+            }
+        return self._hosts[host]
+
+    def increment(self, host: str, counter: str):
+        """Increment a counter of a host.
+
+        Args:
+            host (str): The upstream host.
+            counter (str): One of "requests", "retries", "hedges", "failures" or "rejected".
+        """
+        with self._lock:
+            self._host(host)[counter] += 1
+
+    def observe_latency(self, host: str, seconds: float):
+        """Record the latency of a successful request.
+
+        Args:
+            host (str): The upstream host.
+            seconds (float): How long the request took, including retries.
+        """
+        with self._lock:
+            metrics = self._host(host)
+            metrics["latency_count"] += 1
+            metrics["latency_sum"] += seconds
+            metrics["latency_max"] = max(metrics["latency_max"], seconds)
+
+    def snapshot(self) -> dict[str, dict]:
+        """Get a copy of the current metrics.
+
+        Returns:
+            dict[str, dict]: The metrics of each host.
+        """
+        with self._lock:
+            return {host: dict(metrics) for host, metrics in self._hosts.items()}
+
+
+metrics = Metrics()
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(host: str) -> CircuitBreaker:
+    """Get the circuit breaker shared by all the requests to a host.
+
+    Args:
+        host (str): The upstream host.
+
+    Returns:
+        CircuitBreaker: The breaker of the host.
+    """
+    with _breakers_lock:
+        if host not in _breakers:
+            _breakers[host] = CircuitBreaker(BREAKER_THRESHOLD, BREAKER_RESET)
+        return _breakers[host]
+
+
+def get_metrics() -> dict[str, dict]:
+    """Get the metrics of the upstream requests of this process, with the state of the circuit breakers.
+
+    Returns:
+        dict[str, dict]: The metrics of each host.
+    """
+    snapshot = metrics.snapshot()
+    for host, host_metrics in snapshot.items():
+        host_metrics["circuit_open"] = get_breaker(host).opened_at is not None
+    return snapshot
+
+
+def get_session() -> requests.Session:
+    """Get the shared session with a keep-alive connection pool sized by the concurrency cap.
+
+    Returns:
+        requests.Session: The session shared by all the upstream calls of this process.
+    """
+    global _session  # noqa: PLW0603
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=2, pool_maxsize=CONCURRENCY)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+    return _session
+
+
+def _send(method: str, url: str, kwargs: dict) -> requests.Response:
+    # a single attempt, waiting for a token if the rate limit is reached and a free slot if the concurrency cap is
+    if _limiter is not None:
+        _limiter.acquire(urlparse(url).netloc)
+    if not kwargs.get("stream"):
+        with _slots:
+            return get_session().request(method, url, **kwargs)
+
+    # the body of a streamed response is read after the headers, so the slot is held until the response is closed
+    _slots.acquire()
+    try:
+        response = get_session().request(method, url, **kwargs)
+    except BaseException:
+        _slots.release()
+        raise
+    close = response.close
+    released = threading.Lock()
+
+    def close_and_release():
+        try:
+            close()
+        finally:
+            # the response may be closed more than once, but the slot is released only once
+            if released.acquire(blocking=False):
+                _slots.release()
+
+    response.close = close_and_release
+    return response
+
+
+def _close_response(future: Future):
+    # close the response of a request that lost the race, so its connection is released back to the pool
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+
+def _send_hedged(method: str, url: str, kwargs: dict, host: str) -> requests.Response:
+    # send the request, and if it has not been answered in time, send a duplicate and use the first answer
+    first = _hedge_pool.submit(_send, method, url, kwargs)
+    done, _ = wait([first], timeout=HEDGE_AFTER)
+    if done:
+        return first.result()
+    metrics.increment(host, "hedges")
+    pending = {first, _hedge_pool.submit(_send, method, url, kwargs)}
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                # the slower request is not needed anymore
+                for other in pending:
+                    other.add_done_callback(_close_response)
+                return future.result()
+            error = future.exception()
+    raise error
+
+
+def backoff(attempt: int) -> float:
+    """Get the delay before the next attempt, an exponential backoff with full jitter.
+
+    Args:
+        attempt (int): The number of the failed attempt, starting from 0.
+
+    Returns:
+        float: The delay in seconds.
+    """
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF * 2**attempt))
+
+
+def request(
+    method: str,
+    url: str,
+    handle: Callable[[requests.Response], R] | None = None,
+    hedge: bool = False,
+    **kwargs,
+) -> requests.Response | R:
+    """Make an HTTP request with the shared session, retrying transient failures.
+
+    Args:
+        method (str): The HTTP method, e.g., "GET" or "POST".
+        url (str): The URL to call.
+        handle (Callable[[requests.Response], R] | None, optional): A function that consumes the response (e.g.,
+            streams its body into a file) and returns the result of the request. The function is called inside the
+            retry loop, so it can raise RetryableError if the response turns out to be a transient error (e.g., an
+            error page with status 200). Defaults to None.
+        hedge (bool, optional): Whether the request can be hedged. Only idempotent requests should be. Hedging is
+            done only if UPSTREAM_HEDGE_AFTER is set. Defaults to False.
+        **kwargs: Passed on to requests.Session.request. A streamed response (stream=True) holds its slot of the
+            concurrency cap until it is closed, which is done after handle. Without handle, the caller has to close
+            the response.
+
+    Raises:
+        UpstreamError: If the circuit breaker of the host is open or the request fails after all the retries.
+
+    Returns:
+        requests.Response | R: The result of handle, or the response of the upstream API if handle is not given.
+    """
+    kwargs.setdefault("timeout", TIMEOUT)
+    host = urlparse(url).netloc
+    breaker = get_breaker(host)
+    start = time.monotonic()
+    error = None
+    for attempt in range(RETRIES + 1):
+        if not breaker.allow():
+            metrics.increment(host, "rejected")
+            raise UpstreamError(f"{host} is unavailable, not trying again for a while") from error
+        if attempt > 0:
+            metrics.increment(host, "retries")
+        metrics.increment(host, "requests")
+        try:
+            if hedge and HEDGE_AFTER is not None:
+                response = _send_hedged(method, url, kwargs, host)
+            else:
+                response = _send(method, url, kwargs)
+            if response.status_code in RETRY_STATUSES:
+                # the error page is not read, close it to release the connection of a streamed response
+                response.close()
+                raise RetryableError(f"{host} responded with status {response.status_code}")
+            if handle is None:
+                result = response
+            else:
+                try:
+                    result = handle(response)
+                finally:
+                    # a streamed response holds its slot until it is closed (see _send), whatever handle did with it
+                    if kwargs.get("stream"):
+                        response.close()
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError,
+                RetryableError) as e:
+            error = e
+            breaker.record_failure()
+            metrics.increment(host, "failures")
+            if attempt < RETRIES:
+                time.sleep(backoff(attempt))
+            continue
+        except (requests.RequestException, UpstreamError):
+            # an upstream failure that is not worth retrying
+            breaker.record_failure()
+            metrics.increment(host, "failures")
+            raise
+        except Exception:
+            # a local failure (e.g., writing the response to disk) tells nothing about the host, but a trial request
+            # is over
+            breaker.release_trial()
+            raise
+        breaker.record_success()
+        metrics.observe_latency(host, time.monotonic() - start)
+        return result
+    raise UpstreamError(f"{host} could not be reached after {RETRIES + 1} attempts: {error}") from error
+
+
+def fetch_all(func: Callable[[T], R], items: Iterable[T], max_workers: int | None = None) -> list[R]:
+    """Call func for every item concurrently in a bounded thread pool.
+
+    The results are returned in the same order as the items. If any of the calls raises an exception, the exception
+    is raised from here as well.
+
+    Args:
+        func (Callable[[T], R]): The function to call for each item.
+        items (Iterable[T]): The items.
+        max_workers (int | None, optional): The size of the thread pool. Defaults to UPSTREAM_CONCURRENCY.
+
+    Returns:
+        list[R]: The results of the calls.
+    """
+    items = list(items)
+    workers = min(max_workers or CONCURRENCY, len(items))
+    # no need for a thread pool when there is nothing to run concurrently
+    if workers <= 1:
+        return [func(item) for item in items]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(func, items))
+
+
+def normalize_polygon(coordinate_pairs: list) -> list[tuple[float, float]]:
+    """Get a normalized form of a polygon, so that the same polygon always gives the same form.
+
+    The coordinates are rounded to centimeters, the closing point of the ring is dropped, the ring is turned
+    counterclockwise and it is rotated to start from its smallest point.
+
+    Args:
+        coordinate_pairs (list): A list of coordinate pairs (in EPSG:3067) as tuples or lists.
+
+    Returns:
+        list[tuple[float, float]]: The normalized ring without the closing point.
+    """
+    ring = [(round(float(pair[0]), 2), round(float(pair[1]), 2)) for pair in coordinate_pairs]
+    if len(ring) > 1 and ring[0] == ring[-1]:
+        ring = ring[:-1]
+    # the shoelace formula gives a negative area for a clockwise ring
+    area = sum(ring[i - 1][0] * ring[i][1] - ring[i][0] * ring[i - 1][1] for i in range(len(ring)))
+    if area < 0:
+        ring.reverse()
+    start = ring.index(min(ring)) if ring else 0
+    return ring[start:] + ring[:start]
+
+
+def stand_query_key(coordinate_pairs: list, std_version: str) -> str:
+    """Get a key that identifies a Metsäkeskus polygon query.
+
+    Args:
+        coordinate_pairs (list): The polygon as a list of coordinate pairs.
+        std_version (str): The version of the forest data standard asked from Metsäkeskus, e.g., "MV1.9".
+
+    Returns:
+        str: A hash of the normalized polygon and the standard version.
+    """
+    ring = " ".join(f"{x:.2f},{y:.2f}" for x, y in normalize_polygon(coordinate_pairs))
+    return hashlib.sha256(f"{std_version}|{ring}".encode()).hexdigest()
@@ -18,6 +18,8 @@ from desdeo.problem.schema import (
 )
 from desdeo.tools.utils import available_solvers, payoff_table_method
 
+from convert_to_opt import read_alternatives
+
 
 def utopia_problem(
     data_dir: str,
@@ -52,8 +54,9 @@ def utopia_problem(
     are represented by $v_{ij}$, $w_{ij}$, and $p_{ij}$ respectively.
 
     Args:
-        data_dir (str): The directory of the data. Has to contain files 'alternatives.csv', 'alternatives_key.csv',
-            'carbon.json' and 'dec_vars.json'. 'carbon.json' has the CO2 tons computed for each stand as a dict,
+        data_dir (str): The directory of the data. Has to contain files 'alternatives.parquet' (or 'alternatives.csv'),
+            'alternatives_key.csv', 'carbon.json' and 'dec_vars.json'.
+            'carbon.json' has the CO2 tons computed for each stand as a dict,
             'dec_vars.json' has the reference solution's decision variable values as a list.
         problem_name (str, optional): The name of the problem. Defalts to 'Forest problem'.
         holding (int, optional): The number of the holding to be optimized. Defaults to 1.
@@ -70,8 +73,13 @@ def utopia_problem(
         (1 - 0.01 * discounting_factor) ** 17,
     ]
 
-    df = pl.read_csv(
-        Path(f"{data_dir}/alternatives.csv"), schema_overrides={"unit": pl.Float64}, infer_schema_length=1000
+    # only the columns the objectives are formed from
+    df = read_alternatives(
+        data_dir,
+        [
+            "holding", "unit", "schedule", "stock_0", "stock_20", f"npv_{discounting_factor}_percent",
+            "harvest_value_5", "harvest_value_10", "harvest_value_20",
+        ],
     )
     separator = ","
     unfiltered_df_key = pl.read_csv(
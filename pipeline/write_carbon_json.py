@@ -2,7 +2,7 @@
 
 Arguments:
     -d: Data directory. The directory that has the forest' data. Assumes that the directory has the following files:
-        - alternatives.csv
+        - alternatives.parquet (or alternatives.csv)
         - alternatives_key.csv
         - trees.json.
         Defaults to 'C:/MyTemp/code/UTOPIA/alternatives/select'.
@@ -17,14 +17,16 @@ from sys import platform
 import numpy as np
 import polars as pl
 
+from convert_to_opt import read_alternatives
+
 class CarbonJsonException(Exception):
     '''
     '''
 
 def write_carbon_json(data_dir: str):
 
-    if not os.path.exists(f"{data_dir}/alternatives.csv"):
-        raise CarbonJsonException(f"There's no alternatives.csv in {data_dir}")
+    if not os.path.exists(f"{data_dir}/alternatives.csv") and not os.path.exists(f"{data_dir}/alternatives.parquet"):
+        raise CarbonJsonException(f"There's no alternatives.parquet (or alternatives.csv) in {data_dir}")
 	
     if not os.path.exists(f"{data_dir}/alternatives_key.csv"):
         raise CarbonJsonException(f"There's no alternatives_key.csv in {data_dir}")
@@ -32,8 +34,10 @@ def write_carbon_json(data_dir: str):
     if not os.path.exists(f"{data_dir}/trees.json"):
         raise CarbonJsonException(f"There's no trees.json in {data_dir}")
 
-    # reading the csv files, infer_schema_length's high number makes it slower but is necessary
-    df = pl.read_csv(Path(f"{data_dir}/alternatives.csv"), schema_overrides={"unit": pl.Float64}, infer_schema_length=10000)
+    # only the stock volumes of the species in the planning years are needed from the alternatives
+    df = read_alternatives(
+        data_dir, ["unit", "schedule", *[f"stock_{k}_{year}" for k in range(1, 39) for year in [0, 5, 10, 20]]]
+    )
     df_key = pl.read_csv(Path(f"{data_dir}/alternatives_key.csv"), schema_overrides={"unit": pl.Float64})
     unique_units = df_key.unique(["unit"], maintain_order=True).get_column("unit")
 
@@ -0,0 +1,66 @@
+import itertools
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+import requests
+from requests.adapters import BaseAdapter
+
+# the pipeline modules import each other by their module names, as when they are run from the pipeline directory
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "pipeline"))
+
+import upstream  # noqa: E402
+
+GATEWAY_TIMEOUT_PAGE = b"<html><body><h1>504 Gateway Time-out</h1></body></html>"
+
+_hosts = itertools.count()
+
+
+class FakeAdapter(BaseAdapter):
+    """Answers the requests of a session with respond(number of the call), which gives a status and a body."""
+
+    def __init__(self, respond):
+        super().__init__()
+        self.respond = respond
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def send(self, request, **kwargs):
+        with self._lock:
+            self.calls = self.calls + 1
+            call = self.calls
+        status, body = self.respond(call)
+        response = requests.Response()
+        response.status_code = status
+        # the body is already read, so it is also what a streamed response gives
+        response._content = body
+        response._content_consumed = True
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def fake_upstream(monkeypatch):
+    """Point the shared session to a fake adapter, with no delays between the attempts."""
+    monkeypatch.setattr(upstream, "RETRIES", 2)
+    monkeypatch.setattr(upstream, "BACKOFF", 0.0)
+    monkeypatch.setattr(upstream, "BREAKER_THRESHOLD", 3)
+    monkeypatch.setattr(upstream, "HEDGE_AFTER", None)
+    # the breakers of the real hosts, as used by the pipeline, are not left open for the other tests
+    monkeypatch.setattr(upstream, "_breakers", {})
+
+    def install(respond) -> tuple[FakeAdapter, str]:
+        adapter = FakeAdapter(respond)
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        monkeypatch.setattr(upstream, "_session", session)
+        # every test has a host of its own, so the breakers and the metrics start from scratch
+        return adapter, f"http://host-{next(_hosts)}.test/items"
+
+    return install
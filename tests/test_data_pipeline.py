@@ -0,0 +1,97 @@
+import gzip
+
+import pytest
+import shapely
+from conftest import GATEWAY_TIMEOUT_PAGE
+
+pytest.importorskip("desdeo")
+pytest.importorskip("lukefi.metsi.data.formats.smk_util")
+
+import data_pipeline  # noqa: E402
+from data_pipeline import (  # noqa: E402
+    STD_VERSION,
+    PipelineError,
+    plan_queries,
+    remove_neighboring_stands,
+    write_real_estate_xmls,
+)
+from disk_cache import DiskCache  # noqa: E402
+from upstream import stand_query_key  # noqa: E402
+
+SQUARE = [[0.0, 0.0], [100.0, 0.0], [100.0, 100.0], [0.0, 100.0], [0.0, 0.0]]
+FOREST_DATA = b"<ForestPropertyData>" + b" " * 5000 + b"</ForestPropertyData>"
+
+STAND = """
+    <st:Stand id="{id}">
+      <st:StandBasicData>
+        <st:StandNumber>{number}</st:StandNumber>
+        <gdt:PolygonGeometry><gml:polygonProperty><gml:Polygon><gml:exterior><gml:LinearRing>
+          <gml:coordinates>{x0},{y0} {x1},{y0} {x1},{y1} {x0},{y1} {x0},{y0}</gml:coordinates>
+        </gml:LinearRing></gml:exterior></gml:Polygon></gml:polygonProperty></gdt:PolygonGeometry>
+      </st:StandBasicData>
+    </st:Stand>"""
+
+STANDS = """<ForestPropertyData xmlns="http://standardit.tapio.fi/schemas/forestData"
+    xmlns:st="http://standardit.tapio.fi/schemas/forestData/Stand" xmlns:gml="http://www.opengis.net/gml"
+    xmlns:gdt="http://standardit.tapio.fi/schemas/forestData/common/geometricDataTypes">
+  <st:Stands>{stands}
+  </st:Stands>
+</ForestPropertyData>
+"""
+
+# two adjacent real estates, a stand on their border that is mostly on the west one, and a stand far from both
+WEST = [[0.0, 0.0], [100.0, 0.0], [100.0, 100.0], [0.0, 100.0], [0.0, 0.0]]
+EAST = [[100.0, 0.0], [200.0, 0.0], [200.0, 100.0], [100.0, 100.0], [100.0, 0.0]]
+BOUNDS = {"1": (10, 10, 50, 90), "2": (93, 10, 104, 90), "3": (150, 10, 190, 90), "4": (500, 10, 600, 90)}
+
+
+@pytest.fixture
+def stand_cache(tmp_path, monkeypatch) -> DiskCache:
+    cache = DiskCache("stands", root=str(tmp_path / "cache"))
+    monkeypatch.setattr(data_pipeline, "stand_cache", cache)
+    monkeypatch.setattr(data_pipeline, "stand_store", None)
+    return cache
+
+
+def test_a_gateway_timeout_page_is_retried_and_not_cached(tmp_path, fake_upstream, stand_cache):
+    adapter, _ = fake_upstream(lambda call: (200, GATEWAY_TIMEOUT_PAGE))
+
+    with pytest.raises(PipelineError, match="Metsäkeskus"):
+        write_real_estate_xmls([SQUARE], ["1"], str(tmp_path), None)
+
+    assert adapter.calls == 3
+    assert stand_cache.get(stand_query_key(SQUARE, STD_VERSION)) is None
+
+
+def test_the_forest_data_is_cached_after_a_retried_gateway_timeout(tmp_path, fake_upstream, stand_cache):
+    adapter, _ = fake_upstream(lambda call: (200, GATEWAY_TIMEOUT_PAGE) if call == 1 else (200, FOREST_DATA))
+
+    errors, files = write_real_estate_xmls([SQUARE], ["1"], str(tmp_path), None)
+
+    assert adapter.calls == 2
+    assert errors == []
+    assert files == [[0]]
+    assert gzip.decompress(stand_cache.get(stand_query_key(SQUARE, STD_VERSION))) == FOREST_DATA
+    assert gzip.decompress((tmp_path / "output_1.xml.gz").read_bytes()) == FOREST_DATA
+
+
+@pytest.mark.parametrize("merge_distance", [None, 20.0])
+def test_a_stand_shared_by_adjacent_real_estates_is_assigned_once(tmp_path, merge_distance):
+    queries = plan_queries([WEST, EAST], merge_distance)
+    assert [parts for _, parts in queries] == ([[0], [1]] if merge_distance is None else [[0, 1]])
+
+    # each query gets the stands that meet its polygon, and the first one also the far stand
+    for i, (polygon, _) in enumerate(queries):
+        ids = [stand_id for stand_id, bounds in BOUNDS.items()
+               if shapely.Polygon(polygon).intersects(shapely.box(*bounds)) or (i == 0 and stand_id == "4")]
+        stands = "".join(STAND.format(id=stand_id, number=stand_id, x0=BOUNDS[stand_id][0], y0=BOUNDS[stand_id][1],
+                                      x1=BOUNDS[stand_id][2], y1=BOUNDS[stand_id][3]) for stand_id in ids)
+        (tmp_path / f"output_{i+1}.xml.gz").write_bytes(gzip.compress(STANDS.format(stands=stands).encode()))
+
+    removed_ids, forest_datas = remove_neighboring_stands(
+        [WEST, EAST], [0, 1], [parts for _, parts in queries], str(tmp_path), ["west", "east"])
+
+    assert removed_ids == ["4"]
+    assert forest_datas[0].ids == ["1", "2"]
+    assert forest_datas[1].ids == ["3"]
+    assert forest_datas[0].numbers == [1, 2]
@@ -0,0 +1,84 @@
+import os
+import time
+
+import disk_cache
+from disk_cache import EVICT_HEADROOM, DiskCache
+
+
+def test_a_stale_entry_is_removed_on_get(tmp_path):
+    cache = DiskCache("test", ttl=60, root=str(tmp_path))
+    cache.put("fresh", b"1")
+    cache.put("stale", b"2")
+    path = cache.path("stale")
+    old = time.time() - 120
+    os.utime(path, (old, old))
+
+    assert cache.get("fresh") == b"1"
+    assert cache.get("stale") is None
+    assert not path.exists()
+
+
+def test_eviction_removes_the_least_recently_used_entries_below_the_limit(tmp_path):
+    cache = DiskCache("test", root=str(tmp_path))
+    now = time.time()
+    for i in range(10):
+        cache.put(str(i), b"x" * 100)
+        # the entries were last used in the order 9, 8, ..., 0
+        os.utime(cache.path(str(i)), (now - i, now))
+
+    cache.max_bytes = 500
+    total = cache.evict()
+
+    assert total <= cache.max_bytes * (1 - EVICT_HEADROOM)
+    assert total == 400
+    assert [cache.path(str(i)).exists() for i in range(10)] == [True] * 4 + [False] * 6
+
+
+def test_the_size_estimate_keeps_the_cache_within_its_limit(tmp_path, monkeypatch):
+    monkeypatch.setattr(disk_cache, "SCAN_INTERVAL", 5)
+    cache = DiskCache("test", max_bytes=1000, root=str(tmp_path))
+    scans = []
+    evict = cache.evict
+    monkeypatch.setattr(cache, "evict", lambda: scans.append(1) or evict())
+
+    for i in range(40):
+        cache.put(str(i), b"x" * 100)
+        assert sum(path.stat().st_size for path in cache._entries()) <= 1000
+
+    # the directory is not scanned on every write
+    assert len(scans) < 40
+    # the entries written by other processes are counted within SCAN_INTERVAL writes
+    other = DiskCache("test", root=str(tmp_path))
+    for i in range(40, 50):
+        other.put(str(i), b"x" * 100)
+    for i in range(50, 55):
+        cache.put(str(i), b"x" * 100)
+    assert sum(path.stat().st_size for path in cache._entries()) <= 1000
+
+
+def test_put_file_and_copy_to_round_trip(tmp_path):
+    cache = DiskCache("test", root=str(tmp_path / "cache"))
+    source = tmp_path / "source.bin"
+    source.write_bytes(bytes(range(256)) * 10)
+
+    cache.put_file("key", str(source))
+    destination = tmp_path / "destination.bin"
+
+    assert cache.copy_to("key", str(destination))
+    assert destination.read_bytes() == source.read_bytes()
+    assert not cache.copy_to("missing", str(tmp_path / "missing.bin"))
+    assert not (tmp_path / "missing.bin").exists()
+
+
+def test_invalidate_and_clear(tmp_path):
+    cache = DiskCache("test", root=str(tmp_path))
+    for key in ["a", "b", "c"]:
+        cache.put(key, key.encode())
+
+    cache.invalidate("a")
+    assert cache.get("a") is None
+    assert cache.get("b") == b"b"
+
+    cache.clear()
+    assert cache.get("b") is None
+    assert cache.get("c") is None
@@ -0,0 +1,55 @@
+from xml.etree import ElementTree as ET
+
+import pytest
+
+pytest.importorskip("lukefi.metsi.data.formats.smk_util")
+
+from forest_data import ForestData, get_stand_rings, serialize_stand  # noqa: E402
+
+ST = "{http://standardit.tapio.fi/schemas/forestData/Stand}"
+
+STANDS = """<ForestPropertyData xmlns="http://standardit.tapio.fi/schemas/forestData"
+    xmlns:st="http://standardit.tapio.fi/schemas/forestData/Stand" xmlns:gml="http://www.opengis.net/gml"
+    xmlns:gdt="http://standardit.tapio.fi/schemas/forestData/common/geometricDataTypes">
+  <st:Stands>
+    <st:Stand id="1001">
+      <st:StandBasicData>
+        <st:StandNumber>7</st:StandNumber>
+        <gdt:PolygonGeometry><gml:polygonProperty><gml:Polygon><gml:exterior><gml:LinearRing>
+          <gml:coordinates>0,0 100,0 100,100 0,100 0,0</gml:coordinates>
+        </gml:LinearRing></gml:exterior></gml:Polygon></gml:polygonProperty></gdt:PolygonGeometry>
+      </st:StandBasicData>
+    </st:Stand>
+  </st:Stands>
+</ForestPropertyData>
+"""
+
+
+def _forest_data() -> ForestData:
+    forest_data = ForestData()
+    for stand in ET.fromstring(STANDS).iter(f"{ST}Stand"):
+        forest_data.add(stand, None)
+    return forest_data
+
+
+def test_stands_can_be_looked_up_by_namespace_after_to_xml():
+    forest_data = _forest_data()
+    document = forest_data.to_xml()
+
+    assert "<st:StandNumber>7</st:StandNumber>" in document
+    stand = forest_data.stands[0]
+    assert stand.findtext(f"{ST}StandBasicData/{ST}StandNumber") == "7"
+    assert len(get_stand_rings(stand)["exterior"]) == 5
+    # writing the stands again gives the same document
+    assert forest_data.to_xml() == document
+
+
+def test_serialize_stand_leaves_the_stand_as_is():
+    stand = _forest_data().stands[0]
+    tail = stand.tail
+
+    serialized = serialize_stand(stand)
+
+    assert serialized.startswith('<st:Stand id="1001">')
+    assert stand.tag == f"{ST}Stand"
+    assert stand.tail == tail
@@ -0,0 +1,61 @@
+import json
+
+import pytest
+import shapely
+
+from map_encoding import decode_stand_map, encode_stand_map
+
+# the boundary the stands share, with some vertices off the straight line
+SHARED_EDGE = [[100.0, 0.0], [100.03, 25.01], [99.98, 50.04], [100.02, 75.07], [100.0, 100.0]]
+
+
+def _stand(identifier: int, ring: list) -> dict:
+    return {"type": "Feature", "properties": {"id": identifier},
+            "geometry": {"type": "Polygon", "coordinates": [ring + ring[:1]]}}
+
+
+def _stands() -> dict:
+    west = [[0.01, 0.02], *SHARED_EDGE, [0.0, 100.04]]
+    # the other stand goes around the shared boundary in the opposite direction
+    east = [[200.06, 0.0], [200.0, 100.0], *SHARED_EDGE[::-1]]
+    return {"type": "FeatureCollection", "features": [_stand(1, west), _stand(2, east)]}
+
+
+def _arcs(geometry: dict) -> list[int]:
+    return [index for ring in geometry["arcs"] for index in ring]
+
+
+@pytest.mark.parametrize("precision", [0, 1, 2])
+def test_the_shared_edge_of_adjacent_stands_is_one_arc(precision):
+    topology = json.loads(json.dumps(encode_stand_map(_stands(), precision=precision, tolerance=0.0, topology=True)))
+
+    west, east = topology["objects"]["stands"]["geometries"]
+    shared = {index if index >= 0 else ~index for index in _arcs(west)} & \
+        {index if index >= 0 else ~index for index in _arcs(east)}
+    # the shared edge and the rest of the boundary of each stand
+    assert len(topology["arcs"]) == 3
+    assert len(shared) == 1
+    # the stands go along the shared arc in the opposite directions
+    arc = shared.pop()
+    assert sorted([index for index in _arcs(west) + _arcs(east) if index in (arc, ~arc)]) == [~arc, arc]
+
+    # the decoded coordinates are the original ones within the quantization error (the points that became collinear
+    # are dropped, which does not move the boundary)
+    error = 0.5 * 10**-precision + 1e-9
+    decoded = decode_stand_map(topology)
+    assert [feature["properties"] for feature in decoded["features"]] == [{"id": 1}, {"id": 2}]
+    for original, feature in zip(_stands()["features"], decoded["features"]):
+        ring = original["geometry"]["coordinates"][0]
+        points = feature["geometry"]["coordinates"][0]
+        assert points[0] == points[-1]
+        for x, y in points:
+            assert min(max(abs(x - ox), abs(y - oy)) for ox, oy in ring) <= error
+        assert shapely.hausdorff_distance(shapely.Polygon(points), shapely.Polygon(ring)) <= error * 2**0.5
+
+
+def test_the_simplified_stands_still_share_their_edge():
+    decoded = decode_stand_map(encode_stand_map(_stands(), precision=2, tolerance=0.5, topology=True))
+
+    west, east = [{tuple(point) for point in feature["geometry"]["coordinates"][0]} for feature in decoded["features"]]
+    # the wiggles of the shared edge are simplified away the same way in both stands
+    assert west & east == {(100.0, 0.0), (100.0, 100.0)}
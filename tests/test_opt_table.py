@@ -0,0 +1,92 @@
+from pathlib import Path
+from xml.etree import ElementTree as ET
+
+import polars as pl
+import pytest
+import yaml
+
+pytest.importorskip("lukefi.metsi.app.simulator")
+
+from forest_data import ForestData  # noqa: E402
+from metsi_driver import run_metsi  # noqa: E402
+
+ROOT = Path(__file__).resolve().parent.parent
+ST = "{http://standardit.tapio.fi/schemas/forestData/Stand}"
+
+STRATUM = """
+            <tst:TreeStratum id="{number}">
+              <tst:StratumNumber>{number}</tst:StratumNumber>
+              <tst:TreeSpecies>{species}</tst:TreeSpecies>
+              <tst:Storey>1</tst:Storey>
+              <tst:Age>{age}</tst:Age>
+              <tst:BasalArea>{basal_area}</tst:BasalArea>
+              <tst:StemCount>{stems}</tst:StemCount>
+              <tst:MeanDiameter>{diameter}</tst:MeanDiameter>
+              <tst:MeanHeight>{height}</tst:MeanHeight>
+              <co:DataSource>1</co:DataSource>
+            </tst:TreeStratum>"""
+
+STANDS = """<ForestPropertyData xmlns="http://standardit.tapio.fi/schemas/forestData"
+    xmlns:st="http://standardit.tapio.fi/schemas/forestData/Stand" xmlns:gml="http://www.opengis.net/gml"
+    xmlns:gdt="http://standardit.tapio.fi/schemas/forestData/common/geometricDataTypes"
+    xmlns:co="http://standardit.tapio.fi/schemas/forestData/common"
+    xmlns:ts="http://standardit.tapio.fi/schemas/forestData/treeStand"
+    xmlns:tst="http://standardit.tapio.fi/schemas/forestData/treeStratum">
+  <st:Stands>
+    <st:Stand id="1001">
+      <st:StandBasicData>
+        <st:CompleteState>1</st:CompleteState>
+        <st:StandBasicDataDate>2024-01-01</st:StandBasicDataDate>
+        <st:StandNumber>7</st:StandNumber>
+        <st:StandNumberExtension>0</st:StandNumberExtension>
+        <st:MainGroup>1</st:MainGroup>
+        <st:SubGroup>1</st:SubGroup>
+        <st:FertilityClass>3</st:FertilityClass>
+        <st:SoilType>10</st:SoilType>
+        <st:DrainageState>1</st:DrainageState>
+        <st:DevelopmentClass>03</st:DevelopmentClass>
+        <st:Area>2.5</st:Area>
+        <st:CuttingRestriction>0</st:CuttingRestriction>
+        <gdt:PolygonGeometry><gml:polygonProperty><gml:Polygon><gml:exterior><gml:LinearRing>
+          <gml:coordinates>500000,7000000 500200,7000000 500200,7000125 500000,7000125 500000,7000000</gml:coordinates>
+        </gml:LinearRing></gml:exterior></gml:Polygon></gml:polygonProperty></gdt:PolygonGeometry>
+      </st:StandBasicData>
+      <ts:TreeStandData>
+        <ts:TreeStandDataDate date="2024-01-01" type="1">
+          <tst:TreeStrata>{strata}
+          </tst:TreeStrata>
+        </ts:TreeStandDataDate>
+      </ts:TreeStandData>
+    </st:Stand>
+  </st:Stands>
+</ForestPropertyData>
+""".format(strata=STRATUM.format(number=1, species=1, age=45, basal_area=18, stems=900, diameter=19, height=16)
+           + STRATUM.format(number=2, species=2, age=40, basal_area=6, stems=500, diameter=14, height=12))
+
+
+def test_opt_table_has_the_rows_of_the_j_export(tmp_path, monkeypatch):
+    # the parameter files are given relative to the root of the repository in the control file
+    monkeypatch.chdir(ROOT)
+    control = yaml.safe_load((ROOT / "control.yaml").read_text())
+    opt_table = next(decl for decl in control["export"] if decl["format"] == "opt_table")
+    control["export"] = [
+        {"format": "J", "cvariables": ["identifier", "year"], "xvariables": opt_table["xvariables"]},
+        opt_table,
+    ]
+    control_file = tmp_path / "control.yaml"
+    control_file.write_text(yaml.safe_dump(control))
+
+    forest_data = ForestData()
+    for stand in ET.fromstring(STANDS).iter(f"{ST}Stand"):
+        forest_data.add(stand, None)
+    exports = run_metsi([str(tmp_path / "output.xml"), str(tmp_path), str(control_file)], forest_data=forest_data)
+
+    # J writes the values as text, so they are compared as floats
+    xda = pl.read_csv(tmp_path / "data.xda", separator="\t", has_header=False, infer_schema=False)
+    xda_rows = [[float(value) for value in row] for row in xda.iter_rows()]
+    table_rows = [[float(value) for value in row] for row in exports["opt_table"].iter_rows()]
+
+    assert len(table_rows) > 0
+    assert len(table_rows) == len(xda_rows)
+    for table_row, xda_row in zip(table_rows, xda_rows):
+        assert table_row == pytest.approx(xda_row, rel=1e-6, abs=1e-6)
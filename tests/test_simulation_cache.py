@@ -0,0 +1,55 @@
+import polars as pl
+import pytest
+
+pytest.importorskip("lukefi.metsi.data.formats.smk_util")
+
+from simulation_cache import read_results, write_results  # noqa: E402
+
+# the layout of rm_timber's trees.txt: each schedule starts with a year line and ends with an empty line, each stand
+# ends with one more empty line, and a year with no trees gives an empty line of its own
+TREES = """11 0 2025
+1 1 2 3 4 5.5
+11 0 2030
+
+
+11 1 2025
+1 1 2 3 4 6.5
+
+
+12 0 2025
+2 1 2 3 4 7.5
+
+
+"""
+
+
+def _table() -> pl.DataFrame:
+    return pl.DataFrame({"identifier": [11, 11, 12], "area": [1.0, 1.0, 2.0]})
+
+
+def test_trees_are_split_by_the_year_lines_of_the_stands(tmp_path):
+    (tmp_path / "trees.txt").write_text(TREES)
+
+    results = read_results(str(tmp_path), ["11", "12"], _table())
+
+    assert results["11"]["trees"] == ["11 0 2025", "1 1 2 3 4 5.5", "11 0 2030", "", "", "11 1 2025",
+                                      "1 1 2 3 4 6.5", "", ""]
+    assert results["12"]["trees"] == ["12 0 2025", "2 1 2 3 4 7.5", "", ""]
+    assert results["11"]["rows"] == [[11, 1.0], [11, 1.0]]
+
+    # the blocks of the stands give the same file back
+    combined = tmp_path / "combined"
+    combined.mkdir()
+    table = write_results(str(combined), ["11", "12"], results, ["data.parquet"])
+    assert (combined / "trees.txt").read_text() == TREES
+    assert pl.read_parquet(combined / "data.parquet").equals(table)
+
+
+def test_lines_outside_of_the_blocks_are_not_dropped(tmp_path):
+    (tmp_path / "trees.txt").write_text("1 1 2 3 4 5.5\n" + TREES)
+    with pytest.raises(ValueError, match="Line 1"):
+        read_results(str(tmp_path), ["11", "12"], _table())
+
+    (tmp_path / "trees.txt").write_text(TREES + "11 2 2025\n\n\n")
+    with pytest.raises(ValueError, match="stand 11"):
+        read_results(str(tmp_path), ["11", "12"], _table())
@@ -0,0 +1,126 @@
+import threading
+import time
+
+import pytest
+import requests
+from conftest import GATEWAY_TIMEOUT_PAGE
+
+import upstream
+from upstream import CircuitBreaker, RetryableError, UpstreamError, request
+
+
+def test_transient_failures_are_retried(fake_upstream):
+    adapter, url = fake_upstream(lambda call: (503, b"") if call == 1 else (200, b"ok"))
+
+    response = request("GET", url)
+
+    assert response.content == b"ok"
+    assert adapter.calls == 2
+    metrics = upstream.get_metrics()[url.split("/")[2]]
+    assert metrics["retries"] == 1
+    assert metrics["failures"] == 1
+
+
+def test_a_gateway_timeout_page_with_status_200_is_retried(fake_upstream):
+    adapter, url = fake_upstream(lambda call: (200, GATEWAY_TIMEOUT_PAGE) if call == 1 else (200, b"<data/>"))
+
+    def handle(response: requests.Response) -> bytes:
+        if b"504 Gateway Time-out" in response.content:
+            raise RetryableError("504 Gateway Time-out")
+        return response.content
+
+    assert request("POST", url, handle=handle) == b"<data/>"
+    assert adapter.calls == 2
+
+
+def test_the_breaker_opens_after_consecutive_failures_and_half_opens_after_the_cooldown(fake_upstream, monkeypatch):
+    monkeypatch.setattr(upstream, "BREAKER_RESET", 0.2)
+    status = {"code": 503}
+    adapter, url = fake_upstream(lambda call: (status["code"], b"ok"))
+
+    # three failed attempts open the breaker
+    with pytest.raises(UpstreamError, match="after 3 attempts"):
+        request("GET", url)
+    assert adapter.calls == 3
+    breaker = upstream.get_breaker(url.split("/")[2])
+    assert breaker.opened_at is not None
+
+    # the requests fail fast while the breaker is open
+    with pytest.raises(UpstreamError, match="unavailable"):
+        request("GET", url)
+    assert adapter.calls == 3
+
+    # after the cooldown a trial request is let through, and its success closes the breaker
+    time.sleep(0.25)
+    status["code"] = 200
+    assert request("GET", url).content == b"ok"
+    assert adapter.calls == 4
+    assert breaker.opened_at is None
+
+
+def test_only_one_trial_request_is_let_through_a_half_open_breaker():
+    breaker = CircuitBreaker(threshold=1, reset_timeout=0.0)
+    breaker.record_failure()
+
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.allow()
+    assert breaker.allow()
+
+
+def test_a_local_error_does_not_count_as_a_failure_of_the_host(fake_upstream):
+    adapter, url = fake_upstream(lambda call: (200, b"ok"))
+
+    def handle(response: requests.Response):
+        raise OSError("No space left on device")
+
+    with pytest.raises(OSError):
+        request("GET", url, handle=handle)
+    breaker = upstream.get_breaker(url.split("/")[2])
+    assert breaker.failures == 0
+    assert not breaker.trial_in_flight
+    assert adapter.calls == 1
+
+
+def test_a_hedged_request_uses_the_first_response(fake_upstream, monkeypatch):
+    monkeypatch.setattr(upstream, "HEDGE_AFTER", 0.05)
+
+    def respond(call: int) -> tuple[int, bytes]:
+        # the first request is slow, so a duplicate is sent and answered first
+        if call == 1:
+            time.sleep(0.5)
+            return 200, b"slow"
+        return 200, b"fast"
+
+    adapter, url = fake_upstream(respond)
+
+    start = time.monotonic()
+    response = request("GET", url, hedge=True)
+
+    assert response.content == b"fast"
+    assert time.monotonic() - start < 0.4
+    assert adapter.calls == 2
+    assert upstream.get_metrics()[url.split("/")[2]]["hedges"] == 1
+
+
+def test_a_streamed_response_holds_its_slot_until_it_is_closed(fake_upstream, monkeypatch):
+    monkeypatch.setattr(upstream, "_slots", threading.BoundedSemaphore(1))
+    adapter, url = fake_upstream(lambda call: (503, b"") if call == 1 else (200, b"ok"))
+
+    # the slot of the retried error page is released when it is closed
+    response = request("GET", url, stream=True)
+    assert adapter.calls == 2
+    assert not upstream._slots.acquire(blocking=False)
+
+    # closing twice releases the slot once (a bounded semaphore would raise if released too many times)
+    response.close()
+    response.close()
+    assert upstream._slots.acquire(blocking=False)
+    upstream._slots.release()
+
+    # the response is closed after handle, even if handle left it open
+    assert request("GET", url, handle=lambda response: response.content, stream=True) == b"ok"
+    assert upstream._slots.acquire(blocking=False)